@@ -0,0 +1,178 @@
+"""## SQS Archive Source API
+
+Lets the pipeline take resource files straight out of a zip or tar archive (including
+compressed '.tar.gz', '.tgz', '.tar.bz2' and '.tar.xz' files) with the "archive-source"
+and "archive-member" cache options, instead of unpacking the archive by hand first.
+
+Members are streamed out of the archive one at a time, so only the members a resource
+needs are ever written to the scratch directory. Every archive is opened, or downloaded
+for URL archive sources, only once per pipeline run and shared by all resources using
+it. Each worker thread reads members through its own handle on the archive file, so
+members of the same archive can be read in parallel.
+
+Usage:
+
+    archives = ArchiveSet(scratchDirMgr)
+    archive = archives.getArchive("~/textures/set.zip", modConfig)
+    if archive:
+        for name in archive.getMemberNames("*.png"):
+            memberFile = archive.openMember(name)
+    archives.close()
+"""
+
+
+copyright = """SquidSpace.js, the associated tooling, and the documentation are copyright
+Jack William Bell 2020 except where noted. All other content, including HTML files and 3D
+assets, are copyright their respective authors."""
+
+
+import os
+import hashlib
+import tarfile
+import zipfile
+import threading
+from fnmatch import fnmatchcase
+from urllib.parse import urlsplit
+from sqslogger import logger
+from common import getSourceURL, getDestFile, copySourceToDestAndClose
+
+
+def isURLSource(archiveSource):
+    """Returns True if the archive source is an HTTP(S) URL rather than a file path."""
+    return urlsplit(archiveSource).scheme.lower() in ("http", "https")
+
+
+def isMemberPattern(archiveMember):
+    """Returns True if the archive member is a glob pattern rather than a member name."""
+    return any(c in archiveMember for c in "*?[")
+
+
+class Archive(object):
+    """One zip or tar archive source. Safe to use from multiple threads."""
+    def __init__(self, archiveSource):
+        self.source = archiveSource
+        self.path = None
+        self.kind = None # Either "zip" or "tar".
+        self.names = None # Regular file members, in archive order.
+        self.prepared = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.handles = []
+
+    def prepare(self, modConfig, scratchDirMgr):
+        """Downloads the archive if it is a URL, then reads the member list. Only does
+        the work the first time it is called. Returns True on success, otherwise returns
+        False."""
+        with self.lock:
+            if self.prepared:
+                return self.path != None
+            self.prepared = True
+
+            path = os.path.expanduser(self.source)
+            if isURLSource(self.source):
+                # Download to the scratch directory, through the download cache if enabled.
+                sourceFile = getSourceURL(self.source, modConfig.getDownloadCache(), modConfig.getDownloader())
+                if not sourceFile:
+                    logger.error("archivesource.Archive.prepare() - Could not open archive URL '{0}'.".format(self.source))
+                    return False
+                ext = os.path.splitext(urlsplit(self.source).path)[1]
+                path = scratchDirMgr.makeFilePath(hashlib.sha256(self.source.encode("utf-8")).hexdigest() + ext)
+                if not copySourceToDestAndClose(sourceFile, getDestFile(path)):
+                    logger.error("archivesource.Archive.prepare() - Could not download archive '{0}'.".format(self.source))
+                    return False
+
+            try:
+                if zipfile.is_zipfile(path):
+                    with zipfile.ZipFile(path) as zf:
+                        names = [info.filename for info in zf.infolist() if not info.is_dir()]
+                    self.kind = "zip"
+                elif tarfile.is_tarfile(path):
+                    with tarfile.open(path) as tf:
+                        names = [info.name for info in tf.getmembers() if info.isfile()]
+                    self.kind = "tar"
+                else:
+                    logger.error("archivesource.Archive.prepare() - '{0}' is not a zip or tar archive.".format(self.source))
+                    return False
+            except:
+                logger.exception("archivesource.Archive.prepare() - Could not read archive '{0}'.".format(self.source))
+                return False
+
+            self.names = names
+            self.path = path
+            return True
+
+    def getMemberNames(self, archiveMember):
+        """Returns the names of the regular file members matching the archive member,
+        which is either a member name or a glob pattern, sorted by name."""
+        if not isMemberPattern(archiveMember):
+            return [archiveMember] if archiveMember in self.names else []
+        return sorted(name for name in self.names if fnmatchcase(name, archiveMember))
+
+    def getHandle(self):
+        """Returns the calling thread's open ZipFile or TarFile for the archive."""
+        handle = getattr(self.local, "handle", None)
+        if handle is None:
+            if self.kind == "zip":
+                handle = zipfile.ZipFile(self.path)
+            else:
+                handle = tarfile.open(self.path)
+            self.local.handle = handle
+            with self.lock:
+                self.handles.append(handle)
+        return handle
+
+    def openMember(self, name):
+        """Opens and returns a file-like object streaming the member's bytes or None if
+        the member could not be opened.
+
+        NOTE: Read and close the member before opening another one from the same
+        thread; tar members share the thread's archive handle."""
+        try:
+            handle = self.getHandle()
+            if self.kind == "zip":
+                return handle.open(name)
+            return handle.extractfile(name)
+        except:
+            logger.exception("archivesource.Archive.openMember() - Could not open member '{0}' of archive '{1}'.".format(name, self.source))
+
+        # Failed!
+        return None
+
+    def close(self):
+        """Closes every thread's archive handle."""
+        with self.lock:
+            for handle in self.handles:
+                handle.close()
+            self.handles = []
+            self.local = threading.local()
+
+
+class ArchiveSet(object):
+    """The archives used by one pipeline run, so every archive is only opened once.
+    Downloaded archives are kept in the passed scratch directory. Safe to use from
+    multiple threads."""
+    def __init__(self, scratchDirMgr):
+        self.scratchDirMgr = scratchDirMgr
+        self.lock = threading.Lock()
+        self.archives = {}
+
+    def getArchive(self, archiveSource, modConfig):
+        """Returns the prepared Archive for the archive source or None if it could not
+        be opened."""
+        with self.lock:
+            archive = self.archives.get(archiveSource)
+            if archive is None:
+                archive = Archive(archiveSource)
+                self.archives[archiveSource] = archive
+
+        # Prepare outside the set lock, so different archives are prepared in parallel.
+        if archive.prepare(modConfig, self.scratchDirMgr):
+            return archive
+        return None
+
+    def close(self):
+        """Closes all archives. Does not remove the scratch directory."""
+        with self.lock:
+            for archive in self.archives.values():
+                archive.close()
+            self.archives = {}
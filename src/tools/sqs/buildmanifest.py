@@ -0,0 +1,154 @@
+"""## SQS Build Manifest API
+
+A build manifest is a persistent record of the resources the pipeline has already
+built. It is stored as a JSON file in the 'build-dir' and maps each resource output
+file path to a fingerprint of what produced it:
+
+* the SHA-256 digest of the source file bytes
+
+* the resolved filter chain, including all filter options
+
+When the pipeline sees a resource whose fingerprint matches the manifest entry and
+whose output file still exists, the filter chain is skipped.
+
+Example manifest entry:
+
+    "assets/textures/foo.png": {
+        "fingerprint": "5f1c...",
+        "source": "https://example.com/images/foo.jpg",
+        "source-digest": "9a0e...",
+        "filters": [{"filter": "shellexec", "options": {...}}],
+        "outputs": ["assets/textures/foo.png"]
+    }
+
+The "outputs" are the files actually published for the resource, which differ from the
+resource output file path when the filter chain ends with 'branches' with an
+"out-suffix". An entry is only current if all of them exist.
+
+Several pipeline runs can share the manifest. Each run only saves the entries it
+changed, merged into the manifest on disk under a lock on 'pipeline.manifest.json.lock',
+so runs never throw away each other's entries.
+"""
+
+
+copyright = """SquidSpace.js, the associated tooling, and the documentation are copyright
+Jack William Bell 2020 except where noted. All other content, including HTML files and 3D
+assets, are copyright their respective authors."""
+
+
+import os
+import json
+import hashlib
+import threading
+from sqslogger import logger
+from filelock import FileLock, LOCK_FILE_SUFFIX
+
+
+MANIFEST_FILE_NAME = "pipeline.manifest.json"
+
+
+def makeFingerprint(sourceDigest, filters):
+    """Returns a fingerprint string for a source digest and a resolved filter chain.
+    The filter chain is serialized with sorted keys, so option order does not matter."""
+    canonical = json.dumps({"source-digest": sourceDigest, "filters": filters}, sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class BuildManifest(object):
+    """Loads, queries, updates and saves a pipeline build manifest. Safe to use from
+    multiple threads in the same process."""
+    def __init__(self, manifestPath, rebuildAll = False):
+        """Loads the manifest from the passed path, if it exists. If rebuildAll is True
+        no entry is ever considered current, but new entries are still recorded."""
+        self.path = manifestPath
+        self.rebuildAll = rebuildAll
+        self.entries = {}
+        self.changes = {} # Output path to new entry, or None if forgotten, since the last save.
+        self.lock = threading.Lock()
+        self.load()
+
+    def readEntries(self):
+        """Returns the entries in the manifest file. A missing or unreadable manifest 
+        results in no entries, which simply means everything is rebuilt."""
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                return data
+        except:
+            logger.warning("buildmanifest.BuildManifest.readEntries() - Could not load manifest '{0}'; rebuilding everything.".format(self.path))
+        return {}
+
+    def load(self):
+        """Loads the manifest file."""
+        with self.lock:
+            self.entries = self.readEntries()
+            self.changes = {}
+
+    def save(self):
+        """Writes the entries changed since the last save to the manifest file, keeping 
+        entries other runs saved in the meantime. The file is written to a temporary file 
+        and then renamed, so an interrupted save never leaves a truncated manifest. 
+        Returns True on success, otherwise returns False."""
+        tempPath = "{0}.tmp-{1}".format(self.path, os.getpid())
+        try:
+            dirPath = os.path.dirname(self.path)
+            if dirPath: os.makedirs(dirPath, exist_ok=True)
+            with FileLock(self.path + LOCK_FILE_SUFFIX), self.lock:
+                entries = self.readEntries()
+                for outputPath, entry in self.changes.items():
+                    if entry is None:
+                        entries.pop(outputPath, None)
+                    else:
+                        entries[outputPath] = entry
+                with open(tempPath, 'w') as f:
+                    json.dump(entries, f, indent=1, sort_keys=True)
+                os.replace(tempPath, self.path)
+                self.entries = entries
+                self.changes = {}
+            return True
+        except:
+            logger.exception("buildmanifest.BuildManifest.save() - Could not save manifest '{0}'.".format(self.path))
+
+        return False
+
+    def getOutputs(self, outputPath):
+        """Returns the list of files published for the output path, or None if it has 
+        no entry. Entries without "outputs" published only the output path itself."""
+        with self.lock:
+            entry = self.entries.get(outputPath)
+        if entry is None:
+            return None
+        return entry.get("outputs") or [outputPath]
+
+    def isCurrent(self, outputPath, fingerprint):
+        """Returns True if the manifest entry for the output path has the passed
+        fingerprint and its published files still exist, otherwise returns False."""
+        if self.rebuildAll or not fingerprint:
+            return False
+        with self.lock:
+            entry = self.entries.get(outputPath)
+        return (entry is not None and entry.get("fingerprint") == fingerprint and 
+                all(os.path.isfile(filePath) for filePath in self.getOutputs(outputPath)))
+
+    def record(self, outputPath, fingerprint, source, sourceDigest, filters, outputs = None):
+        """Records a successfully built output, with the list of files published for it,
+        if they are not just the output path."""
+        with self.lock:
+            self.entries[outputPath] = {
+                "fingerprint": fingerprint,
+                "source": source,
+                "source-digest": sourceDigest,
+                "filters": filters
+            }
+            if outputs:
+                self.entries[outputPath]["outputs"] = sorted(outputs)
+            self.changes[outputPath] = self.entries[outputPath]
+
+    def forget(self, outputPath):
+        """Removes the entry for the output path, if any, so it is rebuilt next time."""
+        with self.lock:
+            self.entries.pop(outputPath, None)
+            self.changes[outputPath] = None
@@ -0,0 +1,298 @@
+"""## SQS Command Runner API
+
+Runs the shell commands used by filters, with an optional timeout, and keeps a per-run
+report of how expensive each command is.
+
+Every command is started in its own process group, so when a command runs longer than
+its timeout the whole group is killed: the shell and anything it started, such as the
+commands of a pipe. Because the commands are not in the terminal's process group they
+don't get SIGINT when the user presses Ctrl-C, so a command being waited for when
+KeyboardInterrupt is raised is killed, and cancelCommands() kills every running command
+for code which is interrupted while other threads are waiting for commands.
+
+For every command the wall time, CPU time (user plus system, including any processes the
+command waited for) and peak resident set size are recorded from os.wait4(). The numbers
+are added up per command label, normally the command template, so all the runs of one
+filter are reported together. On systems without os.wait4() only the wall time is
+recorded.
+
+At the end of a run the report is logged and written to 'command-report.json' in the
+'build-dir', slowest commands first:
+
+    {
+        "commands": [
+            {"command": "convert {pathIn} -resize 50% {pathOut}", "runs": 12, "failures": 0,
+             "timeouts": 0, "wall-time": 8.41, "max-wall-time": 1.02, "cpu-time": 7.93,
+             "peak-rss": 104857600}
+        ]
+    }
+
+Times are in seconds and "peak-rss" is in bytes, or null when it is not known.
+
+Usage:
+
+    if runCommand("gzip -9 < in.txt > out.gz", "gzip -9", 60):
+        ...
+    getCommandStats().logReport()
+"""
+
+
+copyright = """SquidSpace.js, the associated tooling, and the documentation are copyright
+Jack William Bell 2020 except where noted. All other content, including HTML files and 3D
+assets, are copyright their respective authors."""
+
+
+import os
+import sys
+import json
+import time
+import atexit
+import signal
+import threading
+import subprocess
+from sqslogger import logger
+
+
+COMMAND_REPORT_FILE_NAME = "command-report.json"
+
+# The number of commands listed when the report is logged.
+REPORT_LOG_LIMIT = 10
+
+
+class CommandStats(object):
+    """Adds up the cost of commands by command label. Safe to use from multiple threads."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forgets all recorded commands, for a new run."""
+        with self.lock:
+            self.commands = {}
+
+    def record(self, label, status, wallTime, cpuTime, peakRSS):
+        """Records one run of a command. The status is "ok", "failed" or "timeout"; the
+        CPU time and peak RSS may be None when they are not known."""
+        with self.lock:
+            entry = self.commands.get(label)
+            if entry is None:
+                entry = {"command": label, "runs": 0, "failures": 0, "timeouts": 0,
+                        "wall-time": 0.0, "max-wall-time": 0.0, "cpu-time": None, "peak-rss": None}
+                self.commands[label] = entry
+            entry["runs"] = entry["runs"] + 1
+            if status == "failed":
+                entry["failures"] = entry["failures"] + 1
+            elif status == "timeout":
+                entry["timeouts"] = entry["timeouts"] + 1
+            entry["wall-time"] = entry["wall-time"] + wallTime
+            entry["max-wall-time"] = max(entry["max-wall-time"], wallTime)
+            if cpuTime is not None:
+                entry["cpu-time"] = (entry["cpu-time"] or 0.0) + cpuTime
+            if peakRSS is not None:
+                entry["peak-rss"] = max(entry["peak-rss"] or 0, peakRSS)
+
+    def getReport(self):
+        """Returns a list of the recorded command entries, highest total wall time first."""
+        with self.lock:
+            entries = [dict(entry) for entry in self.commands.values()]
+        return sorted(entries, key=lambda entry: entry["wall-time"], reverse=True)
+
+    def logReport(self):
+        """Logs the most expensive commands, if any commands were run."""
+        report = self.getReport()
+        if not report:
+            return
+        logger.info("commandrunner.CommandStats.logReport() - {0} commands run {1} times, slowest first:".format(
+                len(report), sum(entry["runs"] for entry in report)))
+        for entry in report[:REPORT_LOG_LIMIT]:
+            logger.info("    {wall:9.2f}s wall {cpu} CPU {rss} peak RSS {runs} runs {failures} failed {timeouts} timed out: {command}".format(
+                    wall=entry["wall-time"], runs=entry["runs"], failures=entry["failures"], timeouts=entry["timeouts"],
+                    cpu="-" if entry["cpu-time"] is None else "{0:.2f}s".format(entry["cpu-time"]),
+                    rss="-" if entry["peak-rss"] is None else "{0:.1f}MiB".format(entry["peak-rss"] / 1048576),
+                    command=entry["command"]))
+
+    def writeReport(self, reportPath):
+        """Writes the report to a JSON file, if any commands were run. Returns True on
+        success or when there is nothing to write, otherwise returns False."""
+        report = self.getReport()
+        if not report:
+            return True
+        # Unique to the process, as other runs may write the file at the same time.
+        tempPath = "{0}.tmp-{1}".format(reportPath, os.getpid())
+        try:
+            dirPath = os.path.dirname(reportPath)
+            if dirPath: os.makedirs(dirPath, exist_ok=True)
+            with open(tempPath, 'w') as f:
+                json.dump({"commands": report}, f, indent=1)
+            os.replace(tempPath, reportPath)
+            return True
+        except:
+            logger.exception("commandrunner.CommandStats.writeReport() - Could not write command report '{0}'.".format(reportPath))
+
+        return False
+
+
+sharedCommandStats = CommandStats()
+
+
+def getCommandStats():
+    """Returns the CommandStats shared by every caller in the process."""
+    return sharedCommandStats
+
+
+# Commands started and not yet waited for.
+runningProcs = set()
+runningProcsLock = threading.Lock()
+
+# Seconds between checks for a finished command where os.waitid() is missing.
+REAP_POLL_INTERVAL = 0.01
+
+
+def startCommand(command, stdin = None, stdout = None):
+    """Starts a shell command in a new process group and returns its subprocess.Popen.
+    Raises OSError if the command could not be started. Every started command must be
+    passed to waitCommand()."""
+    proc = subprocess.Popen(command, shell=True, stdin=stdin, stdout=stdout, start_new_session=True)
+    # Held while killing the command and while reaping it, so a kill never targets a 
+    # process ID which was reaped, and may have been reused.
+    proc.reapLock = threading.Lock()
+    with runningProcsLock:
+        runningProcs.add(proc)
+    return proc
+
+
+def killCommand(proc):
+    """Kills a started command and every process in its process group, unless it has
+    already been waited for."""
+    with proc.reapLock:
+        if proc.returncode is not None:
+            return
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except OSError:
+            pass # Already gone.
+
+
+def waitStatusToExitCode(status):
+    """Returns the exit code for a wait status, like subprocess: the exit status, or the
+    negative signal number if the process was killed by a signal."""
+    if hasattr(os, "waitstatus_to_exitcode"):
+        return os.waitstatus_to_exitcode(status)
+
+    # Python 3.8 and older.
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    raise ValueError("Invalid wait status: {0}".format(status))
+
+
+def reapCommand(proc):
+    """Waits for a started command to exit and sets its return code. Returns its 
+    resource usage, or None where os.wait4() is missing.
+    
+    NOTE: The command is only reaped while holding its reap lock, after it has exited,
+    so killCommand() never sees a reaped command without a return code."""
+    if not hasattr(os, "wait4"):
+        proc.wait()
+        return None
+    
+    if hasattr(os, "waitid"):
+        # Wait for the exit without reaping; the exited process keeps its ID until reaped.
+        os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+    while True:
+        with proc.reapLock:
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            if pid:
+                proc.returncode = waitStatusToExitCode(status)
+                return rusage
+        time.sleep(REAP_POLL_INTERVAL)
+
+
+def cancelCommands():
+    """Kills every running command. Threads waiting for them see them fail."""
+    with runningProcsLock:
+        procs = list(runningProcs)
+    for proc in procs:
+        killCommand(proc)
+
+
+def waitCommand(proc, command, label, startTime, deadline, logger = logger):
+    """Waits for a command started with startCommand() at startTime, killing its process
+    group if it is still running at deadline, a time.monotonic() value or None for no
+    limit. Records the command under the label and logs any failure. Returns True if the
+    command results in a return code of zero, otherwise returns False."""
+    timedOut = threading.Event()
+    timer = None
+    if deadline is not None:
+        def expire():
+            timedOut.set()
+            killCommand(proc)
+        timer = threading.Timer(max(0.0, deadline - time.monotonic()), expire)
+        timer.daemon = True
+        timer.start()
+
+    rusage = None
+    try:
+        rusage = reapCommand(proc)
+    except KeyboardInterrupt:
+        killCommand(proc)
+        proc.wait()
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+        with runningProcsLock:
+            runningProcs.discard(proc)
+    wallTime = time.monotonic() - startTime
+
+    retcode = proc.returncode
+    if timedOut.is_set():
+        status = "timeout"
+        logger.error("commandrunner.waitCommand() - Command '{0}' did not finish in time and was killed.".format(command))
+    elif retcode < 0:
+        status = "failed"
+        logger.error("commandrunner.waitCommand() - Command '{0}' was terminated by a signal. Return code: {1}.".format(
+                command, -retcode))
+    elif retcode != 0:
+        status = "failed"
+        logger.error("commandrunner.waitCommand() - Command '{0}' resulted in a non-zero return code. Return code: {1}.".format(
+                command, retcode))
+    else:
+        status = "ok"
+
+    cpuTime = None
+    peakRSS = None
+    if rusage is not None:
+        cpuTime = rusage.ru_utime + rusage.ru_stime
+        # Linux reports kilobytes, macOS reports bytes.
+        peakRSS = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    getCommandStats().record(label or command, status, wallTime, cpuTime, peakRSS)
+
+    return status == "ok"
+
+
+def runCommand(command, label = None, timeout = None, logger = logger, stdin = None, stdout = None):
+    """Runs a shell command, killing it if it runs longer than timeout seconds, unless
+    timeout is None. The command is recorded under the label, which defaults to the
+    command. Returns True if the command results in a return code of zero, otherwise
+    logs the problem and returns False."""
+    startTime = time.monotonic()
+    try:
+        proc = startCommand(command, stdin, stdout)
+    except OSError:
+        logger.exception("commandrunner.runCommand() - Command '{0}' failed with an exception.".format(command))
+        return False
+
+    return waitCommand(proc, command, label, startTime, None if timeout is None else startTime + timeout, logger)
+
+
+def isValidTimeout(timeout):
+    """Returns True if timeout is None or a positive number of seconds."""
+    return timeout is None or (isinstance(timeout, (int, float)) and not isinstance(timeout, bool) and timeout > 0)
+
+
+atexit.register(cancelCommands)
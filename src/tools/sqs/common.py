@@ -6,10 +6,22 @@ Shared code used by all SQS tools and APIs.
 # TODO: Refactor to pass the logger in as an argument to all functions?
 
 from enum import Enum
+import io
 import os 
+import queue
+import atexit
 import shutil
-import urllib.request
+import hashlib
+import tempfile
+import itertools
+import threading
 from sqslogger import logger
+from downloader import getSharedDownloader
+from downloadcache import DownloadCache
+from stepcache import getSharedStepCache
+from filterregistry import getSharedFilterRegistry
+from filelock import FileLock, LOCK_FILE_SUFFIX, LOCKING_SUPPORTED
+from copyengine import copyStream, copyFile, removeFile, LINK_MODE_COPY, LINK_MODE_HARDLINK, LINK_MODE_AUTO, LINK_MODES
 
 class ResourceFlavor(Enum):
     """Enumeration of supported resource types."""
@@ -26,6 +38,17 @@ class ResourceAction(Enum):
     LINK = 2
     
         
+# Default for the "memory-threshold" configuration value: the most bytes a filter chain
+# keeps in memory between in-memory filters before spilling to the scratch directory.
+DEFAULT_MEMORY_THRESHOLD = 64 * 1024 * 1024
+
+# Memory backed file system used for scratch directories with "scratch-tmpfs".
+TMPFS_DIR = "/dev/shm"
+
+# Prefix of scratch directories renamed aside to be deleted in the background.
+SCRATCH_TRASH_PREFIX = ".trash-"
+
+
 class ModuleConfiguration(object):
     """Contains a module configuration."""
     def __init__(self, defaultConfigData, moduleConfigData):
@@ -42,6 +65,14 @@ class ModuleConfiguration(object):
         self.modDir = "assets/mods/"
         self.filterProfiles = {}
         self.autoLoad = False;
+        self.downloadCache = True
+        self.downloadOptions = {}
+        self.memoryThreshold = DEFAULT_MEMORY_THRESHOLD
+        self.filterJobs = 1
+        self.stepCacheSize = 0
+        self.filterDirs = []
+        self.scratchTmpfs = False
+        self.linkMode = LINK_MODE_COPY
         
         # TODO: make sure the 'dir' values are proper paths with a trailing slash and/or
         # use Python dir functions to generate full path. 
@@ -69,6 +100,22 @@ class ModuleConfiguration(object):
                 self.filterProfiles.update(defaultConfigData["filter-profiles"])    
             if "autoload" in defaultConfigData:
                 self.autoLoad = defaultConfigData["autoload"]   
+            if "download-cache" in defaultConfigData:
+                self.downloadCache = defaultConfigData["download-cache"]
+            if "download-options" in defaultConfigData:
+                self.downloadOptions.update(defaultConfigData["download-options"])
+            if "memory-threshold" in defaultConfigData:
+                self.memoryThreshold = defaultConfigData["memory-threshold"]
+            if "filter-jobs" in defaultConfigData:
+                self.filterJobs = defaultConfigData["filter-jobs"]
+            if "step-cache-size" in defaultConfigData:
+                self.stepCacheSize = defaultConfigData["step-cache-size"]
+            if "filter-dirs" in defaultConfigData:
+                self.filterDirs = self.filterDirs + list(defaultConfigData["filter-dirs"])
+            if "scratch-tmpfs" in defaultConfigData:
+                self.scratchTmpfs = defaultConfigData["scratch-tmpfs"]
+            if "link-mode" in defaultConfigData:
+                self.linkMode = defaultConfigData["link-mode"]
         
         # Override with values from passed module configuration, if any.
         if isinstance(moduleConfigData, dict):
@@ -93,6 +140,26 @@ class ModuleConfiguration(object):
                 self.filterProfiles.update(moduleConfigData["filter-profiles"])   
             if "autoload" in moduleConfigData:
                 self.autoLoad = moduleConfigData["autoload"]   
+            if "download-cache" in moduleConfigData:
+                self.downloadCache = moduleConfigData["download-cache"]
+            if "download-options" in moduleConfigData:
+                self.downloadOptions.update(moduleConfigData["download-options"])
+            if "memory-threshold" in moduleConfigData:
+                self.memoryThreshold = moduleConfigData["memory-threshold"]
+            if "filter-jobs" in moduleConfigData:
+                self.filterJobs = moduleConfigData["filter-jobs"]
+            if "step-cache-size" in moduleConfigData:
+                self.stepCacheSize = moduleConfigData["step-cache-size"]
+            if "filter-dirs" in moduleConfigData:
+                self.filterDirs = self.filterDirs + list(moduleConfigData["filter-dirs"])
+            if "scratch-tmpfs" in moduleConfigData:
+                self.scratchTmpfs = moduleConfigData["scratch-tmpfs"]
+            if "link-mode" in moduleConfigData:
+                self.linkMode = moduleConfigData["link-mode"]
+    
+        if not self.linkMode in LINK_MODES:
+            logger.warning("common.ModuleConfiguration() - Unknown 'link-mode' value '{0}', using '{1}'.".format(self.linkMode, LINK_MODE_COPY))
+            self.linkMode = LINK_MODE_COPY
     
     def getResourcePath(self, resourceFlavor):
         """Returns a resource path based on the resource flavor or None."""
@@ -130,7 +197,200 @@ class ModuleConfiguration(object):
         return None
     
     def getScratchDirManager(self):
-        return ScratchDirManager(os.path.join(self.bldDir, "scratch/"))
+        """Returns a ScratchDirManager for a new scratch directory no other process or 
+        caller uses. See makeProcessScratchDirManager()."""
+        return makeProcessScratchDirManager(self.getScratchBaseDir())
+    
+    def getScratchBaseDir(self):
+        """Returns the directory holding the scratch directories: 'scratch' in the build 
+        directory, or a directory on the memory backed file system if "scratch-tmpfs" is 
+        set and there is one."""
+        if self.scratchTmpfs:
+            if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK) and hasattr(os, "getuid"):
+                return os.path.join(TMPFS_DIR, "sqs-scratch-{0}".format(os.getuid()))
+            logger.warning("common.ModuleConfiguration.getScratchBaseDir() - '{0}' is not available, using the build directory.".format(TMPFS_DIR))
+        return os.path.join(self.bldDir, "scratch")
+    
+    def getDownloadCache(self):
+        """Returns a DownloadCache for 'url-source' downloads in the build directory or 
+        None if the download cache is turned off."""
+        if self.downloadCache:
+            return DownloadCache(os.path.join(self.bldDir, "cache/downloads/"), self.getDownloader())
+        return None
+    
+    def getStepCache(self):
+        """Returns the StepCache for filter step results in the build directory or None 
+        if the step cache is turned off."""
+        if self.stepCacheSize > 0:
+            return getSharedStepCache(os.path.join(self.bldDir, "cache/steps/"), self.stepCacheSize)
+        return None
+    
+    def addFilterDirs(self):
+        """Adds the "filter-dirs" plug-in filter directories to the shared filter 
+        registry, using the filter index in the build directory."""
+        getSharedFilterRegistry().addFilterDirs(self.filterDirs, os.path.join(self.bldDir, "cache/filters.json"))
+    
+    def getDownloader(self):
+        """Returns the shared Downloader for the "download-options" configuration."""
+        return getSharedDownloader(self.downloadOptions)
+
+
+class BackgroundDeleter(object):
+    """Deletes directory trees on a background thread, so callers don't wait for them."""
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+    
+    def delete(self, path):
+        """Queues a directory tree to be deleted."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="sqs-deleter", daemon=True)
+                self.thread.start()
+        self.queue.put(path)
+    
+    def run(self):
+        while True:
+            path = self.queue.get()
+            try:
+                shutil.rmtree(path, ignore_errors=True)
+            finally:
+                self.queue.task_done()
+    
+    def wait(self):
+        """Waits until every queued directory tree is deleted."""
+        self.queue.join()
+
+
+sharedDeleter = BackgroundDeleter()
+
+# Deletes are finished before the process exits, so no trash is left behind.
+atexit.register(sharedDeleter.wait)
+
+
+def getSharedBackgroundDeleter():
+    """Returns the BackgroundDeleter shared by every caller in the process."""
+    return sharedDeleter
+
+
+trashCounter = itertools.count(1)
+
+
+def discardDir(dirPath):
+    """Removes a directory right away by renaming it aside, next to itself, and deletes 
+    the renamed directory in the background. Falls back to deleting it in place if it 
+    can't be renamed. Does nothing if there is no directory."""
+    dirPath = os.path.normpath(dirPath)
+    trashPath = os.path.join(os.path.dirname(dirPath), "{0}{1}-{2}-{3}".format(
+            SCRATCH_TRASH_PREFIX, os.getpid(), next(trashCounter), os.path.basename(dirPath)))
+    try:
+        os.rename(dirPath, trashPath)
+    except FileNotFoundError:
+        return
+    except OSError:
+        shutil.rmtree(dirPath, ignore_errors=True)
+        return
+    
+    getSharedBackgroundDeleter().delete(trashPath)
+
+
+def getScratchDirOwner(dirName):
+    """Returns the process ID which created a scratch directory or scratch trash 
+    directory in a scratch base directory, from its name, or None if the name is not one 
+    of ours."""
+    if dirName.startswith(SCRATCH_TRASH_PREFIX):
+        dirName = dirName[len(SCRATCH_TRASH_PREFIX):]
+    pid = dirName.split("-", 1)[0]
+    if pid.isdigit() and "-" in dirName:
+        return int(pid)
+    return None
+
+
+def isProcessRunning(pid):
+    """Returns True if a process with the ID is running on this machine."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass # Running, but owned by someone else.
+    return True
+
+
+def getScratchLockPath(baseDir, pid):
+    """Returns the path of the lock file a process holds while it uses scratch 
+    directories in a scratch base directory."""
+    return os.path.join(baseDir, "{0}{1}".format(pid, LOCK_FILE_SUFFIX))
+
+
+# This process's scratch locks, by scratch base directory. Held until the process exits.
+scratchLocks = {}
+scratchLocksLock = threading.Lock()
+
+
+def lockProcessScratch(baseDir):
+    """Takes this process's scratch lock in a scratch base directory, if it doesn't 
+    already hold it. The lock is held, and its lock file kept, until the process exits, 
+    so other processes know its scratch directories are in use."""
+    lockPath = getScratchLockPath(baseDir, os.getpid())
+    with scratchLocksLock:
+        if lockPath not in scratchLocks:
+            lock = FileLock(lockPath)
+            lock.acquire()
+            scratchLocks[lockPath] = lock
+            atexit.register(lock.release, True)
+
+
+def pruneScratchDirs(baseDir):
+    """Deletes, in the background, the scratch directories in a scratch base directory 
+    left behind by processes which are no longer running, and their lock files. A 
+    process is known to be gone when no one holds its scratch lock, so it works across 
+    machines and containers sharing the directory, and when process IDs are reused. Where
+    locking isn't supported, the process ID is checked instead."""
+    try:
+        names = os.listdir(baseDir)
+    except OSError:
+        return
+    ownedNames = {}
+    for name in names:
+        pid = getScratchDirOwner(name)
+        if pid is None and name.endswith(LOCK_FILE_SUFFIX) and name[:-len(LOCK_FILE_SUFFIX)].isdigit():
+            # Just a lock file.
+            ownedNames.setdefault(int(name[:-len(LOCK_FILE_SUFFIX)]), [])
+        elif pid is not None:
+            ownedNames.setdefault(pid, []).append(name)
+    
+    for pid, pidNames in ownedNames.items():
+        if pid == os.getpid():
+            continue
+        lock = FileLock(getScratchLockPath(baseDir, pid))
+        try:
+            if not lock.acquire(blocking=False):
+                continue # Still in use.
+        except OSError:
+            logger.exception("common.pruneScratchDirs() - Could not lock '{0}'.".format(lock.path))
+            continue
+        try:
+            if not LOCKING_SUPPORTED and isProcessRunning(pid):
+                continue
+            for name in pidNames:
+                logger.debug("common.pruneScratchDirs() - Removing stale scratch directory '{0}'.".format(name))
+                getSharedBackgroundDeleter().delete(os.path.join(baseDir, name))
+        finally:
+            lock.release(remove=True)
+
+
+def makeProcessScratchDirManager(baseDir):
+    """Returns a ScratchDirManager for a new, uniquely named scratch directory in the base
+    directory, named after the process ID, so any number of processes and callers can 
+    share the base directory. The process holds a lock in the base directory while it 
+    runs, and stale scratch directories of processes which are no longer running are 
+    removed. See pruneScratchDirs()."""
+    os.makedirs(baseDir, exist_ok=True)
+    lockProcessScratch(baseDir)
+    pruneScratchDirs(baseDir)
+    return ScratchDirManager(tempfile.mkdtemp(prefix="{0}-".format(os.getpid()), dir=baseDir))
 
 
 class ScratchDirManager(object):
@@ -140,8 +400,11 @@ class ScratchDirManager(object):
         exist it is created. If the directory exists, it is cleared; deleting all
         files in the directory.
         
-        WARNING: Two processes using the same temp directory name at the same time will
-                 result in undefined, but almost certainly bad, behavior.
+        WARNING: Two callers using the same scratch directory path at the same time will
+                 result in undefined, but almost certainly bad, behavior. Use 
+                 makeProcessScratchDirManager() or ModuleConfiguration.getScratchDirManager() 
+                 for a directory no one else uses, and makeSubScratchDirManager() with 
+                 different names for each worker.
         
         NOTE: The Python tempfile library doesn't create file names that can be passed
               to functions opening those files, only file-like objects. Also it doesn't 
@@ -153,31 +416,29 @@ class ScratchDirManager(object):
         
     def create(self):
         """Creates the scratch directory if it doesn't exist, otherwise it clears it."""
-        # TODO: This is kind of a brute-force method. Might want to revisit it.
         self.remove()
         os.makedirs(self.path)
         self.ctr = 0;
         
     def remove(self):
-        """Clears the scratch directory and removes it."""
-        try:
-            shutil.rmtree(self.path)
-        except:
-            pass
+        """Removes the scratch directory. The directory is renamed aside, so it is gone 
+        right away however many files it holds, and deleted in the background."""
+        discardDir(self.path)
         
     def clear(self):
         """Clears the scratch directory."""
-        # TODO: This is kind of a brute-force method. Might want to revisit it.
         self.create()
     
     def listFiles(self, subDirName = None):
-        """Returns a list of files paths in the scratch directory. May return an empty 
+        """Returns a list of files paths in the scratch directory, sorted by name, so 
+        filter chains see their inputs in the same order every run. May return an empty 
         list if the directory could not be listed. You can optionally specify a sub 
         directory name of the scratch directory to list."""
+        result = []
         path = self.path
         if (subDirName): path = os.path.join(path, subDirName)
         try: 
-            result = [os.path.join(path, f) for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
+            result = [os.path.join(path, f) for f in sorted(os.listdir(path)) if os.path.isfile(os.path.join(path, f))]
         except:
             pass
         
@@ -188,7 +449,8 @@ class ScratchDirManager(object):
         list if the directory could not be listed."""
         result = []
         try: 
-            result = [os.path.join(path, f) for f in os.listdir(self.path) if not os.path.isfile(os.path.join(self.path, f))]
+            result = [os.path.join(self.path, f) for f in os.listdir(self.path) 
+                    if not f.startswith(SCRATCH_TRASH_PREFIX) and not os.path.isfile(os.path.join(self.path, f))]
         except:
             pass
         
@@ -248,6 +510,16 @@ def makeOutputFilesFuncForDir(dirPath):
     return outputFilesFunc
 
     
+def makeOutputBuffersFunc(buffers):
+    """Returns an 'outputs()' function, such as those used by the in-memory filters, 
+    which stores the data for a file name in the passed dictionary. Writing the same 
+    file name twice replaces the earlier data, just like writing a file would."""
+    def outputBuffersFunc(fileName, data):
+        buffers[os.path.basename(fileName)] = bytes(data)
+    
+    return outputBuffersFunc
+
+
 def forceFileExtension(filePath, exToUse):
     """Forces the passed file path to have the passed extension."""
     if not exToUse.startswith("."): exToUse = "." + exToUse
@@ -255,14 +527,23 @@ def forceFileExtension(filePath, exToUse):
     return root + exToUse
     
 
-def getSourceURL(urlSource): 
+def getSourceURL(urlSource, downloadCache = None, downloader = None): 
     """Opens and returns a file-like object from the fully qualified url contained 
     in the url source or None if no url source was specified or the file url not be 
-    opened."""
+    opened. If a download cache is passed, the URL is opened through the cache, which
+    only downloads the file again if it changed. Otherwise the URL is opened with the
+    passed downloader or the shared default downloader."""
     if urlSource != None and len(urlSource) > 0:
+        if downloadCache:
+            return downloadCache.open(urlSource)
+        if not downloader:
+            downloader = getSharedDownloader()
         try:
-            sf = urllib.request.urlopen(urlSource)
-            return sf
+            sf = downloader.open(urlSource)
+            if sf.status == 200:
+                return sf
+            logger.error("common.getSourceURL() - Could not open URL '{0}'. HTTP status: {1}.".format(urlSource, sf.status))
+            sf.close()
         except:
             logger.exception("common.getSourceURL() - Could not open URL '{0}'.".format(urlSource))
 
@@ -290,7 +571,8 @@ def getDestFile(fileDest):
     """Opens and returns the file with the path contained in the file destination or 
     None if no file destination was specified or the file could not be opened.
     
-    NOTE: File is opened in 'wb' (write/binary) mode."""
+    NOTE: File is opened in 'wb' (write/binary) mode. Used for scratch files; output 
+          files are written through the shared Publisher. See Publisher.openFile()."""
     if fileDest: # PYTHON TIP: both None and an empty string evaluates to 'False'
         try:
             sf = open(fileDest, 'wb')
@@ -308,41 +590,322 @@ def copySourceToDestAndClose(sourceFile, destFile):
     returns False.
     
     NOTE: Requires minimal memory because it doesn't read and write all of the source at one time.
+          When both are files on disk the kernel copies the data. See copyengine.py.
     
     NOTE: Assumes both files were opened with the same text or binary mode. May still work otherwise."""
     # Assume failure.
     result = False
     
     try:
-        # Prime the pump
-        chunk = sourceFile.read(4096) # Read 4kb at a time.
-        
         # Write the data.
-        while chunk: # PYTHON TIP: an empty string or binary object evaluates to 'False'
-            destFile.write(chunk)
-            chunk = sourceFile.read(4096) # Get next 4kb.
+        copyStream(sourceFile, destFile)
             
         # We are good!
         result = True
     except:
         logger.exception("common.copySourceToDest() - Copy failed with exception.")
     finally:
-        # Close the files.
+        # Close the files. A published file isn't published unless the copy worked.
         try: 
             sourceFile.close()
         except:
             pass
         try: 
-            destFile.close()
+            if not result and isinstance(destFile, PublishedFile):
+                destFile.discard()
+            else:
+                destFile.close()
         except:
             pass
+        if isinstance(destFile, PublishedFile) and not destFile.published:
+            result = False
             
     # Done!
     return result
 
-def copyFileToDir(inFilePath, outDirPath):
-    return copySourceToDestAndClose(getSourceFile(inFilePath), 
-            getDestFile(os.path.join(outDirPath, os.path.basename(inFilePath))))
+def copyFileToPath(inFilePath, outFilePath, linkMode = LINK_MODE_COPY, allowHardlink = True):
+    """Copies or links a file to the output path, replacing any file there, as the link 
+    mode allows. See copyengine.copyFile(). Returns True on success, otherwise returns 
+    False."""
+    try:
+        copyFile(inFilePath, outFilePath, linkMode, allowHardlink)
+        return True
+    except:
+        logger.exception("common.copyFileToPath() - Could not copy '{0}' to '{1}'.".format(inFilePath, outFilePath))
+    
+    return False
+
+
+def copyFileToDir(inFilePath, outDirPath, linkMode = LINK_MODE_COPY, allowHardlink = True):
+    """Copies or links a file to the output directory, keeping its name. See 
+    copyFileToPath()."""
+    return copyFileToPath(inFilePath, os.path.join(outDirPath, os.path.basename(inFilePath)), linkMode, allowHardlink)
+
+
+publishTempCounter = itertools.count(1)
+
+
+def makePublishTempPath(destPath):
+    """Returns a temporary file path in the same directory as the destination path, 
+    unique to the current process and call. Files are written to the temporary path
+    and then renamed to the destination path."""
+    destDir, destName = os.path.split(destPath)
+    return os.path.join(destDir, ".{0}.sqs-tmp-{1}-{2}".format(destName, os.getpid(), next(publishTempCounter)))
+
+
+def isHardLinked(filePath):
+    """Returns True if the file exists and has more than one name, i.e. hard links."""
+    try:
+        return os.stat(filePath).st_nlink > 1
+    except OSError:
+        return False
+
+
+def isSameFileContent(filePathA, filePathB):
+    """Returns True if both files exist and hold the same bytes, comparing their sizes 
+    and then their SHA-256 digests."""
+    try:
+        statA = os.stat(filePathA)
+        statB = os.stat(filePathB)
+    except OSError:
+        return False
+    if os.path.samestat(statA, statB):
+        return True
+    if statA.st_size != statB.st_size:
+        return False
+    digest = hashFile(filePathA)
+    return digest is not None and digest == hashFile(filePathB)
+
+
+class PublishedFile(io.BufferedWriter):
+    """A binary file opened for writing by a Publisher. Data is written to a temporary 
+    file next to the destination, which is published when the file is closed. Call 
+    discard() instead of close() to throw the data away; leaving a 'with' block with an
+    exception does the same. After closing, 'published' is True if the destination now 
+    holds the data."""
+    def __init__(self, publisher, destPath):
+        self.publisher = publisher
+        self.destPath = destPath
+        self.tempPath = makePublishTempPath(destPath)
+        self.discarded = False
+        self.published = False
+        super().__init__(io.FileIO(self.tempPath, 'wb'))
+    
+    def discard(self):
+        self.discarded = True
+        self.close()
+    
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            if self.discarded:
+                removeFile(self.tempPath)
+            else:
+                self.published = self.publisher.commit(self.tempPath, self.destPath)
+    
+    def __del__(self):
+        # Never publish a file which was dropped without being closed.
+        try:
+            if not self.closed:
+                self.discard()
+        except ValueError:
+            pass # The temporary file could not be created.
+    
+    def __exit__(self, excType, excValue, traceback):
+        if excType is not None:
+            self.discarded = True
+        self.close()
+
+
+class PublishedTextFile(io.TextIOWrapper):
+    """A PublishedFile wrapped for writing text. Like PublishedFile, the data is thrown
+    away by discard(), by leaving a 'with' block with an exception, or by dropping the 
+    file without closing it."""
+    def discard(self):
+        self.buffer.discarded = True
+        self.close()
+    
+    def __del__(self):
+        # Never publish a file which was dropped without being closed.
+        try:
+            if not self.closed:
+                self.discard()
+        except ValueError:
+            pass
+    
+    def __exit__(self, excType, excValue, traceback):
+        if excType is not None:
+            self.buffer.discarded = True
+        self.close()
+
+
+class Publisher(object):
+    """Publishes output files atomically and only when their bytes change. A new file 
+    is written to a temporary file in the destination directory, compared with the 
+    existing destination file, and renamed over it only if they differ. So readers see 
+    either the old file or the complete new file, never a partially written one, and an
+    unchanged output keeps its modified time, which keeps browser caches, rsync and other 
+    incremental tools from seeing a change. Counts the files changed and unchanged. Safe 
+    to use from multiple threads, and from multiple processes publishing to the same 
+    directories, which take turns comparing and replacing files."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """Resets the counts, for a new run."""
+        with self.lock:
+            self.changed = 0
+            self.unchanged = 0
+    
+    def countFile(self, changed):
+        with self.lock:
+            if changed:
+                self.changed = self.changed + 1
+            else:
+                self.unchanged = self.unchanged + 1
+    
+    def getCounts(self):
+        """Returns a tuple of (files changed, files unchanged) since the last reset."""
+        with self.lock:
+            return (self.changed, self.unchanged)
+    
+    def logSummary(self, caller):
+        """Logs the counts, if any files were published."""
+        changed, unchanged = self.getCounts()
+        if changed or unchanged:
+            logger.info("{0} - {1} output files changed, {2} unchanged.".format(caller, changed, unchanged))
+    
+    def lockDestination(self, destPath):
+        """Returns a FileLock on the destination directory, held while comparing and 
+        replacing a destination file, so processes publishing to the same directory take
+        turns."""
+        return FileLock(os.path.dirname(destPath) or ".")
+    
+    def commit(self, tempPath, destPath, keepHardLinks = True):
+        """Replaces the destination with the temporary file, unless they hold the same 
+        bytes, and removes the temporary file. If keepHardLinks is False a destination 
+        which is a hard link is replaced anyway. Returns True on success, otherwise 
+        returns False."""
+        try:
+            with self.lockDestination(destPath):
+                if isSameFileContent(tempPath, destPath) and (keepHardLinks or not isHardLinked(destPath)):
+                    removeFile(tempPath)
+                    self.countFile(False)
+                    return True
+                os.replace(tempPath, destPath)
+                # Renaming a hard link over another link to the same file does nothing.
+                removeFile(tempPath)
+            self.countFile(True)
+            return True
+        except:
+            logger.exception("common.Publisher.commit() - Could not rename '{0}' to '{1}'.".format(tempPath, destPath))
+        
+        # Failed! Don't leave the temporary file behind.
+        try:
+            removeFile(tempPath)
+        except:
+            pass
+        
+        return False
+    
+    def openFile(self, destPath, text = False):
+        """Opens a PublishedFile for writing the destination path, or a PublishedTextFile
+        for writing text if text is True. The destination is published when the file is 
+        closed. Raises OSError if the file can't be created."""
+        publishedFile = PublishedFile(self, destPath)
+        if text:
+            return PublishedTextFile(publishedFile)
+        return publishedFile
+    
+    def publishBytes(self, data, destPath):
+        """Publishes bytes to the destination path. Returns True on success, otherwise 
+        returns False."""
+        try:
+            with self.openFile(destPath) as f:
+                f.write(data)
+            return f.published
+        except:
+            logger.exception("common.Publisher.publishBytes() - Could not write '{0}'.".format(destPath))
+        
+        return False
+    
+    def publishFile(self, sourcePath, destPath, linkMode = LINK_MODE_COPY, move = False):
+        """Publishes a copy of the source file to the destination path, creating the 
+        destination directory if needed. The copy may be a link, as the link mode allows; 
+        published files are never written to in place, so hard links are safe. If move 
+        is True the source file is renamed to the destination instead, where possible. 
+        Returns True on success, otherwise returns False."""
+        destDir = os.path.dirname(destPath)
+        try:
+            if destDir: os.makedirs(destDir, exist_ok=True)
+        except:
+            logger.exception("common.Publisher.publishFile() - Could not create directory '{0}'.".format(destDir))
+            return False
+        
+        # Nothing to do if the destination already has the same bytes, unless it is a 
+        # hard link, e.g. from an earlier run, which the link mode doesn't allow.
+        keepHardLinks = linkMode in (LINK_MODE_HARDLINK, LINK_MODE_AUTO)
+        if isSameFileContent(sourcePath, destPath) and (keepHardLinks or not isHardLinked(destPath)):
+            self.countFile(False)
+            return True
+        
+        if move:
+            try:
+                with self.lockDestination(destPath):
+                    os.replace(sourcePath, destPath)
+                self.countFile(True)
+                return True
+            except OSError:
+                pass # E.g. on different file systems; copy it instead.
+        
+        # Copy before taking the lock, then check again; another process may have 
+        # published the same bytes in the meantime.
+        tempPath = makePublishTempPath(destPath)
+        if not copyFileToPath(sourcePath, tempPath, linkMode):
+            logger.error("common.Publisher.publishFile() - Could not copy '{0}' to '{1}'.".format(sourcePath, tempPath))
+            try:
+                removeFile(tempPath)
+            except:
+                pass
+            return False
+        
+        return self.commit(tempPath, destPath, keepHardLinks)
+
+
+sharedPublisher = Publisher()
+
+
+def getSharedPublisher():
+    """Returns the Publisher shared by every caller in the process."""
+    return sharedPublisher
+
+
+def publishFile(sourcePath, destPath, linkMode = LINK_MODE_COPY):
+    """Atomically publishes a copy of the source file to the destination path with the 
+    shared Publisher, leaving the destination alone if it already has the same bytes. 
+    See Publisher.publishFile(). Returns True on success, otherwise returns False."""
+    return getSharedPublisher().publishFile(sourcePath, destPath, linkMode)
+
+
+def hashFile(filePath):
+    """Returns the SHA-256 hex digest of the file contents or None if the file could
+    not be read."""
+    h = hashlib.sha256()
+    try:
+        with open(filePath, 'rb') as f:
+            chunk = f.read(1024 * 1024)
+            while chunk:
+                h.update(chunk)
+                chunk = f.read(1024 * 1024)
+    except:
+        logger.exception("common.hashFile() - Could not read file '{0}'.".format(filePath))
+        return None
+
+    return h.hexdigest()
 
 
 def lookAheadIterator(iterable):
@@ -0,0 +1,244 @@
+"""## SQS Copy Engine API
+
+Copies data between file-like objects as fast as the two ends allow. Used by every tool
+which copies whole files or streams, such as common.copySourceToDestAndClose() and the
+'merge' filter.
+
+When both ends are regular files on disk the data is copied by the kernel without passing
+through Python, with os.copy_file_range() (which may also share blocks on file systems
+supporting it) or, where that doesn't work, such as between file systems on some
+kernels, with os.sendfile(). Anything else, such as URL responses, archive members and
+pipes, is copied through a large buffer with readinto(), reusing one buffer per thread so
+no memory is allocated per chunk.
+
+The file positions of both ends are respected and left just past the copied data, so
+copies can be mixed with normal reads and writes, e.g. writing a separator between merged
+files.
+
+Whole files can also be 'copied' without moving any data, depending on the link mode:
+
+* "copy" – always copy the data
+
+* "reflink" – clone the file, where the file system supports it (such as Btrfs and XFS), 
+  so both files share their data blocks until one of them is changed, when the changed
+  blocks are copied; safe for any use of either file
+
+* "hardlink" – make a second name for the same file, where both paths are on the same
+  file system; changing one file in place changes the other, so only used where the 
+  caller says no tool writes to the files afterwards
+
+* "auto" – a clone, else a hard link where allowed, else a copy
+
+Each mode falls back to copying the data when linking doesn't work. The destination file
+is always removed first, never written through, so an earlier hard link to it is not 
+changed.
+
+Usage:
+
+    with open("in.babylon", 'rb') as sourceFile, open("out.babylon", 'wb') as destFile:
+        copyStream(sourceFile, destFile)
+
+    copyFile("in.babylon", "out.babylon", LINK_MODE_AUTO)
+"""
+
+
+copyright = """SquidSpace.js, the associated tooling, and the documentation are copyright
+Jack William Bell 2020 except where noted. All other content, including HTML files and 3D
+assets, are copyright their respective authors."""
+
+
+import io
+import os
+import sys
+import stat
+import errno
+import threading
+try:
+    import fcntl
+except ImportError:
+    # Windows.
+    fcntl = None
+
+
+# Size of the per-thread buffer used when the data can't be copied by the kernel.
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Most bytes the kernel is asked to copy in one call.
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Errors meaning the kernel can't copy between these files, so the next method is tried.
+FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP,
+        errno.EBADF, errno.EPERM, errno.ENOTSOCK}
+
+# Only Linux can sendfile() to a file; elsewhere the destination must be a socket.
+SENDFILE_TO_FILES = sys.platform.startswith("linux")
+
+LINK_MODE_COPY = "copy"
+LINK_MODE_REFLINK = "reflink"
+LINK_MODE_HARDLINK = "hardlink"
+LINK_MODE_AUTO = "auto"
+LINK_MODES = (LINK_MODE_COPY, LINK_MODE_REFLINK, LINK_MODE_HARDLINK, LINK_MODE_AUTO)
+
+# Linux ioctl making the destination file share the source file's data blocks.
+FICLONE = 0x40049409
+
+
+def getRegularFileDescriptor(fileObject):
+    """Returns the file descriptor of a binary file object open on a regular file, or None
+    for anything else."""
+    if isinstance(fileObject, io.TextIOBase):
+        return None
+    try:
+        fd = fileObject.fileno()
+        if stat.S_ISREG(os.fstat(fd).st_mode) and fileObject.seekable():
+            return fd
+    except (AttributeError, OSError, ValueError):
+        pass
+    return None
+
+
+def copyFileRange(sourceFd, destFd, sourceOffset, destOffset):
+    """Copies with os.copy_file_range() and returns the number of bytes copied, 0 at the
+    end of the source."""
+    return os.copy_file_range(sourceFd, destFd, COPY_CHUNK_SIZE, sourceOffset, destOffset)
+
+
+def sendFile(sourceFd, destFd, sourceOffset, destOffset):
+    """Copies with os.sendfile() and returns the number of bytes copied, 0 at the end of
+    the source."""
+    os.lseek(destFd, destOffset, os.SEEK_SET)
+    return os.sendfile(destFd, sourceFd, sourceOffset, COPY_CHUNK_SIZE)
+
+
+def getKernelCopyFuncs():
+    """Returns the list of kernel copy functions this system has, best first."""
+    result = []
+    if hasattr(os, "copy_file_range"):
+        result.append(copyFileRange)
+    if hasattr(os, "sendfile") and SENDFILE_TO_FILES:
+        result.append(sendFile)
+    return result
+
+
+def copyWithKernel(sourceFile, destFile):
+    """Copies from the source file to the destination file with the kernel, if both are
+    regular files and the kernel can. Returns a tuple of (bytes copied, done); when done
+    is False the rest of the source must be copied another way."""
+    sourceFd = getRegularFileDescriptor(sourceFile)
+    destFd = getRegularFileDescriptor(destFile)
+    if sourceFd is None or destFd is None:
+        return (0, False)
+
+    # Copy from the file objects' positions, not the descriptors', which may differ
+    # because of buffering.
+    destFile.flush()
+    sourceOffset = sourceFile.tell()
+    destOffset = destFile.tell()
+    copied = 0
+    try:
+        for copyFunc in getKernelCopyFuncs():
+            try:
+                while True:
+                    count = copyFunc(sourceFd, destFd, sourceOffset + copied, destOffset + copied)
+                    if count == 0:
+                        return (copied, True)
+                    copied = copied + count
+            except OSError as e:
+                if e.errno not in FALLBACK_ERRNOS:
+                    raise
+    finally:
+        sourceFile.seek(sourceOffset + copied)
+        destFile.seek(destOffset + copied)
+
+    return (copied, False)
+
+
+bufferCache = threading.local()
+
+
+def getCopyBuffer():
+    """Returns a memoryview of this thread's copy buffer."""
+    buffer = getattr(bufferCache, "buffer", None)
+    if buffer is None:
+        buffer = memoryview(bytearray(COPY_BUFFER_SIZE))
+        bufferCache.buffer = buffer
+    return buffer
+
+
+def copyBuffered(sourceFile, destFile):
+    """Copies the rest of the source file-like object to the destination file-like object
+    through the thread's copy buffer. Returns the number of bytes copied."""
+    copied = 0
+    readinto = getattr(sourceFile, "readinto", None)
+    if readinto is None or isinstance(sourceFile, io.TextIOBase):
+        # Only read() is supported.
+        chunk = sourceFile.read(COPY_BUFFER_SIZE)
+        while chunk:
+            destFile.write(chunk)
+            copied = copied + len(chunk)
+            chunk = sourceFile.read(COPY_BUFFER_SIZE)
+        return copied
+
+    buffer = getCopyBuffer()
+    count = readinto(buffer)
+    while count:
+        destFile.write(buffer[:count])
+        copied = copied + count
+        count = readinto(buffer)
+
+    return copied
+
+
+def copyStream(sourceFile, destFile, kernelCopy = True):
+    """Copies everything from the current position of the source file-like object to the
+    destination file-like object and returns the number of bytes copied. If kernelCopy is
+    False the data always goes through the copy buffer. Raises OSError on failure."""
+    copied = 0
+    if kernelCopy:
+        copied, done = copyWithKernel(sourceFile, destFile)
+        if done:
+            return copied
+
+    return copied + copyBuffered(sourceFile, destFile)
+
+
+def removeFile(filePath):
+    """Removes a file, if there is one."""
+    try:
+        os.remove(filePath)
+    except FileNotFoundError:
+        pass
+
+
+def cloneFile(sourcePath, destPath):
+    """Makes the destination file a clone of the source file sharing its data blocks. 
+    Returns True on success, otherwise removes any destination file and returns False."""
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    try:
+        with open(sourcePath, 'rb') as sourceFile, open(destPath, 'wb') as destFile:
+            fcntl.ioctl(destFile.fileno(), FICLONE, sourceFile.fileno())
+        return True
+    except OSError:
+        removeFile(destPath)
+    return False
+
+
+def copyFile(sourcePath, destPath, linkMode = LINK_MODE_COPY, allowHardlink = True):
+    """Copies or links the source file to the destination path, replacing any file 
+    there, using the link mode. Hard links are only made if allowHardlink is True. 
+    Returns the way the file was copied, one of "reflink", "hardlink" or "copy". Raises 
+    OSError on failure."""
+    removeFile(destPath)
+    if linkMode in (LINK_MODE_REFLINK, LINK_MODE_AUTO) and cloneFile(sourcePath, destPath):
+        return LINK_MODE_REFLINK
+    if linkMode in (LINK_MODE_HARDLINK, LINK_MODE_AUTO) and allowHardlink:
+        try:
+            os.link(sourcePath, destPath)
+            return LINK_MODE_HARDLINK
+        except OSError:
+            pass # E.g. on different file systems.
+
+    with open(sourcePath, 'rb') as sourceFile, open(destPath, 'wb') as destFile:
+        copyStream(sourceFile, destFile)
+    return LINK_MODE_COPY
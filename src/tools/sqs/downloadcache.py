@@ -0,0 +1,408 @@
+"""## SQS Download Cache API
+
+An on-disk cache for 'url-source' downloads. Each cached URL is stored as two files
+in the cache directory, both named with the SHA-256 digest of the URL:
+
+* '<digest>.data' – The downloaded bytes
+
+* '<digest>.json' – The URL plus the 'ETag' and 'Last-Modified' response headers
+
+When a URL is already cached, the next request is sent as a conditional request with
+'If-None-Match' and/or 'If-Modified-Since' headers. If the server answers '304 Not
+Modified' the cached bytes are used, so a no-change run costs one small round trip per
+asset. If the server cannot be reached at all, the cached copy is used with a warning.
+
+Downloads go through a Downloader, so they share pooled keep-alive connections and
+per-host limits. See downloader.py.
+
+Large downloads are resumable. When the server advertises 'Accept-Ranges: bytes' and
+sends a validator ('ETag' or 'Last-Modified') and a 'Content-Length', the body is
+written to '<digest>.part' and the byte ranges already written are tracked in
+'<digest>.part.json'. If the transfer is interrupted, the next attempt (in the same run
+or a later one) sends 'Range' and 'If-Range' requests for the missing bytes only. If
+the file changed on the server in the meantime, the server sends the whole file again
+and the partial download is discarded.
+
+Files at least twice the downloader 'segment-size' are split into up to 'max-segments'
+byte ranges which are downloaded in parallel.
+
+Several processes can share the cache directory. Each URL is fetched under a lock on
+'<digest>.lock', so only one process or thread downloads it at a time and the others
+use the result. See filelock.py.
+
+Usage:
+
+    cache = DownloadCache("build/cache/downloads/")
+    sourceFile = cache.open("https://example.com/images/foo.jpg")
+"""
+
+
+copyright = """SquidSpace.js, the associated tooling, and the documentation are copyright
+Jack William Bell 2020 except where noted. All other content, including HTML files and 3D
+assets, are copyright their respective authors."""
+
+
+import os
+import json
+import hashlib
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from sqslogger import logger
+from downloader import DownloadError, getSharedDownloader
+from filelock import FileLock, LOCK_FILE_SUFFIX
+
+
+CHECKPOINT_SIZE = 8 * 1024 * 1024
+
+
+keyLocks = {}
+keyLocksLock = threading.Lock()
+
+
+def getKeyLock(key):
+    """Returns the lock serializing downloads of one cache key within the process."""
+    with keyLocksLock:
+        lock = keyLocks.get(key)
+        if lock is None:
+            lock = threading.Lock()
+            keyLocks[key] = lock
+        return lock
+
+
+def parseContentRangeStart(contentRange):
+    """Returns the first byte position from a 'Content-Range' header value or None."""
+    try:
+        unit, rangeSpec = contentRange.split(" ", 1)
+        if unit.lower() == "bytes":
+            return int(rangeSpec.split("-", 1)[0])
+    except (AttributeError, ValueError):
+        pass
+    return None
+
+
+class DownloadCache(object):
+    """Manages a directory of cached URL downloads."""
+    def __init__(self, cacheDirPath, downloader = None):
+        """Sets up the cache for the passed directory path. The directory is created
+        when the first file is cached. If no downloader is passed the shared default
+        downloader is used."""
+        self.path = cacheDirPath
+        self.downloader = downloader or getSharedDownloader()
+
+    def makeKey(self, url):
+        """Returns the cache key for a URL."""
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def makeDataPath(self, key):
+        """Returns the path of the cached data file for a key."""
+        return os.path.join(self.path, key + ".data")
+
+    def makeMetaPath(self, key):
+        """Returns the path of the cached metadata file for a key."""
+        return os.path.join(self.path, key + ".json")
+
+    def makePartPath(self, key):
+        """Returns the path of the partial download file for a key."""
+        return os.path.join(self.path, key + ".part")
+
+    def makePartMetaPath(self, key):
+        """Returns the path of the partial download metadata file for a key."""
+        return os.path.join(self.path, key + ".part.json")
+
+    def makeLockPath(self, key):
+        """Returns the path of the lock file for a key, locked while fetching it."""
+        return os.path.join(self.path, key + LOCK_FILE_SUFFIX)
+
+    def makeTempPath(self, filePath):
+        """Returns a temporary file path next to the passed file path which is unique to
+        the current process and thread."""
+        return "{0}.tmp-{1}-{2}".format(filePath, os.getpid(), threading.get_ident())
+
+    def loadMeta(self, key):
+        """Returns the metadata dictionary for a key or None if the URL is not cached."""
+        try:
+            if os.path.isfile(self.makeDataPath(key)):
+                with open(self.makeMetaPath(key), 'r') as f:
+                    return json.load(f)
+        except:
+            logger.warning("downloadcache.DownloadCache.loadMeta() - Ignoring unreadable cache entry '{0}'.".format(key))
+
+        return None
+
+    def loadPartMeta(self, key):
+        """Returns the partial download metadata dictionary for a key or None if there
+        is no usable partial download."""
+        try:
+            if os.path.isfile(self.makePartPath(key)):
+                with open(self.makePartMetaPath(key), 'r') as f:
+                    part = json.load(f)
+                if part.get("etag") or part.get("last-modified"):
+                    return part
+        except:
+            logger.warning("downloadcache.DownloadCache.loadPartMeta() - Ignoring unreadable partial download '{0}'.".format(key))
+
+        return None
+
+    def savePartMeta(self, key, part):
+        """Writes the partial download metadata for a key."""
+        metaPath = self.makePartMetaPath(key)
+        tempPath = self.makeTempPath(metaPath)
+        with part["lock"]:
+            with open(tempPath, 'w') as f:
+                json.dump({k: v for k, v in part.items() if k != "lock"}, f)
+            os.replace(tempPath, metaPath)
+
+    def removePart(self, key):
+        """Deletes the partial download files for a key, if any."""
+        for path in (self.makePartPath(key), self.makePartMetaPath(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def makeRanges(self, length):
+        """Splits a file length into a list of [start, end, written] byte ranges, one per
+        parallel segment. The end position is exclusive."""
+        if length <= 0:
+            return [[0, 0, 0]]
+        segments = 1
+        segmentSize = self.downloader.segmentSize
+        if self.downloader.maxSegments > 1 and segmentSize > 0 and length >= 2 * segmentSize:
+            segments = min(self.downloader.maxSegments, length // segmentSize)
+        step = -(-length // segments) # PYTHON TIP: Negated floor division of a negated value rounds up.
+        return [[start, min(start + step, length), 0] for start in range(0, length, step)]
+
+    def makeRequestHeaders(self, meta):
+        """Returns the conditional request headers for cached metadata."""
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last-modified"):
+                headers["If-Modified-Since"] = meta["last-modified"]
+
+        return headers
+
+    def store(self, url, key, response):
+        """Writes the body and validators of a response to the cache. Returns True on
+        success, otherwise returns False."""
+        dataPath = self.makeDataPath(key)
+        metaPath = self.makeMetaPath(key)
+        tempDataPath = self.makeTempPath(dataPath)
+        tempMetaPath = self.makeTempPath(metaPath)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(tempDataPath, 'wb') as f:
+                chunk = response.read(1024 * 1024)
+                while chunk:
+                    f.write(chunk)
+                    chunk = response.read(1024 * 1024)
+            with open(tempMetaPath, 'w') as f:
+                json.dump({
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last-modified": response.headers.get("Last-Modified")
+                }, f)
+            # Data first, so the metadata never describes bytes we don't have.
+            os.replace(tempDataPath, dataPath)
+            os.replace(tempMetaPath, metaPath)
+            return True
+        except:
+            logger.exception("downloadcache.DownloadCache.store() - Could not cache URL '{0}'.".format(url))
+            for tempPath in (tempDataPath, tempMetaPath):
+                try:
+                    os.remove(tempPath)
+                except:
+                    pass
+
+        return False
+
+    def writeRange(self, key, part, byteRange, response):
+        """Writes a response body to the partial download file at the range position,
+        updating the written count of the range and saving the metadata every
+        CHECKPOINT_SIZE bytes. Raises an exception if the transfer is interrupted."""
+        start, end, written = byteRange
+        sinceCheckpoint = 0
+        with open(self.makePartPath(key), 'r+b') as f:
+            f.seek(start + written)
+            chunk = response.read(min(1024 * 1024, end - start - byteRange[2]))
+            while chunk:
+                f.write(chunk)
+                byteRange[2] = byteRange[2] + len(chunk)
+                sinceCheckpoint = sinceCheckpoint + len(chunk)
+                if sinceCheckpoint >= CHECKPOINT_SIZE:
+                    f.flush()
+                    self.savePartMeta(key, part)
+                    sinceCheckpoint = 0
+                if byteRange[2] >= end - start:
+                    break
+                chunk = response.read(min(1024 * 1024, end - start - byteRange[2]))
+        if byteRange[2] < end - start:
+            raise http.client.IncompleteRead(b"", end - start - byteRange[2])
+
+    def fetchRange(self, url, key, part, byteRange):
+        """Requests the missing bytes of one range. Returns False if the server ignored
+        the range request, which means the file changed, otherwise returns True. Raises
+        an exception if the transfer failed."""
+        start, end, written = byteRange
+        headers = {
+            "Range": "bytes={0}-{1}".format(start + written, end - 1),
+            "If-Range": part.get("etag") or part.get("last-modified")
+        }
+        with self.downloader.open(url, headers, compress=False) as response:
+            if response.status != 206 or parseContentRangeStart(response.headers.get("Content-Range")) != start + written:
+                if response.status not in (200, 206, 416):
+                    raise DownloadError("Range request for '{0}' returned status {1}.".format(url, response.status))
+                return False
+            self.writeRange(key, part, byteRange, response)
+        return True
+
+    def fetchRanges(self, url, key, part):
+        """Downloads every incomplete range of a partial download, in parallel if there
+        is more than one. Returns False if the partial download must be discarded,
+        otherwise returns True. Raises DownloadError if the transfer was interrupted;
+        the progress made so far is kept for the next attempt."""
+        incomplete = [r for r in part["ranges"] if r[2] < r[1] - r[0]]
+        try:
+            if len(incomplete) <= 1:
+                return all(self.fetchRange(url, key, part, r) for r in incomplete)
+            with ThreadPoolExecutor(max_workers=len(incomplete)) as executor:
+                futures = [executor.submit(self.fetchRange, url, key, part, r) for r in incomplete]
+                results = [future.result() for future in futures]
+            return all(results)
+        except (OSError, http.client.HTTPException) as e:
+            raise DownloadError("Download of '{0}' was interrupted: {1}".format(url, e))
+        finally:
+            self.savePartMeta(key, part)
+
+    def finishPart(self, url, key, part):
+        """Moves a complete partial download into the cache. Returns True on success,
+        otherwise returns False."""
+        if any(r[2] < r[1] - r[0] for r in part["ranges"]):
+            logger.error("downloadcache.DownloadCache.finishPart() - Download of '{0}' is incomplete.".format(url))
+            return False
+        metaPath = self.makeMetaPath(key)
+        tempMetaPath = self.makeTempPath(metaPath)
+        with open(tempMetaPath, 'w') as f:
+            json.dump({"url": url, "etag": part.get("etag"), "last-modified": part.get("last-modified")}, f)
+        os.replace(self.makePartPath(key), self.makeDataPath(key))
+        os.replace(tempMetaPath, metaPath)
+        self.removePart(key)
+        return True
+
+    def storeResumable(self, url, key, response):
+        """Writes a '200 OK' response to the cache through a resumable partial download
+        if the server supports it, otherwise falls back to store(). Returns True on
+        success, False on failure. Raises DownloadError if the transfer was
+        interrupted."""
+        headers = response.headers
+        try:
+            length = int(headers.get("Content-Length"))
+        except (TypeError, ValueError):
+            length = None
+        resumable = ((headers.get("Accept-Ranges") or "").lower() == "bytes" and length is not None and
+                (headers.get("ETag") or headers.get("Last-Modified")) and not headers.get("Content-Encoding"))
+        if not resumable:
+            return self.store(url, key, response)
+
+        part = {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last-modified": headers.get("Last-Modified"),
+            "length": length,
+            "ranges": self.makeRanges(length),
+            "lock": threading.Lock()
+        }
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.makePartPath(key), 'wb') as f:
+            f.truncate(length)
+        self.savePartMeta(key, part)
+
+        if len(part["ranges"]) > 1:
+            # Large file. Drop this response and fetch the segments in parallel instead.
+            logger.debug("downloadcache.DownloadCache.storeResumable() - Downloading '{0}' in {1} segments.".format(url, len(part["ranges"])))
+            response.close()
+            if not self.fetchRanges(url, key, part):
+                return False
+        else:
+            try:
+                self.writeRange(key, part, part["ranges"][0], response)
+            except (OSError, http.client.HTTPException) as e:
+                raise DownloadError("Download of '{0}' was interrupted: {1}".format(url, e))
+            finally:
+                self.savePartMeta(key, part)
+
+        return self.finishPart(url, key, part)
+
+    def fetch(self, url, key):
+        """Makes sure the cache holds the current contents of the URL. Returns True if
+        the cached data file can be used, otherwise returns False."""
+        meta = self.loadMeta(key)
+        attempts = self.downloader.retries + 1
+
+        for attempt in range(attempts):
+            try:
+                # Resume a partial download?
+                part = self.loadPartMeta(key)
+                if part:
+                    part["lock"] = threading.Lock()
+                    logger.debug("downloadcache.DownloadCache.fetch() - Resuming download of '{0}'.".format(url))
+                    if self.fetchRanges(url, key, part):
+                        return self.finishPart(url, key, part)
+                    # The file changed on the server. Start over.
+                    logger.debug("downloadcache.DownloadCache.fetch() - '{0}' changed, restarting download.".format(url))
+                    self.removePart(key)
+
+                with self.downloader.open(url, self.makeRequestHeaders(meta)) as response:
+                    if response.status == 304 and meta:
+                        logger.debug("downloadcache.DownloadCache.fetch() - Not modified, using cached '{0}'.".format(url))
+                        return True
+                    elif response.status == 200:
+                        if not self.storeResumable(url, key, response):
+                            return False
+                        logger.debug("downloadcache.DownloadCache.fetch() - Downloaded '{0}'.".format(url))
+                        return True
+                    logger.error("downloadcache.DownloadCache.fetch() - Could not open URL '{0}'. HTTP status: {1}.".format(url, response.status))
+                    return False
+            except DownloadError as e:
+                if attempt + 1 < attempts and self.loadPartMeta(key):
+                    logger.warning("downloadcache.DownloadCache.fetch() - {0} Resuming.".format(e))
+                    continue
+                if meta:
+                    logger.warning("downloadcache.DownloadCache.fetch() - Could not reach URL '{0}', using cached copy.".format(url))
+                    return True
+                logger.exception("downloadcache.DownloadCache.fetch() - Could not open URL '{0}'.".format(url))
+                return False
+            except:
+                logger.exception("downloadcache.DownloadCache.fetch() - Could not cache URL '{0}'.".format(url))
+                return False
+
+        return False
+
+    def open(self, url):
+        """Returns a file-like object with the current contents of the URL, downloading
+        it only if the server reports it changed since it was cached, or None if the URL
+        could not be opened.
+
+        NOTE: The returned file is opened in 'rb' (read/binary) mode."""
+        key = self.makeKey(url)
+
+        # Other threads wait on the key lock, other processes on the lock file.
+        with getKeyLock(key):
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                with FileLock(self.makeLockPath(key)):
+                    fetched = self.fetch(url, key)
+            except OSError:
+                logger.exception("downloadcache.DownloadCache.open() - Could not lock cache for URL '{0}'.".format(url))
+                return None
+            if not fetched:
+                return None
+
+        try:
+            return open(self.makeDataPath(key), 'rb')
+        except:
+            logger.exception("downloadcache.DownloadCache.open() - Could not open cached file for URL '{0}'.".format(url))
+
+        return None
@@ -0,0 +1,336 @@
+"""## SQS Downloader API
+
+A thread-safe HTTP(S) downloader used for all 'url-source' fetching. Compared to
+opening every URL with urllib it provides:
+
+* persistent keep-alive connections, pooled per host
+
+* a per-host concurrency cap, so a worker pool can't flood one server
+
+* 'Accept-Encoding: gzip' for text assets, transparently decompressed
+
+* retry with exponential backoff on transient errors, including the HTTP status
+  codes 429, 500, 502, 503 and 504
+
+* redirect following
+
+Downloader options, set with the "download-options" configuration value:
+
+* "max-per-host" [optional, integer, default 4] Maximum concurrent requests per host
+
+* "retries" [optional, integer, default 3] Number of retries after a transient error
+
+* "backoff" [optional, number, default 0.5] Seconds to wait before the first retry;
+  doubled for every retry after that
+
+* "timeout" [optional, number, default 60] Socket timeout in seconds
+
+* "max-segments" [optional, integer, default 4] Maximum number of byte ranges a large
+  cached download is split into and downloaded in parallel; 1 turns segmenting off
+
+* "segment-size" [optional, integer, default 33554432 (32 MB)] Minimum size in bytes of
+  one segment; only files at least twice this size are segmented
+
+Usage:
+
+    downloader = getSharedDownloader(options)
+    with downloader.open("https://example.com/models/foo.babylon") as response:
+        if response.status == 200:
+            data = response.read()
+
+NOTE: The downloader returns responses for all final HTTP status codes, including
+errors. It only raises an exception (DownloadError) when the server could not be
+reached or kept failing after all retries.
+"""
+
+
+copyright = """SquidSpace.js, the associated tooling, and the documentation are copyright
+Jack William Bell 2020 except where noted. All other content, including HTML files and 3D
+assets, are copyright their respective authors."""
+
+
+import os
+import json
+import time
+import zlib
+import threading
+import http.client
+from urllib.parse import urlsplit, urljoin
+from sqslogger import logger
+
+
+USER_AGENT = "SquidSpace.js-sqs"
+
+TEXT_EXTENSIONS = (".babylon", ".json", ".js", ".txt", ".obj", ".mtl", ".gltf", ".svg",
+        ".html", ".css", ".csv", ".xml", ".glsl", ".fx")
+
+TRANSIENT_STATUS_CODES = (429, 500, 502, 503, 504)
+
+REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+
+MAX_REDIRECTS = 5
+
+MAX_RETRY_AFTER = 30
+
+
+class DownloadError(Exception):
+    """Raised when a URL could not be downloaded."""
+    pass
+
+
+def isTextURL(url):
+    """Returns True if the URL path has a file extension for a text asset that is
+    worth requesting with compression."""
+    ext = os.path.splitext(urlsplit(url).path)[1].lower()
+    return ext in TEXT_EXTENSIONS
+
+
+class HostPool(object):
+    """Idle keep-alive connections and a concurrency cap for one host."""
+    def __init__(self, maxConnections):
+        self.semaphore = threading.BoundedSemaphore(maxConnections)
+        self.lock = threading.Lock()
+        self.idle = []
+
+
+class DownloadResponse(object):
+    """A file-like HTTP response. Closing the response returns the connection to the
+    pool for reuse, if the body was read completely, and releases the host slot."""
+    def __init__(self, downloader, hostKey, conn, response, url):
+        self.downloader = downloader
+        self.hostKey = hostKey
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.headers = response.headers
+        self.closed = False
+        self.eof = False
+        self.buffer = bytearray()
+        self.decompressor = None
+        if (response.headers.get("Content-Encoding") or "").lower() == "gzip":
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def read(self, amt = -1):
+        """Reads up to amt bytes of the (decompressed) body. Reads everything if amt is
+        negative or None."""
+        if amt is None: amt = -1
+        if self.decompressor is None:
+            if amt < 0:
+                return self.response.read()
+            return self.response.read(amt)
+
+        self.fillBuffer(amt)
+        if amt < 0 or amt >= len(self.buffer):
+            data = bytes(self.buffer)
+            self.buffer.clear()
+        else:
+            data = bytes(self.buffer[:amt])
+            del self.buffer[:amt]
+
+        return data
+
+    def readinto(self, b):
+        """Reads up to len(b) bytes of the (decompressed) body into the writable buffer b
+        and returns the number of bytes read, 0 at the end of the body."""
+        if self.decompressor is None:
+            return self.response.readinto(b)
+
+        view = memoryview(b).cast("B")
+        self.fillBuffer(len(view))
+        count = min(len(view), len(self.buffer))
+        view[:count] = self.buffer[:count]
+        del self.buffer[:count]
+        return count
+
+    def fillBuffer(self, amt):
+        """Decompresses the body into the buffer until it holds at least amt bytes or the
+        body ends. Fills it with the whole body if amt is negative."""
+        while (amt < 0 or len(self.buffer) < amt) and not self.eof:
+            raw = self.response.read(64 * 1024)
+            if raw:
+                self.buffer += self.decompressor.decompress(raw)
+            else:
+                self.buffer += self.decompressor.flush()
+                self.eof = True
+
+    def close(self):
+        """Closes the response. Safe to call more than once."""
+        if self.closed:
+            return
+        self.closed = True
+        reusable = self.response.isclosed() and not self.response.will_close
+        if not reusable:
+            self.response.close()
+        self.downloader.releaseConnection(self.hostKey, self.conn, reusable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+class Downloader(object):
+    """Downloads URLs using pooled keep-alive connections. Safe to share between
+    threads."""
+    def __init__(self, maxPerHost = 4, retries = 3, backoff = 0.5, timeout = 60, 
+            maxSegments = 4, segmentSize = 32 * 1024 * 1024):
+        """Sets up the downloader. The maxSegments and segmentSize arguments are used by
+        callers that split large downloads into parallel byte ranges; see 
+        downloadcache.py."""
+        self.maxPerHost = max(1, maxPerHost)
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.timeout = timeout
+        self.maxSegments = max(1, maxSegments)
+        self.segmentSize = segmentSize
+        self.lock = threading.Lock()
+        self.pools = {}
+
+    def getHostPool(self, hostKey):
+        """Returns the HostPool for a (scheme, host, port) key, creating it if needed."""
+        with self.lock:
+            pool = self.pools.get(hostKey)
+            if pool is None:
+                pool = HostPool(self.maxPerHost)
+                self.pools[hostKey] = pool
+            return pool
+
+    def acquireConnection(self, hostKey):
+        """Waits for a free slot for the host and returns a (connection, reused) tuple.
+        The connection is an idle keep-alive connection if one is available."""
+        pool = self.getHostPool(hostKey)
+        pool.semaphore.acquire()
+        with pool.lock:
+            if pool.idle:
+                return (pool.idle.pop(), True)
+        scheme, host, port = hostKey
+        if scheme == "https":
+            return (http.client.HTTPSConnection(host, port, timeout=self.timeout), False)
+        return (http.client.HTTPConnection(host, port, timeout=self.timeout), False)
+
+    def releaseConnection(self, hostKey, conn, reusable):
+        """Returns a connection to the idle pool, or closes it, and frees the host slot."""
+        pool = self.getHostPool(hostKey)
+        if reusable:
+            with pool.lock:
+                pool.idle.append(conn)
+        else:
+            conn.close()
+        pool.semaphore.release()
+
+    def close(self):
+        """Closes all idle connections."""
+        with self.lock:
+            pools = list(self.pools.values())
+        for pool in pools:
+            with pool.lock:
+                for conn in pool.idle:
+                    conn.close()
+                pool.idle = []
+
+    def makeRetryDelay(self, attempt, response = None):
+        """Returns the seconds to wait before a retry, honoring a numeric 'Retry-After'
+        response header."""
+        delay = self.backoff * (2 ** attempt)
+        if response is not None:
+            try:
+                delay = max(delay, min(float(response.headers.get("Retry-After")), MAX_RETRY_AFTER))
+            except (TypeError, ValueError):
+                pass
+        return delay
+
+    def request(self, url, headers):
+        """Sends one GET request and returns a DownloadResponse. Retries transient
+        errors. Raises DownloadError once the retries are used up."""
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https") or not parts.hostname:
+            raise DownloadError("Unsupported URL '{0}'.".format(url))
+        port = parts.port or (443 if scheme == "https" else 80)
+        hostKey = (scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path = path + "?" + parts.query
+
+        attempt = 0
+        while True:
+            conn, reused = self.acquireConnection(hostKey)
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                self.releaseConnection(hostKey, conn, False)
+                if reused:
+                    # The server probably closed an idle keep-alive connection. Try
+                    # again right away with a fresh one.
+                    continue
+                if attempt >= self.retries:
+                    raise DownloadError("Could not download '{0}': {1}".format(url, e))
+                delay = self.makeRetryDelay(attempt)
+                logger.warning("downloader.Downloader.request() - Request for '{0}' failed ({1}), retrying in {2:.1f}s.".format(url, e, delay))
+                attempt = attempt + 1
+                time.sleep(delay)
+                continue
+
+            result = DownloadResponse(self, hostKey, conn, response, url)
+            if response.status in TRANSIENT_STATUS_CODES and attempt < self.retries:
+                delay = self.makeRetryDelay(attempt, response)
+                result.read()
+                result.close()
+                logger.warning("downloader.Downloader.request() - Request for '{0}' returned status {1}, retrying in {2:.1f}s.".format(url, response.status, delay))
+                attempt = attempt + 1
+                time.sleep(delay)
+                continue
+
+            return result
+
+    def open(self, url, headers = None, compress = None):
+        """Opens a URL and returns a DownloadResponse for the final HTTP status after
+        following redirects. The headers argument is a dictionary of extra request
+        headers. If compress is None, gzip is requested for text assets only; see
+        isTextURL(). Raises DownloadError if the URL could not be downloaded.
+
+        NOTE: Always close the response, preferably with a 'with' statement."""
+        requestHeaders = {"User-Agent": USER_AGENT}
+        if compress is None:
+            compress = isTextURL(url)
+        if compress:
+            requestHeaders["Accept-Encoding"] = "gzip"
+        else:
+            requestHeaders["Accept-Encoding"] = "identity"
+        if headers:
+            requestHeaders.update(headers)
+
+        for redirect in range(MAX_REDIRECTS + 1):
+            response = self.request(url, requestHeaders)
+            location = response.headers.get("Location")
+            if response.status not in REDIRECT_STATUS_CODES or not location:
+                return response
+            # Drain the redirect body so the connection can be reused.
+            response.read()
+            response.close()
+            url = urljoin(url, location)
+
+        raise DownloadError("Too many redirects for '{0}'.".format(url))
+
+
+sharedDownloaders = {}
+sharedDownloadersLock = threading.Lock()
+
+
+def getSharedDownloader(options = None):
+    """Returns a Downloader for the passed "download-options" dictionary, shared by
+    every caller in the process using the same options, so connections and host limits
+    are shared across a whole run."""
+    if not isinstance(options, dict): options = {}
+    key = json.dumps(options, sort_keys=True)
+    with sharedDownloadersLock:
+        downloader = sharedDownloaders.get(key)
+        if downloader is None:
+            downloader = Downloader(options.get("max-per-host", 4), options.get("retries", 3),
+                    options.get("backoff", 0.5), options.get("timeout", 60), options.get("max-segments", 4),
+                    options.get("segment-size", 32 * 1024 * 1024))
+            sharedDownloaders[key] = downloader
+        return downloader
@@ -0,0 +1,117 @@
+"""## SQS File Lock API
+
+Advisory file locks shared between processes, so several SQS runs can use the same
+'build-dir', caches and asset directories at the same time. Used around the scratch
+directories, the download and step caches, the build manifest and journal, and output
+publishing.
+
+A FileLock locks a lock file, created if needed, or a directory with fcntl.flock().
+Exclusive locks keep out every other holder; shared locks only keep out exclusive ones.
+Every FileLock opens its own file, so two FileLocks on the same path exclude each other
+even in the same process, from any thread. The operating system releases the locks of a
+process when it exits, however it exits, so a killed run never leaves a directory locked.
+
+The locks are advisory: they only keep out code which takes them too. Lock files may be
+removed by whoever holds them; a waiting FileLock notices and locks the new file instead.
+
+On systems without fcntl, such as Windows, locking does nothing.
+
+Usage:
+
+    with FileLock("build/cache/downloads/1234.lock"):
+        ...
+
+    lock = FileLock("build/scratch/4321.lock")
+    if lock.acquire(blocking=False):
+        ...
+        lock.release(remove=True)
+"""
+
+
+copyright = """SquidSpace.js, the associated tooling, and the documentation are copyright
+Jack William Bell 2020 except where noted. All other content, including HTML files and 3D
+assets, are copyright their respective authors."""
+
+
+import os
+try:
+    import fcntl
+except ImportError:
+    # Windows.
+    fcntl = None
+
+
+LOCK_FILE_SUFFIX = ".lock"
+
+# False where locking does nothing.
+LOCKING_SUPPORTED = fcntl is not None
+
+
+def openLockFile(lockPath):
+    """Opens the lock file, creating it if needed, or the directory, and returns the file
+    descriptor. Raises OSError on failure."""
+    try:
+        return os.open(lockPath, os.O_RDWR | os.O_CREAT, 0o666)
+    except IsADirectoryError:
+        return os.open(lockPath, os.O_RDONLY)
+
+
+class FileLock(object):
+    """An advisory lock on a lock file or directory, shared between processes. Use as a
+    context manager, or call acquire() and release(). Not reentrant, and not meant to be
+    shared between threads; make one per use."""
+    def __init__(self, lockPath, shared = False):
+        self.path = lockPath
+        self.shared = shared
+        self.fd = None
+
+    def acquire(self, blocking = True):
+        """Takes the lock, waiting for it unless blocking is False. Returns True if the
+        lock was taken, otherwise returns False. Raises OSError if the lock file can't be
+        opened."""
+        if fcntl is None:
+            return True
+        operation = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        if not blocking:
+            operation = operation | fcntl.LOCK_NB
+        while True:
+            fd = openLockFile(self.path)
+            try:
+                fcntl.flock(fd, operation)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            except:
+                os.close(fd)
+                raise
+
+            # Was the lock file removed, or replaced, while we waited?
+            try:
+                if os.path.samestat(os.fstat(fd), os.stat(self.path)):
+                    self.fd = fd
+                    return True
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def release(self, remove = False):
+        """Releases the lock, if held. If remove is True the lock file is removed first."""
+        if self.fd is None:
+            return
+        try:
+            if remove:
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+        finally:
+            # Closing the file releases the lock.
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.release()
@@ -16,10 +16,17 @@ assets, are copyright their respective authors."""
 import sys
 import os
 import json
+import time
+import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 
-from common import ModuleConfiguration, ScratchDirManager, makeOutputFilesFuncForDir, copyFileToDir, lookAheadIterator
-from filterhelpers import getFilterModule
+from common import ModuleConfiguration, ScratchDirManager, makeOutputBuffersFunc, copyFileToDir, lookAheadIterator, hashFile, getSharedPublisher, Publisher, DEFAULT_MEMORY_THRESHOLD
+from filterhelpers import getFilterModule, getFilterBuffersFunc, getFilterStreamFuncs, getFilterValidateFunc, isFilterPerFile, shutdownFilters
+from stepcache import makeStepKey, isStepCacheable
+from copyengine import LINK_MODE_COPY
+from commandrunner import startCommand, waitCommand, killCommand, cancelCommands, getCommandStats, COMMAND_REPORT_FILE_NAME
 from sqslogger import logger
 
 
@@ -133,7 +140,374 @@ def filterFilesFunctionSignature(inputs, outputs, options, logger):
     pass
 
 
-def processFilterChain(inFiles, outDir, scratchDirMgr, filterChain):
+def filterBuffersFunctionSignature(inputs, outputs, options, logger):
+    """## Filter Buffers Functions
+    
+    Filter modules whose work is done in Python may also provide a filter buffers 
+    function named filterBuffers(), which filters in-memory file data instead of files. 
+    When consecutive filters in a chain have filter buffers functions, the intermediate 
+    results are passed from one to the next in memory and never touch the scratch 
+    directory. See processFilterChain().
+    
+    Filter buffers functions work exactly like filter files functions, except for the 
+    inputs and outputs arguments, and must produce the same output data and file names.
+    
+    Filter buffers functions return the number of files successfully processed. 
+    
+    ### Arguments
+    
+    * inputs: A list of zero to many (file name, bytes) tuples
+    
+    * outputs: A function that, when called with a file name and a bytes object, 
+      stores the bytes as the output file with that name
+    
+    * options: An options dictionary or None; options may or may not contain
+      named values the implementation knows about
+    
+    * logger: A Python logger instance for the implementation to use as needed
+    """
+    pass
+
+
+def getBuffersSize(buffers):
+    """Returns the total number of bytes in a list of (file name, bytes) tuples."""
+    return sum(len(data) for name, data in buffers)
+
+
+def readFilesToBuffers(inFiles, memoryThreshold):
+    """Reads a list of files into a list of (file name, bytes) tuples. Returns None if 
+    the files add up to more than the memory threshold or could not be read."""
+    try:
+        if sum(os.path.getsize(filePath) for filePath in inFiles) > memoryThreshold:
+            return None
+        buffers = []
+        for filePath in inFiles:
+            with open(filePath, 'rb') as f:
+                buffers.append((os.path.basename(filePath), f.read()))
+        return buffers
+    except:
+        logger.exception("filtercommand.readFilesToBuffers() - Could not read input files.")
+    
+    return None
+
+
+def writeBuffersToDir(buffers, dirPath):
+    """Writes a list of (file name, bytes) tuples to files in a directory. Returns the 
+    list of file paths or None if a file could not be written."""
+    filePaths = []
+    for name, data in buffers:
+        filePath = os.path.join(dirPath, name)
+        try:
+            with open(filePath, 'wb') as f:
+                f.write(data)
+        except:
+            logger.exception("filtercommand.writeBuffersToDir() - Could not write '{0}'.".format(filePath))
+            return None
+        filePaths.append(filePath)
+    
+    return filePaths
+
+
+# Publishes intermediate files between scratch directories, such as the outputs of the
+# filters shared by filter branches. Its counts are never reported.
+scratchPublisher = Publisher()
+
+
+def publishFilesToDir(filePaths, outDir, linkMode = LINK_MODE_COPY, move = False, publisher = None):
+    """Publishes files to the output directory with the passed Publisher, or the shared 
+    Publisher, keeping their names. If move is True the files are moved rather than 
+    copied where possible. Returns False if a file could not be published, otherwise 
+    returns True."""
+    result = True
+    publisher = publisher or getSharedPublisher()
+    for filePath in filePaths:
+        if not publisher.publishFile(filePath, os.path.join(outDir, os.path.basename(filePath)), linkMode, move):
+            logger.error("filtercommand.publishFilesToDir() - Could not publish '{0}' to '{1}'.".format(filePath, outDir))
+            result = False
+    return result
+
+
+def publishBuffersToDir(buffers, outDir, publisher = None):
+    """Publishes a list of (file name, bytes) tuples to files in the output directory 
+    with the passed Publisher, or the shared Publisher. Returns False if a file could not
+    be published, otherwise returns True."""
+    result = True
+    publisher = publisher or getSharedPublisher()
+    for name, data in buffers:
+        if not publisher.publishBytes(data, os.path.join(outDir, name)):
+            result = False
+    return result
+
+
+def getStreamCommandFunc(fd):
+    """Returns the makeStreamCommand() function for a filter declaration if the filter 
+    runs in stream mode with its options, otherwise returns None."""
+    filterStreamsFunc, makeStreamCommandFunc = getFilterStreamFuncs(fd.get("filter"))
+    if filterStreamsFunc and filterStreamsFunc(fd.get("options")):
+        return makeStreamCommandFunc
+    return None
+
+
+def planFilterSteps(filterChain):
+    """Splits a filter chain into steps. Each step is a list of filter declarations: 
+    either a single filter or a run of consecutive stream mode filters, which are 
+    connected with pipes. Returns the list of steps."""
+    steps = []
+    for fd in filterChain:
+        if steps and getStreamCommandFunc(fd) and getStreamCommandFunc(steps[-1][-1]):
+            steps[-1].append(fd)
+        else:
+            steps.append([fd])
+    return steps
+
+
+class FilterStep(object):
+    """One step of a compiled filter chain: either a single filter or a run of stream 
+    mode filters connected with pipes. See compileFilterChain()."""
+    def __init__(self, fds, filterFunc, filterBuffersFunc, perFile):
+        self.fds = fds # The filter declarations.
+        self.fd = fds[0]
+        self.name = self.fd.get("filter")
+        self.filterFunc = filterFunc
+        self.filterBuffersFunc = filterBuffersFunc # Only for single filter steps.
+        self.perFile = perFile
+
+
+def compileFilterChain(filterChain):
+    """Resolves every filter module in a filter chain and validates the filter options, 
+    so a bad filter is found before any filter runs. Returns the list of FilterStep 
+    objects to run or None if the filter chain is invalid. All problems found are logged."""
+    if not isinstance(filterChain, list):
+        logger.error("filtercommand.compileFilterChain() - Filter chain '{0}' is not a list.".format(filterChain))
+        return None
+    
+    valid = True
+    for index, fd in enumerate(filterChain):
+        if isinstance(fd, dict) and "branches" in fd:
+            if index != len(filterChain) - 1:
+                logger.error("filtercommand.compileFilterChain() - Filter {0} 'branches' must be the last filter declaration.".format(index + 1))
+                valid = False
+            elif not validateFilterBranches(fd["branches"]):
+                valid = False
+            continue
+        if not isinstance(fd, dict) or not isinstance(fd.get("filter"), str):
+            logger.error("filtercommand.compileFilterChain() - Filter {0} '{1}' is not a valid filter declaration.".format(index + 1, fd))
+            valid = False
+            continue
+        if fd.get("options") is not None and not isinstance(fd["options"], dict):
+            logger.error("filtercommand.compileFilterChain() - Options for filter {0} '{1}' must be an object.".format(index + 1, fd["filter"]))
+            valid = False
+            continue
+        
+        filterFunc, filterDoc = getFilterModule(fd["filter"])
+        if not filterFunc:
+            logger.error("filtercommand.compileFilterChain() - Could not load filter module for filter {0} '{1}'.".format(index + 1, fd["filter"]))
+            valid = False
+            continue
+        
+        validateOptionsFunc = getFilterValidateFunc(fd["filter"])
+        if validateOptionsFunc and not validateOptionsFunc(fd.get("options") or {}, logger):
+            logger.error("filtercommand.compileFilterChain() - Invalid options for filter {0} '{1}'.".format(index + 1, fd["filter"]))
+            valid = False
+    if not valid:
+        return None
+    
+    # The branches are compiled when they run; see processFilterBranches().
+    if getFilterBranches(filterChain) is not None:
+        filterChain = filterChain[:-1]
+    
+    steps = []
+    for fds in planFilterSteps(filterChain):
+        filterFunc, filterDoc = getFilterModule(fds[0]["filter"])
+        if len(fds) > 1:
+            steps.append(FilterStep(fds, filterFunc, None, True))
+        else:
+            steps.append(FilterStep(fds, filterFunc, getFilterBuffersFunc(fds[0]["filter"]), 
+                    isFilterPerFile(fds[0]["filter"], fds[0].get("options"))))
+    return steps
+
+
+def getFilterBranches(filterChain):
+    """Returns the list of branches if the filter chain ends with a 'branches' declaration, 
+    otherwise returns None."""
+    if isinstance(filterChain, list) and filterChain and isinstance(filterChain[-1], dict):
+        return filterChain[-1].get("branches")
+    return None
+
+
+def getFilterOutSuffixes(filterChain):
+    """Returns the list of suffixes the filter chain adds to the names of its output 
+    files: the "out-suffix" of every branch, after the suffixes of any branches in the 
+    branch's own filter chain, or just an empty suffix if the chain has no branches."""
+    branches = getFilterBranches(filterChain)
+    if branches is None:
+        return [""]
+    return [innerSuffix + branch.get("out-suffix", "") for branch in branches 
+            for innerSuffix in getFilterOutSuffixes(branch.get("filters"))]
+
+
+def validateFilterBranches(branches):
+    """Returns True if a list of filter branches is valid, including the filter chain of 
+    every branch, otherwise logs the problems and returns False."""
+    if not isinstance(branches, list) or not branches:
+        logger.error("filtercommand.validateFilterBranches() - 'branches' must be a list with at least one branch.")
+        return False
+    
+    valid = True
+    suffixes = set()
+    for index, branch in enumerate(branches):
+        if not isinstance(branch, dict) or not isinstance(branch.get("out-suffix", ""), str):
+            logger.error("filtercommand.validateFilterBranches() - Branch {0} '{1}' is not a valid branch.".format(index + 1, branch))
+            valid = False
+            continue
+        suffix = branch.get("out-suffix", "")
+        if suffix in suffixes:
+            logger.error("filtercommand.validateFilterBranches() - Branch {0} has the same 'out-suffix' as an earlier branch.".format(index + 1))
+            valid = False
+        suffixes.add(suffix)
+        if branch.get("filters") and compileFilterChain(branch["filters"]) is None:
+            logger.error("filtercommand.validateFilterBranches() - Branch {0} has an invalid filter chain.".format(index + 1))
+            valid = False
+    
+    return valid
+
+
+def addOutSuffix(fileName, suffix):
+    """Returns the file name with the suffix added before the file extension."""
+    stem, ext = os.path.splitext(fileName)
+    return stem + suffix + ext
+
+
+def runStreamCommands(pathIn, pathOut, commands, labels = None, timeouts = None):
+    """Runs a list of shell commands connected with pipes, with pathIn connected to the 
+    STDIN of the first command and the STDOUT of the last written to pathOut. All 
+    commands run at the same time. Each command is recorded in the command report under
+    its label and killed if it is still running its timeout in seconds after the commands
+    start; labels and timeouts are lists matching the commands, or None. Returns True if 
+    every command results in a return code of zero, otherwise returns False."""
+    labels = labels or [None] * len(commands)
+    timeouts = timeouts or [None] * len(commands)
+    procs = []
+    startTime = time.monotonic()
+    try:
+        with open(pathIn, 'rb') as inFile, open(pathOut, 'wb') as outFile:
+            stdin = inFile
+            for i, command in enumerate(commands):
+                stdout = outFile if i == len(commands) - 1 else subprocess.PIPE
+                procs.append(startCommand(command, stdin, stdout))
+                if i > 0:
+                    # The parent's copy of the pipe must be closed, so the command 
+                    # writing to it gets SIGPIPE if the reading command exits early.
+                    stdin.close()
+                stdin = procs[-1].stdout
+    except OSError:
+        logger.exception("filtercommand.runStreamCommands() - Could not start commands for '{0}'.".format(pathIn))
+        for proc in procs:
+            killCommand(proc)
+    
+    # Wait for all the commands, even if one of them failed.
+    result = len(procs) == len(commands)
+    for command, label, timeout, proc in zip(commands, labels, timeouts, procs):
+        if not waitCommand(proc, command, label, startTime, None if timeout is None else startTime + timeout):
+            result = False
+    
+    return result
+
+
+def processStreamSteps(inFiles, outputs, streamChain):
+    """Filters a list of input files through a chain of stream mode filter declarations, 
+    connecting the filter commands for each file with pipes so they run concurrently 
+    and write no intermediate files. Returns the number of files successfully processed."""
+    result = 0
+    for pathIn in inFiles:
+        # Build the command for each filter, carrying the file name through.
+        commands = []
+        nameOut = os.path.basename(pathIn)
+        for fd in streamChain:
+            streamCommand = getStreamCommandFunc(fd)(nameOut, fd.get("options"), logger)
+            if not streamCommand:
+                break
+            command, nameOut = streamCommand
+            commands.append(command)
+        if len(commands) != len(streamChain):
+            logger.error("filtercommand.processStreamSteps() - Could not make stream commands for '{0}'.".format(pathIn))
+            continue
+        
+        options = [fd.get("options") or {} for fd in streamChain]
+        if runStreamCommands(pathIn, outputs(nameOut), commands, [o.get("command-template") for o in options],
+                [o.get("timeout") for o in options]):
+            result = result + 1
+    
+    return result
+
+
+def mapPerFile(func, items, executor):
+    """Calls func for every item and returns the list of results in the same order as 
+    the items. Uses the executor to make the calls concurrently, if one is passed."""
+    if executor is None or len(items) <= 1:
+        return [func(item) for item in items]
+    
+    # PYTHON TIP: Executor.map() returns results in the order of the inputs.
+    return list(executor.map(func, items))
+
+
+def logPerFileFailures(fd, names, counts):
+    """Logs the input files a per-file filter failed on, in input order."""
+    failed = [name for name, cnt in zip(names, counts) if cnt < 1]
+    if failed:
+        logger.warning("filtercommand.processFilterChain() - filter module '{0}' failed for: {1}.".format(fd.get("filter"), ", ".join(failed)))
+
+
+def getStepInputs(buffers, inFiles):
+    """Returns the list of (file name, content digest) tuples for the step cache key of 
+    the current step inputs, either the in-memory buffers or the input files, or None if 
+    an input file could not be read."""
+    if buffers is not None:
+        return [(name, hashlib.sha256(data).hexdigest()) for name, data in buffers]
+    
+    inputs = []
+    for filePath in inFiles:
+        digest = hashFile(filePath)
+        if digest is None:
+            return None
+        inputs.append((os.path.basename(filePath), digest))
+    return inputs
+
+
+def makeRecordingOutputsFunc(outputs):
+    """Returns a tuple of an outputs function wrapping the passed one and the list of 
+    output file paths it returned, in call order. A path may be in the list more than once."""
+    outPaths = []
+    def recordingOutputsFunc(fileName):
+        filePath = outputs(fileName)
+        # PYTHON TIP: list.append() is atomic, so per-file filter threads can share the list.
+        outPaths.append(filePath)
+        return filePath
+    return (recordingOutputsFunc, outPaths)
+
+
+def restoreCachedStep(cachedPaths, outDir, linkMode = LINK_MODE_COPY):
+    """Copies the cached output files of a step to the output directory. Returns the 
+    list of copied file paths or None if a file could not be copied. The next filter may
+    write to the files, so they are never hard links to the cache; they are clones if the
+    link mode allows."""
+    filePaths = []
+    for filePath in cachedPaths:
+        if not copyFileToDir(filePath, outDir, linkMode, False):
+            logger.error("filtercommand.restoreCachedStep() - Could not copy '{0}' to '{1}'.".format(filePath, outDir))
+            return None
+        filePaths.append(os.path.join(outDir, os.path.basename(filePath)))
+    return filePaths
+
+
+def getOutputFiles(outPaths):
+    """Returns the sorted list of output file paths reported to a recording outputs 
+    function which exist. See makeRecordingOutputsFunc()."""
+    return sorted(filePath for filePath in set(outPaths) if os.path.isfile(filePath))
+
+
+def processFilterChain(inFiles, outDir, scratchDirMgr, filterChain, memoryThreshold = DEFAULT_MEMORY_THRESHOLD, jobs = 1, stepCache = None,
+        linkMode = LINK_MODE_COPY, publisher = None):
     """Accepts a list of input file paths, an output directory path, a scratch directory 
     manager object, and a list of filters. Executes each filter in turn, using the scratch 
     directory for intermediate files, with the result that all file in the input files list 
@@ -147,7 +521,46 @@ def processFilterChain(inFiles, outDir, scratchDirMgr, filterChain):
     function will return False.
     
     NOTE: May add temporary files to the scratch directory without clearing them. Calling code
-    is responsible for managing the scratch directory."""
+    is responsible for managing the scratch directory.
+    
+    NOTE: Filters with a filter buffers function get their input in memory, as long as the
+    data adds up to no more than memoryThreshold bytes, and pass their output to the next 
+    filter in memory. Data is only written to the scratch directory when a filter without 
+    a filter buffers function comes next or the data grows past the threshold. A memory 
+    threshold of zero turns this off. See filterBuffersFunctionSignature().
+    
+    NOTE: Consecutive stream mode filters, such as 'shellexec' with the "stream" option, 
+    are run together with their commands connected by pipes. See processStreamSteps().
+    
+    NOTE: If jobs is greater than one, up to that many input files are filtered at the 
+    same time by 'per-file' filters and stream steps, which filter every input file on 
+    its own. The results are merged back in input file order, so the outcome doesn't 
+    depend on which file finished first. See filterhelpers.isFilterPerFile().
+    
+    NOTE: The filter chain is compiled before any filter runs, so an unknown filter or 
+    invalid filter options fail the whole chain up front. Each step gets exactly the 
+    files the step before reported through its outputs function; other files in the 
+    scratch directory are ignored. See compileFilterChain().
+    
+    NOTE: A filter chain may end with a 'branches' declaration, so one pass makes several 
+    variants of the input files. The filters before it run once, then each branch runs 
+    its own filter chain on their output, in parallel. See processFilterBranches().
+    
+    NOTE: The results are written to the output directory with the passed Publisher, or 
+    the shared Publisher, which counts the files changed; see common.Publisher.
+    
+    NOTE: If a step cache is passed, the outputs of every step which filters all of its 
+    input files are cached, and a step run again with the same input bytes, filters and 
+    options takes its outputs from the cache instead. So when only the end of a chain 
+    changes, only the changed steps run. See stepcache.py and restoreCachedStep().
+    
+    NOTE: Files copied without filtering, when the filter chain is empty, and the final
+    outputs of branches are copied or linked as the link mode allows. See 
+    copyengine.copyFile().
+    
+    NOTE: The last filter writes to the scratch directory like the others, and its 
+    outputs are then published to the output directory, which only replaces output files
+    whose bytes changed. See common.Publisher."""
     # Check args.
     # TODO: Type checking. Better error handling.
     if not inFiles:
@@ -164,60 +577,228 @@ def processFilterChain(inFiles, outDir, scratchDirMgr, filterChain):
     result = True # Assume success
     
     # Do we have a filter chain?
-    if filterChain is None:
-        # No filters? Simply copy the files and get out.
-        for filePath in inFiles:
-            if not copyFileToDir(filePath, outDir):
-                logger.error("filtercommand.processFilterChain() - Could not copy '{0}' to '{1}'.".format(filePath, outDir))
-                result = False
+    if not filterChain:
+        # No filters? Simply publish the files and get out.
+        result = publishFilesToDir(inFiles, outDir, linkMode, False, publisher)
     else:
+        # Resolve and check every filter before doing any work.
+        steps = compileFilterChain(filterChain)
+        if steps is None:
+            return False
+        if getFilterBranches(filterChain) is not None:
+            return processFilterBranches(inFiles, outDir, scratchDirMgr, filterChain, memoryThreshold, jobs, stepCache, linkMode, publisher)
+        
         # Set up the scratch work areas.
         # NOTE: first time through the inFiles list is the passed in argument. Afterwards
         #       it is from the outdir.
         sdIn = scratchDirMgr.makeSubScratchDirManager("sd1")
         sdOut = scratchDirMgr.makeSubScratchDirManager("sd2")
         
-        # Process the filter chain.
-        for fd, isLastFD in lookAheadIterator(filterChain):
-            #logger.debug("filtercommand.filterFile() - Lookahead: " + str(isLastFD) + " / " + str(fd))
-            # Get the named filter module.
-            filterFunc, filterDoc = getFilterModule(fd.get("filter"))
-            if not filterFunc:
-                logger.error("filtercommand.processFilterChain() - Could not load filter module for '{0}'.".format(fd.get("filter")))
-                # We cannot continue without a valid filter.
-                result = False
-                break
+        # Intermediate results kept in memory, as a list of (file name, bytes) tuples, or 
+        # None if the current inputs are the files in inFiles.
+        buffers = None
+        
+        # Threads for per-file filters.
+        executor = None
+        if jobs > 1:
+            executor = ThreadPoolExecutor(max_workers=jobs)
+        
+        try:
+            # Process the filter chain.
+            for step, isLastFD in lookAheadIterator(steps):
+                #logger.debug("filtercommand.filterFile() - Lookahead: " + str(isLastFD) + " / " + str(step))
+                fd = step.fd
+                filterFunc = step.filterFunc
             
-            # For the last iteration, we want the output going to the output directory.
-            outputs = sdOut.makeOutputFilesFunc()
-            if isLastFD:
-                outputs = makeOutputFilesFuncForDir(outDir) 
+                # Has this step already been done with the same inputs?
+                stepKey = None
+                if stepCache and isStepCacheable(step.fds):
+                    stepInputs = getStepInputs(buffers, inFiles)
+                    if stepInputs is not None:
+                        stepKey = makeStepKey(step.fds, stepInputs)
+                        # Other processes can't remove the entry while it is copied.
+                        with stepCache.reading():
+                            cached = stepCache.get(stepKey)
+                            if cached:
+                                restored = restoreCachedStep(cached[1], sdOut.path, linkMode)
+                        if cached:
+                            logger.debug("filtercommand.processFilterChain() - Using cached outputs for filter module '{0}'.".format(step.name))
+                            buffers = None
+                            inFiles = restored
+                            if inFiles is None:
+                                result = False
+                                break
+                            if isLastFD:
+                                break
+                        
+                            # Swap the ins and outs, like after running the step.
+                            sdt = sdIn 
+                            sdIn = sdOut 
+                            sdOut = sdt
+                            sdOut.clear()
+                            continue
             
-            # Execute the filter function
-            cnt = filterFunc(inFiles, outputs, fd.get("options"), logger)
-            if cnt < 1:
-                logger.warning("filtercommand.processFilterChain() - filter module '{0}' processed zero files.".format(fd.get("filter")))
-                result = False
-            elif cnt != len(inFiles):
-                logger.warning("filtercommand.processFilterChain() - filter module '{0}' processed {1} files out of {2}.".format(fd.get("filter"), cnt, len(inFiles)))
-                result = False
+                # Can this filter work on more than one file at a time?
+                perFile = step.perFile
             
-            # Get the file list from the out for the next iteration.
-            inFiles = sdOut.listFiles()
+                # Can this filter work in memory?
+                filterBuffersFunc = None
+                if memoryThreshold > 0:
+                    filterBuffersFunc = step.filterBuffersFunc
+                    if filterBuffersFunc and buffers is None:
+                        buffers = readFilesToBuffers(inFiles, memoryThreshold)
             
-            # Swap the ins and outs.
-            sdt = sdIn 
-            sdIn = sdOut 
-            sdOut = sdt
+                if filterBuffersFunc and buffers is not None:
+                    # Execute the filter buffers function.
+                    outBuffers = {}
+                    inCount = len(buffers)
+                    if perFile and executor:
+                        # Filter each buffer on its own, then merge the outputs in input order.
+                        def filterBuffer(item):
+                            itemBuffers = {}
+                            return (filterBuffersFunc([item], makeOutputBuffersFunc(itemBuffers), fd.get("options"), logger), itemBuffers)
+                        itemResults = mapPerFile(filterBuffer, buffers, executor)
+                        for itemCnt, itemBuffers in itemResults:
+                            outBuffers.update(itemBuffers)
+                        cnt = sum(itemCnt for itemCnt, itemBuffers in itemResults)
+                        logPerFileFailures(fd, [name for name, data in buffers], [itemCnt for itemCnt, itemBuffers in itemResults])
+                    else:
+                        cnt = filterBuffersFunc(buffers, makeOutputBuffersFunc(outBuffers), fd.get("options"), logger)
+                    buffers = list(outBuffers.items())
+                    if stepKey and cnt > 0 and cnt == inCount:
+                        stepCache.putBuffers(stepKey, cnt, buffers)
+                
+                    # Too big to keep in memory? (Files are published from memory anyway.)
+                    if getBuffersSize(buffers) > memoryThreshold and not isLastFD:
+                        logger.debug("filtercommand.processFilterChain() - Spilling filter output to the scratch directory.")
+                        inFiles = writeBuffersToDir(buffers, sdOut.path)
+                        buffers = None
+                        if inFiles is None:
+                            result = False
+                            break
+                    
+                        # Swap the ins and outs and clear the new out.
+                        sdt = sdIn 
+                        sdIn = sdOut 
+                        sdOut = sdt
+                        sdOut.clear()
+                else:
+                    # Write out in-memory results from the previous filter.
+                    if buffers is not None:
+                        sdIn.clear()
+                        inFiles = writeBuffersToDir(buffers, sdIn.path)
+                        buffers = None
+                        if inFiles is None:
+                            result = False
+                            break
+                
+                    # Track exactly which files the filter reports writing. The last filter
+                    # writes to the scratch directory too; its outputs are published after.
+                    outputs, outPaths = makeRecordingOutputsFunc(sdOut.makeOutputFilesFunc())
+                
+                    # Execute the filter function, or the piped commands for a stream step.
+                    inCount = len(inFiles)
+                    if len(step.fds) > 1:
+                        logger.debug("filtercommand.processFilterChain() - Piping {0} stream filters.".format(len(step.fds)))
+                        counts = mapPerFile(lambda pathIn: processStreamSteps([pathIn], outputs, step.fds), inFiles, executor)
+                        cnt = sum(counts)
+                    elif perFile and executor:
+                        counts = mapPerFile(lambda pathIn: filterFunc([pathIn], outputs, fd.get("options"), logger), inFiles, executor)
+                        cnt = sum(counts)
+                        logPerFileFailures(fd, [os.path.basename(pathIn) for pathIn in inFiles], counts)
+                    else:
+                        cnt = filterFunc(inFiles, outputs, fd.get("options"), logger)
+                
+                    # The reported output files are the inputs for the next iteration. Other 
+                    # files in the scratch directory are ignored.
+                    inFiles = getOutputFiles(outPaths)
+                    if stepKey and cnt > 0 and cnt == inCount:
+                        stepCache.putFiles(stepKey, cnt, inFiles)
+                
+                    # Swap the ins and outs.
+                    sdt = sdIn 
+                    sdIn = sdOut 
+                    sdOut = sdt
+                
+                    # Clear the new out
+                    sdOut.clear()
             
-            # Clear the new out
-            sdOut.clear()
+                if cnt < 1:
+                    logger.warning("filtercommand.processFilterChain() - filter module '{0}' processed zero files.".format(step.name))
+                    result = False
+                elif cnt != inCount:
+                    logger.warning("filtercommand.processFilterChain() - filter module '{0}' processed {1} files out of {2}.".format(step.name, cnt, inCount))
+                    result = False
         
+            # Publish the results of the last filter. They are in memory or in the scratch 
+            # directory, so files can be moved; inFiles is None if a step failed outright.
+            if buffers is not None:
+                if not publishBuffersToDir(buffers, outDir, publisher):
+                    result = False
+            elif inFiles and not publishFilesToDir(inFiles, outDir, linkMode, True, publisher):
+                result = False
+        finally:
+            if executor:
+                executor.shutdown()
+        
+    return result
+
+
+def processFilterBranches(inFiles, outDir, scratchDirMgr, filterChain, memoryThreshold, jobs, stepCache, linkMode = LINK_MODE_COPY,
+        publisher = None):
+    """Does the work of processFilterChain() for a filter chain ending with 'branches'. 
+    The filters before the branches run once, then every branch filters their output at 
+    the same time, each in its own scratch directory. The outputs of each branch are 
+    written to the output directory with the branch "out-suffix" added to their names, 
+    with the passed Publisher or the shared Publisher; the intermediate files in the 
+    scratch directories are not counted. Returns True if the shared filters and every 
+    branch succeed, otherwise returns False."""
+    branches = getFilterBranches(filterChain)
+    publisher = publisher or getSharedPublisher()
+    
+    # Run the shared filters once.
+    if len(filterChain) > 1:
+        sdShared = scratchDirMgr.makeSubScratchDirManager("shared")
+        sharedOutDir = sdShared.makeSubDir("out")
+        if not processFilterChain(inFiles, sharedOutDir, sdShared.makeSubScratchDirManager("work"), filterChain[:-1], memoryThreshold, jobs, stepCache, linkMode, 
+                scratchPublisher):
+            return False
+        inFiles = sdShared.listFiles("out")
+    
+    # Run the branches, each into its own directory.
+    def runBranch(index):
+        sdBranch = scratchDirMgr.makeSubScratchDirManager("branch{0}".format(index))
+        branchOutDir = sdBranch.makeSubDir("out")
+        result = processFilterChain(inFiles, branchOutDir, sdBranch.makeSubScratchDirManager("work"), 
+                branches[index].get("filters"), memoryThreshold, jobs, stepCache, linkMode, scratchPublisher)
+        return (result, sdBranch.listFiles("out"))
+    with ThreadPoolExecutor(max_workers=len(branches)) as executor:
+        branchResults = list(executor.map(runBranch, range(len(branches))))
+    
+    # Publish the branch outputs to the output directory, in branch order.
+    result = True
+    written = set()
+    for branch, (branchResult, branchOutputs) in zip(branches, branchResults):
+        if not branchResult:
+            logger.warning("filtercommand.processFilterBranches() - Branch with 'out-suffix' '{0}' failed.".format(branch.get("out-suffix", "")))
+            result = False
+        for filePath in branchOutputs:
+            nameOut = addOutSuffix(os.path.basename(filePath), branch.get("out-suffix", ""))
+            if nameOut in written:
+                logger.error("filtercommand.processFilterBranches() - More than one branch wrote '{0}'.".format(nameOut))
+                result = False
+                continue
+            written.add(nameOut)
+            if not publisher.publishFile(filePath, os.path.join(outDir, nameOut), linkMode, True):
+                logger.error("filtercommand.processFilterBranches() - Could not publish '{0}' to '{1}'.".format(filePath, outDir))
+                result = False
+    
     return result
 
 
-def runFilter(defaultConfig, filterProfile, inFiles, outDir):
-    """SQS filter command."""
+def runFilter(defaultConfig, filterProfile, inFiles, outDir, jobs = None):
+    """SQS filter command. Per-file filters process up to jobs input files at the same 
+    time; if jobs is None the "filter-jobs" configuration value is used."""
     # Assume Failure.
     fileToFilter = None
     
@@ -228,15 +809,34 @@ def runFilter(defaultConfig, filterProfile, inFiles, outDir):
     # Create the module processing configuration.
     modConfig = ModuleConfiguration(defaultConfig, {})
         
+    # Find plug-in filters.
+    modConfig.addFilterDirs()
+    
     # Create scratchDirMgr.
     sd = modConfig.getScratchDirManager()
     
     # Process the filters.
-    if not processFilterChain(inFiles, outDir, sd, modConfig.getFilters(None, filterProfile)):
-        logger.warning("filtercommand.runFilter() - Unable to completely process all files and filters.")
+    if jobs is None:
+        jobs = modConfig.filterJobs
+    getCommandStats().reset()
+    getSharedPublisher().reset()
+    try:
+        if not processFilterChain(inFiles, outDir, sd, modConfig.getFilters(None, filterProfile), modConfig.memoryThreshold, jobs,
+                modConfig.getStepCache(), modConfig.linkMode):
+            logger.warning("filtercommand.runFilter() - Unable to completely process all files and filters.")
+    except KeyboardInterrupt:
+        # Commands run in their own process groups, so they didn't get the interrupt.
+        cancelCommands()
+        raise
+    
+    # Report the cost of the commands run.
+    getCommandStats().logReport()
+    getCommandStats().writeReport(os.path.join(modConfig.bldDir, COMMAND_REPORT_FILE_NAME))
+    getSharedPublisher().logSummary("filtercommand.runFilter()")
     
     # Cleanup.
     # TODO: If anything above fails with an exception the scratch dir is not cleaned up.
+    shutdownFilters()
     sd.remove()
     
     # TODO: Support STDIN if inFiles is empty. See junk code below.
@@ -1,27 +1,103 @@
 """## SQS Filter Support API 
 
 Shared code used by all SQS Filter Files Functions.
+
+Filter modules are found by name through the shared filter registry and only imported
+when first used. See filterregistry.py.
 """
 
 import os
-from filters.shellexec import filterFiles as shellexec_filter, __doc__ as shellexec_doc
-from filters.merge import filterFiles as merge_filter, __doc__ as merge_doc
-from filters.cleanbabylon import filterFiles as cleanbab_filter, __doc__ as cleanbab_doc
+from filterregistry import getSharedFilterRegistry
 
 
 def getFilterModule(filterName):
     """Returns a tuple for the passed filter module name containing the filter files 
-    function and the filter doc string. Returns 'None' if the filter could not be 
-    located and/or loaded.
+    function and the filter doc string. Returns '(None, None)' if the filter could not 
+    be located and/or loaded."""
     
-    TODO: Support dynamic imports from a 'filters' directory."""
+    module = getSharedFilterRegistry().getModule(filterName)
+    if module:
+        return (module.filterFiles, module.__doc__)
     
-    # Is it a 'built-in' filter?
-    if filterName == "shellexec":
-        return (shellexec_filter, shellexec_doc)
-    elif filterName == "merge":
-        return (merge_filter, merge_doc)
-    elif filterName == "cleanbabylon":
-        return (cleanbab_filter, cleanbab_doc)
+    return (None, None)
+
+
+def getFilterBuffersFunc(filterName):
+    """Returns the filter buffers function for the passed filter module name, for filter 
+    modules which can filter in-memory data, or 'None' if the filter doesn't support it 
+    or could not be located and/or loaded. See filtercommand.filterBuffersFunctionSignature()."""
+    
+    module = getSharedFilterRegistry().getModule(filterName)
+    return getattr(module, "filterBuffers", None)
+
+
+def getFilterStreamFuncs(filterName):
+    """Returns a tuple for the passed filter module name containing the filter's 
+    filterStreams(options) function and makeStreamCommand(nameIn, options, logger) 
+    function, for filter modules which can run as a command connected with pipes. 
+    Returns '(None, None)' if the filter doesn't support it or could not be located 
+    and/or loaded. See filtercommand.processStreamSteps()."""
+    
+    module = getSharedFilterRegistry().getModule(filterName)
+    filterStreamsFunc = getattr(module, "filterStreams", None)
+    makeStreamCommandFunc = getattr(module, "makeStreamCommand", None)
+    if filterStreamsFunc and makeStreamCommandFunc:
+        return (filterStreamsFunc, makeStreamCommandFunc)
     
     return (None, None)
+
+
+def getFilterValidateFunc(filterName):
+    """Returns the validateOptions(options, logger) function for the passed filter module 
+    name, which returns True if the filter options are valid and logs any problems, or 
+    'None' if the filter doesn't check its options or could not be located and/or loaded. 
+    See filtercommand.compileFilterChain()."""
+    
+    module = getSharedFilterRegistry().getModule(filterName)
+    return getattr(module, "validateOptions", None)
+
+
+def isFilterPerFile(filterName, options = None):
+    """Returns True if the passed filter module name is a 'per-file' filter, which 
+    filters every input file on its own, so different input files may be filtered at 
+    the same time. Filter modules declare this with a module variable named 'perFile',
+    which is either True or a function taking the filter options, for filters where it
+    depends on the options."""
+    
+    module = getSharedFilterRegistry().getModule(filterName)
+    perFile = getattr(module, "perFile", False)
+    if callable(perFile):
+        return perFile(options)
+    return perFile
+
+
+def isFilterBatchable(filterName, options = None):
+    """Returns True if the outputs of the passed filter module name can be matched back 
+    to its input files by name, so the pipeline can run it once over many resources: 
+    'per-file' filters, and filters with a filterBatches(options) function which selects
+    batch mode for the options, such as 'shellexec' with a "batch-command-template". 
+    Many-to-one filters, such as 'merge', are not batchable."""
+    
+    module = getSharedFilterRegistry().getModule(filterName)
+    if module is None:
+        return False
+    filterBatchesFunc = getattr(module, "filterBatches", None)
+    if filterBatchesFunc and filterBatchesFunc(options):
+        return True
+    return bool(isFilterPerFile(filterName, options))
+
+
+def getFilterNames():
+    """Returns the sorted names of all built-in and plug-in filters, without importing 
+    them."""
+    return getSharedFilterRegistry().getFilterNames()
+
+
+def shutdownFilters():
+    """Stops any long-lived processes started by filter modules, such as 'coprocess' 
+    workers, by calling the shutdownFilter() function of every imported filter module 
+    which has one. Call when all filtering is done."""
+    for module in getSharedFilterRegistry().getLoadedModules():
+        shutdownFilterFunc = getattr(module, "shutdownFilter", None)
+        if shutdownFilterFunc:
+            shutdownFilterFunc()
@@ -0,0 +1,208 @@
+"""## SQS Filter Registry API
+
+Finds filter modules by name. Filter modules are Python files in a filter directory,
+named after the filter: a 'foo' filter is the file 'foo.py'. Files starting with an
+underscore are ignored. The built-in filters always come first, then the directories
+from the "filter-dirs" configuration value, in order; when more than one directory has
+a filter with the same name the first one wins. The built-in filters are listed in
+BUILT_IN_FILTERS rather than scanned, as the built-in filters directory also holds
+placeholder modules, such as 'split', which are not filters yet.
+
+Filter directories are scanned once, and filter modules are only imported when a filter
+chain first uses them, so startup time doesn't grow with the number of installed
+filters. Plug-in filter modules are imported from their file path and may import the
+SQS modules, such as 'common', like the built-in filters.
+
+The scan results for the "filter-dirs" directories are cached in an index file, by
+default 'cache/filters.json' in the 'build-dir':
+
+    {
+        "/home/me/sqs-filters": {
+            "mtime": 1602020202000000000,
+            "filters": {"resize": "/home/me/sqs-filters/resize.py"}
+        }
+    }
+
+A directory is only scanned again when its modified time changes, which happens when
+filter files are added, removed or renamed. The index only maps filter names to file
+paths, so filter files edited in place need no scan; they are imported from their path
+on every run.
+
+Usage:
+
+    registry = getSharedFilterRegistry()
+    registry.addFilterDirs(["~/sqs-filters"], "build/cache/filters.json")
+    module = registry.getModule("resize")
+"""
+
+
+copyright = """SquidSpace.js, the associated tooling, and the documentation are copyright
+Jack William Bell 2020 except where noted. All other content, including HTML files and 3D
+assets, are copyright their respective authors."""
+
+
+import os
+import sys
+import json
+import threading
+import importlib
+import importlib.util
+from sqslogger import logger
+
+
+BUILT_IN_FILTER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "filters")
+
+# Modules in the built-in filters directory which are filters. Add new built-in filters here.
+BUILT_IN_FILTERS = ("cleanbabylon", "coprocess", "merge", "shellexec")
+
+# Package name for plug-in filter modules in sys.modules.
+PLUGIN_PACKAGE = "sqsfilterplugins"
+
+
+def scanFilterDir(dirPath):
+    """Returns a dictionary of filter name to file path for the filter modules in a 
+    directory. Returns an empty dictionary if the directory could not be read."""
+    result = {}
+    try:
+        with os.scandir(dirPath) as entries:
+            for entry in entries:
+                name, ext = os.path.splitext(entry.name)
+                if ext == ".py" and not name.startswith("_") and entry.is_file():
+                    result[name] = entry.path
+    except OSError:
+        logger.warning("filterregistry.scanFilterDir() - Could not read filter directory '{0}'.".format(dirPath))
+
+    return result
+
+
+def loadIndex(indexPath):
+    """Returns the filter directory index from the index file or an empty index."""
+    if not indexPath or not os.path.isfile(indexPath):
+        return {}
+    try:
+        with open(indexPath, 'r') as f:
+            index = json.load(f)
+        if isinstance(index, dict):
+            return index
+    except:
+        logger.warning("filterregistry.loadIndex() - Could not read filter index '{0}'.".format(indexPath))
+
+    return {}
+
+
+def saveIndex(indexPath, index):
+    """Writes the filter directory index to the index file."""
+    # Unique to the process, as other runs may write the file at the same time.
+    tempPath = "{0}.tmp-{1}".format(indexPath, os.getpid())
+    try:
+        dirPath = os.path.dirname(indexPath)
+        if dirPath: os.makedirs(dirPath, exist_ok=True)
+        with open(tempPath, 'w') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(tempPath, indexPath)
+    except:
+        logger.exception("filterregistry.saveIndex() - Could not write filter index '{0}'.".format(indexPath))
+
+
+class FilterRegistry(object):
+    """Filter modules by name, imported when first used. Safe to use from multiple
+    threads."""
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.dirs = []
+        self.paths = {} # Filter name to module file path, or None for built-in filters.
+        self.modules = {} # Filter name to imported module, or None if it could not be imported.
+        for name in BUILT_IN_FILTERS:
+            self.paths[name] = None
+        self.dirs.append(BUILT_IN_FILTER_DIR)
+
+    def addFilterDirs(self, filterDirs, indexPath = None):
+        """Adds plug-in filter directories after those already added, using and updating
+        the index file, if any. Directories already added are skipped."""
+        with self.lock:
+            index = None
+            changed = False
+            for dirPath in filterDirs or []:
+                dirPath = os.path.abspath(os.path.expanduser(dirPath))
+                if dirPath in self.dirs:
+                    continue
+                self.dirs.append(dirPath)
+                if index is None:
+                    index = loadIndex(indexPath)
+
+                # Scan the directory unless the index is up to date.
+                try:
+                    mtime = os.stat(dirPath).st_mtime_ns
+                except OSError:
+                    logger.warning("filterregistry.FilterRegistry.addFilterDirs() - Filter directory '{0}' does not exist.".format(dirPath))
+                    continue
+                entry = index.get(dirPath)
+                if (not isinstance(entry, dict) or entry.get("mtime") != mtime or not isinstance(entry.get("filters"), dict) or 
+                        not all(isinstance(filePath, str) for filePath in entry["filters"].values())):
+                    logger.debug("filterregistry.FilterRegistry.addFilterDirs() - Scanning filter directory '{0}'.".format(dirPath))
+                    entry = {"mtime": mtime, "filters": scanFilterDir(dirPath)}
+                    index[dirPath] = entry
+                    changed = True
+
+                for name in sorted(entry["filters"]):
+                    if name in self.paths:
+                        logger.warning("filterregistry.FilterRegistry.addFilterDirs() - Ignoring filter '{0}' in '{1}', a filter with that name was found first.".format(name, dirPath))
+                    else:
+                        self.paths[name] = entry["filters"][name]
+
+            if changed and indexPath:
+                saveIndex(indexPath, index)
+
+    def getFilterNames(self):
+        """Returns the sorted names of all known filters, without importing them."""
+        with self.lock:
+            return sorted(self.paths)
+
+    def getModule(self, filterName):
+        """Returns the filter module for the name, importing it the first time, or None
+        if there is no such filter or it could not be imported."""
+        with self.lock:
+            if filterName in self.modules:
+                return self.modules[filterName]
+            if filterName not in self.paths:
+                return None
+
+            module = None
+            try:
+                path = self.paths[filterName]
+                if path is None:
+                    module = importlib.import_module("filters." + filterName)
+                else:
+                    logger.debug("filterregistry.FilterRegistry.getModule() - Importing plug-in filter '{0}'.".format(path))
+                    moduleName = PLUGIN_PACKAGE + "." + filterName
+                    spec = importlib.util.spec_from_file_location(moduleName, path)
+                    module = importlib.util.module_from_spec(spec)
+                    sys.modules[moduleName] = module
+                    spec.loader.exec_module(module)
+                if not callable(getattr(module, "filterFiles", None)):
+                    logger.error("filterregistry.FilterRegistry.getModule() - '{0}' has no filterFiles() function.".format(filterName))
+                    module = None
+            except:
+                logger.exception("filterregistry.FilterRegistry.getModule() - Could not import filter '{0}'.".format(filterName))
+                module = None
+
+            self.modules[filterName] = module
+            return module
+
+    def getLoadedModules(self):
+        """Returns the list of filter modules imported so far."""
+        with self.lock:
+            return [module for module in self.modules.values() if module is not None]
+
+
+sharedRegistry = None
+sharedRegistryLock = threading.Lock()
+
+
+def getSharedFilterRegistry():
+    """Returns the FilterRegistry shared by every caller in the process."""
+    global sharedRegistry
+    with sharedRegistryLock:
+        if sharedRegistry is None:
+            sharedRegistry = FilterRegistry()
+        return sharedRegistry
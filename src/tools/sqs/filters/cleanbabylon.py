@@ -2,17 +2,25 @@
 
 Removes unhelpful or unneeded data sections from .babylon files. 
 
-Besides the standard filterFile() functions there are two API functions:
+Besides the standard filterFile() functions there are three API functions:
 
 1. cleanBabylonData(data) - Cleans a Python dictionary containing a parsed .babylon file
 
-2. cleanBabylonFile(pathIn, pathOut, options, logger) – Cleans the data of a .babylon 
+2. cleanBabylonBuffer(dataIn, logger) - Cleans the bytes of a .babylon file and returns
+  the cleaned bytes
+
+3. cleanBabylonFile(pathIn, pathOut, options, logger) – Cleans the data of a .babylon 
   file specified in pathIn and writes it to pathOut
 
+The filter also supports in-memory filtering with filterBuffers().
+
 ### Filter File function
 
 Options: None.
 
+Each input file is filtered on its own, so the filter is 'per-file' and the filter chain
+may clean several input files at the same time.
+
 File Extensions supported:
 
 * in – .babylon
@@ -28,6 +36,11 @@ assets, are copyright their respective authors."""
 import sys
 import os
 import json
+
+
+# Every input file is filtered on its own, so the filter chain may filter several input 
+# files at the same time. See filtercommand.processFilterChain().
+perFile = True
     
     
 def cleanBabylonData(data):
@@ -63,13 +76,34 @@ def cleanBabylonData(data):
     return dirty
     
 
+def cleanBabylonBuffer(dataIn, logger):
+    """Cleans the bytes of a .babylon file and returns the cleaned bytes or None if the
+    data could not be parsed."""
+    try:
+        # Load Babylon data.
+        data = json.loads(dataIn)
+    except:
+        logger.exception("cleanbablyon.cleanBabylonBuffer() - Could not parse Babylon data.")
+        return None
+    
+    # Try to clean the data.
+    if cleanBabylonData(data):
+        logger.debug("cleanbablyon.cleanBabylonBuffer() - Babylon data was cleaned.")
+    else:
+        logger.debug("cleanbablyon.cleanBabylonBuffer() - Babylon data did not require cleaning.")
+    
+    # Return it, even if the clean did nothing, because the caller expects output data.
+    # TODO: This writes it packed, do we want a 'pretty print' option?
+    return json.dumps(data).encode("utf-8")
+    
+
 def cleanBabylonFile(pathIn, pathOut, options, logger):
     """Cleans the data of a .babylon file specified in pathIn and writes it to
     pathOut. Returns True on success, otherwise returns False.
     
     NOTE: Currently supports no options."""
     
-    logger.debug("cleanbabylon.cleanBabylonFile() - Processing pathIn: {pathIn} pathOut: {pathOut}".format(pathIn, pathOut))
+    logger.debug("cleanbabylon.cleanBabylonFile() - Processing pathIn: {pathIn} pathOut: {pathOut}".format(pathIn=pathIn, pathOut=pathOut))
     
     # Assume failure.
     result = False
@@ -79,26 +113,19 @@ def cleanBabylonFile(pathIn, pathOut, options, logger):
     if ext == ".babylon":
         try:
             # Load Babylon file
-            with open(pathIn, 'r') as babFile:
-                data = json.load(babFile)
-                close(babFile)
+            with open(pathIn, 'rb') as babFile:
+                data = cleanBabylonBuffer(babFile.read(), logger)
             
-            # Try to clean the data.
-            if cleanBabylonData(data):
-                logger.debug("cleanbablyon.cleanBabylonFile() - Babylon file was cleaned.")
-            else:
-                logger.debug("cleanbablyon.cleanBabylonFile() - Babylon file did not require cleaning.")
-            try:
-                # Write it back out. (We do this even if the clean did nothing, because 
-                # output and input may be/should be different files.)
-                # TODO: This writes it packed, do we want a 'pretty print' option?
-                with open(pathOut, 'w') as babFile:
-                    json.dump(data, babFile)
-                    close(babFile)
-                logger.debug("Babylon file written out.")
-                result = True
-            except:
-                logger.exception("cleanbablyon.cleanBabylonFile() - Could not write output file '{0}', continuing processing.".format(pathOut))
+            if data != None:
+                try:
+                    # Write it back out. (We do this even if the clean did nothing, because 
+                    # output and input may be/should be different files.)
+                    with open(pathOut, 'wb') as babFile:
+                        babFile.write(data)
+                    logger.debug("Babylon file written out.")
+                    result = True
+                except:
+                    logger.exception("cleanbablyon.cleanBabylonFile() - Could not write output file '{0}', continuing processing.".format(pathOut))
         except:
                 logger.exception("cleanbablyon.cleanBabylonFile() - Could not read input file '{0}', continuing processing.".format(pathIn))
     else:
@@ -124,4 +151,28 @@ def filterFiles(inputs, outputs, options, logger):
             
     # Done.
     return result
-    
\ No newline at end of file
+
+
+def filterBuffers(inputs, outputs, options, logger):
+    """SQS filter buffers function that 'cleans' in-memory Babylon files.
+    
+    NOTE: Currently supports no options."""
+    
+    logger.debug("cleanbablyon.filterBuffers().")
+    
+    # Setup
+    result = 0
+
+    # Process input files.
+    for nameIn, dataIn in inputs:
+        name, ext = os.path.splitext(nameIn)
+        if ext != ".babylon":
+            logger.error("cleanbablyon.filterBuffers() - Input file '{0}' is not a .babylon file.".format(nameIn))
+            continue
+        data = cleanBabylonBuffer(dataIn, logger)
+        if data != None:
+            outputs(os.path.basename(nameIn), data)
+            result = result + 1
+            
+    # Done.
+    return result
@@ -0,0 +1,362 @@
+"""## filters.coprocess.py – SQS Filter Module that passes files to long-lived worker processes
+
+Passes files to a worker command for filtering, like 'shellexec', but starts the worker
+only once and sends it every input file as a job, so tools which take a long time to
+start, such as converters running inside a Python or Node runtime, only pay that cost
+once. The filter options must contain a value named 'worker-command' consisting of the
+command which starts a worker. The options may also contain a value named
+'command-arguments' consisting of a JSON object with named argument values to apply to
+the command, which is a standard Python string.format() template.
+
+Workers talk to the filter over STDIN and STDOUT with a line delimited JSON protocol. For
+every input file the filter writes one job line to the worker's STDIN:
+
+    {"id": 1, "pathIn": "/tmp/sd1/foo.obj", "pathOut": "/tmp/sd2/foo.babylon", "arguments": {}}
+
+The paths are absolute, so workers may change their working directory. The worker reads
+the file at pathIn, writes the result to pathOut, and answers with one line on STDOUT
+with the same id:
+
+    {"id": 1, "ok": true}
+
+If the worker can't filter the file it answers with "ok" set to false and an optional
+"error" message. The "arguments" value is the 'job-arguments' option, or an empty object.
+Lines the worker writes to STDOUT which are not answers are logged and otherwise
+ignored; STDERR is not redirected, so worker messages are written to the terminal. When
+STDIN is closed the worker should exit.
+
+Workers are kept in a pool of up to 'workers' processes for each worker command and
+reused by every filter chain run with the same command until shutdownWorkers() is called,
+which the filter and pipeline commands do when they finish. Workers are started when
+first needed. If a worker exits, or its STDIN or STDOUT are closed, while filtering a
+file, the worker is restarted and the file sent to it again, up to 'restarts' times. A
+worker which doesn't answer within 'timeout' seconds is killed, with anything it started,
+and counted as crashed the same way.
+
+The filter checks its options before any file is filtered with validateOptions().
+
+Besides the standard filterFile() functions there are two API functions:
+
+1. getWorkerPool(options, logger) – Returns the shared worker pool for the options
+
+2. shutdownWorkers() – Stops all workers, also called by shutdownFilter()
+
+### Filter File function
+
+Options:
+
+* "in-ext" [optional, string] Specifies the allowed input file extension
+
+* "out-ext" [optional, string] Specifies the output file extension to use
+
+* "worker-command" [required, string] Specifies the command which starts a worker
+
+* "command-arguments" [optional, string] Specifies command arguments which may be replaced
+  by name in the worker command as described above
+
+* "job-arguments" [optional, object] Specifies the "arguments" value sent with each job
+
+* "workers" [optional, integer, default 1] Specifies the most workers to run at the same time
+
+* "restarts" [optional, integer, default 1] Specifies how many times a worker is restarted
+  for one file before the file is counted as failed
+
+* "timeout" [optional, number] Specifies how many seconds a worker may take to answer a
+  job before it is killed and counted as crashed; by default there is no limit
+
+Each input file is filtered on its own, so the filter is 'per-file' and the filter chain
+may send several input files to the pool at the same time; set "workers" to run them in
+parallel.
+
+File Extensions: Determined by option values."""
+
+
+copyright = """SquidSpace.js, the associated tooling, and the documentation are copyright
+Jack William Bell 2020 except where noted. All other content, including HTML files and 3D
+assets, are copyright their respective authors."""
+
+
+import os
+import json
+import queue
+import atexit
+import signal
+import threading
+import subprocess
+from common import forceFileExtension
+from commandrunner import isValidTimeout
+
+
+# Every input file is filtered on its own, so the filter chain may filter several input
+# files at the same time. See filtercommand.processFilterChain().
+perFile = True
+
+# Seconds to wait for a worker to exit after closing its STDIN.
+WORKER_EXIT_TIMEOUT = 5
+
+
+class Worker(object):
+    """One worker process. Only used by one thread at a time."""
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+        self.nextId = 1
+        self.jobLock = threading.Lock() # Guards answered and timedOut against the job timer.
+        self.answered = False
+        self.timedOut = False
+
+    def isRunning(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, logger):
+        """Starts the worker process. Returns True on success, otherwise returns False."""
+        try:
+            self.process = subprocess.Popen(self.command, shell=True, stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE, text=True, bufsize=1, start_new_session=True)
+            return True
+        except OSError:
+            logger.exception("coprocess.Worker.start() - Command '{0}' failed with an exception.".format(self.command))
+
+        # Failed!
+        self.process = None
+        return False
+
+    def kill(self, process = None):
+        """Kills the worker process and anything it started."""
+        process = process or self.process
+        if process is None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (AttributeError, OSError):
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def expire(self, process):
+        """Kills a worker which took too long to answer a job, unless the answer already
+        came. Called by the job timer."""
+        with self.jobLock:
+            if self.answered:
+                return
+            self.timedOut = True
+            self.kill(process)
+
+    def runJob(self, pathIn, pathOut, arguments, logger, timeout = None):
+        """Sends a job to the worker and waits for the answer, up to timeout seconds if 
+        passed. Returns True if the worker filtered the file, False if it could not, or 
+        None if the worker crashed or was killed for taking too long."""
+        jobId = self.nextId
+        self.nextId = self.nextId + 1
+
+        # Killing the worker closes its STDOUT, which ends the wait for the answer.
+        timer = None
+        self.answered = False
+        self.timedOut = False
+        if timeout:
+            timer = threading.Timer(timeout, self.expire, (self.process,))
+            timer.daemon = True
+            timer.start()
+
+        try:
+            self.process.stdin.write(json.dumps({"id": jobId, "pathIn": pathIn, "pathOut": pathOut, "arguments": arguments}) + "\n")
+            self.process.stdin.flush()
+
+            # Read lines until the answer.
+            for line in self.process.stdout:
+                try:
+                    answer = json.loads(line)
+                except ValueError:
+                    answer = None
+                if not isinstance(answer, dict) or answer.get("id") != jobId:
+                    logger.debug("coprocess.Worker.runJob() - Worker '{0}' output: {1}".format(self.command, line.rstrip("\n")))
+                    continue
+
+                # Once answered, the job timer leaves the worker alone.
+                with self.jobLock:
+                    self.answered = True
+                if answer.get("ok") != True:
+                    logger.error("coprocess.Worker.runJob() - Worker '{0}' could not filter '{1}': {2}".format(
+                            self.command, pathIn, answer.get("error")))
+                    return False
+                return True
+        except (OSError, ValueError):
+            # Broken pipe, or a pipe closed by a worker which exited.
+            pass
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        # The worker closed STDOUT before answering.
+        if self.timedOut:
+            logger.warning("coprocess.Worker.runJob() - Worker '{0}' took longer than {1} seconds filtering '{2}', killed it.".format(
+                    self.command, timeout, pathIn))
+        return None
+
+    def stop(self):
+        """Stops the worker process, killing it if it doesn't exit when STDIN is closed."""
+        process = self.process
+        self.process = None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        try:
+            process.wait(WORKER_EXIT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.kill(process)
+            process.wait()
+        process.stdout.close()
+
+
+class WorkerPool(object):
+    """A pool of workers for one worker command. Safe to use from multiple threads."""
+    def __init__(self, command, size):
+        self.command = command
+        self.workers = [Worker(command) for i in range(max(1, size))]
+        # Last in, first out, so running workers are used before new ones are started.
+        self.idle = queue.LifoQueue()
+        for worker in reversed(self.workers):
+            self.idle.put(worker)
+
+    def runJob(self, pathIn, pathOut, arguments, restarts, logger, timeout = None):
+        """Filters one file with the next idle worker, starting or restarting it as needed,
+        waiting up to timeout seconds for each answer if passed. Returns True on success, 
+        otherwise returns False."""
+        worker = self.idle.get()
+        try:
+            for attempt in range(max(0, restarts) + 1):
+                if not worker.isRunning():
+                    if attempt > 0:
+                        logger.warning("coprocess.WorkerPool.runJob() - Worker '{0}' crashed, restarting it.".format(self.command))
+                    worker.stop()
+                    if not worker.start(logger):
+                        return False
+
+                result = worker.runJob(pathIn, pathOut, arguments, logger, timeout)
+                if result is not None:
+                    return result
+                worker.stop()
+
+            logger.error("coprocess.WorkerPool.runJob() - Worker '{0}' crashed filtering '{1}'.".format(self.command, pathIn))
+            return False
+        finally:
+            self.idle.put(worker)
+
+    def shutdown(self):
+        """Stops all workers. Call when no jobs are running."""
+        for worker in self.workers:
+            worker.stop()
+
+
+# Worker pools by worker command and pool size.
+pools = {}
+poolsLock = threading.Lock()
+
+
+def getWorkerPool(options, logger):
+    """Returns the shared worker pool for the filter options or None if the options have
+    no valid worker command."""
+    command = None
+    try:
+        command = options["worker-command"].format(**options.get("command-arguments", {}))
+    except:
+        logger.exception("coprocess.getWorkerPool() - Worker command in options '{0}' is invalid.".format(options))
+        return None
+    if not command.strip():
+        logger.error("coprocess.getWorkerPool() - Worker command '{0}' is invalid.".format(command))
+        return None
+
+    size = int(options.get("workers", 1))
+    with poolsLock:
+        pool = pools.get((command, size))
+        if pool is None:
+            pool = WorkerPool(command, size)
+            pools[(command, size)] = pool
+        return pool
+
+
+def shutdownWorkers():
+    """Stops the workers of every pool. Pools are started again when next needed."""
+    with poolsLock:
+        for pool in pools.values():
+            pool.shutdown()
+        pools.clear()
+
+
+atexit.register(shutdownWorkers)
+
+
+def shutdownFilter():
+    """SQS shutdown filter function. Stops all workers; see shutdownWorkers()."""
+    shutdownWorkers()
+
+
+def validateOptions(options, logger):
+    """SQS validate options function. Returns True if the options have a worker command
+    which can be filled in and valid pool settings, otherwise logs the problem and returns
+    False."""
+    arguments = options.get("command-arguments", {})
+    if not isinstance(arguments, dict):
+        logger.error("coprocess.validateOptions() - 'command-arguments' must be an object.")
+        return False
+    command = options.get("worker-command")
+    if not isinstance(command, str) or not command.strip():
+        logger.error("coprocess.validateOptions() - No or invalid 'worker-command' option supplied.")
+        return False
+    try:
+        command.format(**arguments)
+    except (KeyError, IndexError, ValueError) as e:
+        logger.error("coprocess.validateOptions() - Could not fill in worker command '{0}': {1!r}.".format(command, e))
+        return False
+    if not isinstance(options.get("job-arguments", {}), dict):
+        logger.error("coprocess.validateOptions() - 'job-arguments' must be an object.")
+        return False
+    if not isinstance(options.get("workers", 1), int) or options.get("workers", 1) < 1:
+        logger.error("coprocess.validateOptions() - 'workers' must be a positive integer.")
+        return False
+    if not isinstance(options.get("restarts", 1), int) or options.get("restarts", 1) < 0:
+        logger.error("coprocess.validateOptions() - 'restarts' must be zero or a positive integer.")
+        return False
+    if not isValidTimeout(options.get("timeout")):
+        logger.error("coprocess.validateOptions() - 'timeout' must be a positive number of seconds.")
+        return False
+
+    return True
+
+
+def filterFiles(inputs, outputs, options, logger):
+    """SQS filter files function that sends each file to a worker process. The options
+    argument is a dictionary which must contain the named value 'worker-command'."""
+
+    logger.debug("coprocess.filterFiles().")
+
+    # Setup
+    result = 0
+    pool = getWorkerPool(options, logger)
+    if not pool:
+        return result
+    arguments = options.get("job-arguments", {})
+    restarts = int(options.get("restarts", 1))
+    timeout = options.get("timeout")
+
+    # Process input files.
+    for pathIn in inputs:
+        # Output name will be same as input name, optionally with a different file extension.
+        nameOut = os.path.basename(pathIn)
+        if "out-ext" in options:
+            nameOut = forceFileExtension(nameOut, options["out-ext"])
+        pathOut = outputs(nameOut)
+
+        # Filter it.
+        if pool.runJob(os.path.abspath(pathIn), os.path.abspath(pathOut), arguments, restarts, logger, timeout):
+            if os.path.isfile(pathOut):
+                result = result + 1
+            else:
+                logger.error("coprocess.filterFiles() - Worker did not write output file '{0}'.".format(pathOut))
+
+    # Done.
+    return result
@@ -2,10 +2,16 @@
 
 Merges multiple input files into a single output file.
 
-Besides the standard filterFile() functions there is one API function:
+Besides the standard filterFile() functions there are two API functions:
 
 1. mergeFiles(pathInList, pathOut, options, logger) – Merges files
 
+2. mergeBuffers(dataInList, options) – Merges in-memory file data
+
+The filter also supports in-memory filtering with filterBuffers().
+
+The filter checks its options before any file is filtered with validateOptions().
+
 ### Filter File function
 
 Options: 
@@ -24,6 +30,7 @@ assets, are copyright their respective authors."""
 
 import os
 from common import forceFileExtension
+from copyengine import copyStream
 
 
 def mergeFiles(pathInList, pathOut, options, logger):
@@ -37,7 +44,6 @@ def mergeFiles(pathInList, pathOut, options, logger):
     logger.debug("merge.mergeFiles() - Processing pathOut: {pathOut} options: %{options}.".format(pathOut=pathOut, options=options))
     
     # Setup
-    chunkSize = 4096 # 4KB
     result = 0
     sep = None
     if "file-separator" in options:
@@ -55,11 +61,8 @@ def mergeFiles(pathInList, pathOut, options, logger):
                 # Open input file
                 inFile = open(pathIn, 'rb')
             
-                # Transfer data in chunks.
-                chunk = inFile.read(chunkSize)
-                while chunk:
-                    outFile.write(chunk)
-                    chunk = inFile.read(chunkSize)
+                # Transfer the data.
+                copyStream(inFile, outFile)
             
                 # Add separator?
                 if sep:
@@ -84,6 +87,34 @@ def mergeFiles(pathInList, pathOut, options, logger):
     return result
     
 
+def mergeBuffers(dataInList, options):
+    """Merges a list of bytes objects and returns the merged bytes.
+    
+    Options: 
+
+    * "file-separator" [optional, string] Specifies a string value to insert between each file
+    """
+    sep = b""
+    if "file-separator" in options:
+        sep = bytes(options["file-separator"], 'utf-8')
+    
+    # The separator goes after every file, including the last one, like mergeFiles().
+    return b"".join(data + sep for data in dataInList)
+    
+
+def validateOptions(options, logger):
+    """SQS validate options function. Returns True if the options have an 'out-name', 
+    otherwise logs the problem and returns False."""
+    if not isinstance(options.get("out-name"), str) or not options["out-name"]:
+        logger.error("merge.validateOptions() - No or invalid 'out-name' option supplied.")
+        return False
+    if not isinstance(options.get("file-separator", ""), str):
+        logger.error("merge.validateOptions() - 'file-separator' must be a string.")
+        return False
+    
+    return True
+
+
 def filterFiles(inputs, outputs, options, logger):
     """SQS filter files function that merges files."""
     
@@ -102,4 +133,24 @@ def filterFiles(inputs, outputs, options, logger):
     
     # Done.
     return result
-    
\ No newline at end of file
+
+
+def filterBuffers(inputs, outputs, options, logger):
+    """SQS filter buffers function that merges in-memory files."""
+    
+    logger.debug("merge.filterBuffers().")
+    
+    # Setup
+    result = 0
+    outName = None
+    if "out-name" in options:
+        outName = options["out-name"]
+        
+    if not outName:
+        logger.error("merge.filterBuffers() - No or invalid 'out-name' option supplied.")
+    else:
+        outputs(os.path.basename(outName), mergeBuffers([data for name, data in inputs], options))
+        result = len(inputs)
+    
+    # Done.
+    return result
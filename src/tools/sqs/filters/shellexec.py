@@ -14,10 +14,28 @@ The expectation of any command used as a filter is as follows: the shell command
 read in pathIn, make changes to it, and write the result out to pathOut. Shell commands which 
 do not support this paradigm are not usable as filters.
 
-There is no direct support for mapping the pathIn and pathOut parameters to STDIN 
-and STDOUT for commands supporting that usage. However, it is possible to map them in the
-template string using redirection. It is also possible to support multiple commands in a 
-single command template using pipes.
+Commands which read their input from STDIN and write their output to STDOUT can be run
+in 'stream' mode by setting the 'stream' option to true. In stream mode the input file is
+connected to STDIN and STDOUT is written to the output file, so the template should not
+contain '{pathIn}' or '{pathOut}'. When several stream mode 'shellexec' steps follow each 
+other in a filter chain, the filter chain connects the commands with pipes, so they run at
+the same time and no intermediate files are written. (See makeStreamCommand() below.) It is
+also possible to support multiple commands in a single command template using pipes.
+
+Commands which accept many input files at once can be run in 'batch' mode by supplying a
+'batch-command-template' option instead of 'command-template'. The batch template has two
+specified template values: '{pathsIn}', which is replaced by the space separated and shell
+quoted input file paths, and '{outDir}', which is replaced by the shell quoted output 
+directory. The command must write an output file for every input file to the output 
+directory, using the same file name optionally with the "out-ext" file extension. If there
+are too many input files for a single command line the command is run several times, each 
+time with as many input files as fit. (See makeBatchCommands() below.) After each command
+the output file for every input file is checked, so missing outputs are counted as failed.
+Batch mode is not used in stream mode.
+
+A command which runs longer than the "timeout" option is killed, along with any processes 
+it started, and counts as failed. The wall time, CPU time and peak memory of every command 
+are added to the run's command report. (See commandrunner.py.)
 
 No attempt is made to suppress STDOUT and STDERR output from the command, so command output
 will be written to the terminal during execution unless redirected in the template string.
@@ -25,10 +43,23 @@ will be written to the terminal during execution unless redirected in the templa
 If the command completes with a '0' exit status the filter returns True. Otherwise the filter 
 prints the exit status and returns False.
 
-Besides the standard filterFile() functions there is one API function:
+Besides the standard filterFile() functions there are five API functions:
 
 1. shellExec(pathIn, pathOut, options, logger) – Executes a shell command 
 
+2. filterStreams(options) – Returns True if the options select stream mode
+
+3. makeStreamCommand(nameIn, options, logger) – Returns a tuple of (command, output file 
+   name) for running the stream mode command in a pipe, or None if the command is invalid
+
+4. filterBatches(options) – Returns True if the options select batch mode
+
+5. makeBatchCommands(pathsIn, outDir, options, logger) – Returns a list of (command, input 
+   file path list) tuples running the batch mode command over all input files, or None if 
+   the command is invalid
+
+The filter checks its options before any file is filtered with validateOptions().
+
 ### Filter File function
 
 Options: 
@@ -42,6 +73,18 @@ Options:
 * "command-arguments" [optional, string] Specifies command arguments which may be replaced 
   by name in the command template string as described above
 
+* "stream" [optional, boolean, default false] If true, the command reads the input from
+  STDIN and writes the output to STDOUT as described above
+
+* "batch-command-template" [optional, string] Specifies the batch mode command template 
+  string as described above; replaces "command-template"
+
+* "timeout" [optional, number] Specifies the number of seconds a command may run before
+  it is killed; in batch mode the limit is for each command
+
+Except in batch mode each input file is filtered on its own, so the filter is 'per-file'
+and the filter chain may run the command for several input files at the same time.
+
 File Extensions: Determined by option values."""
 
 
@@ -51,22 +94,154 @@ assets, are copyright their respective authors."""
 
 
 import os
-import subprocess
+import shlex
 from common import forceFileExtension
+from commandrunner import runCommand, isValidTimeout
+
+
+# Linux limits each command line argument to 32 pages, and 'sh -c' gets the whole command 
+# as a single argument.
+MAX_ARG_STRLEN = 131072
+
+# Space left on the command line for the shell and anything we didn't count.
+COMMAND_LENGTH_MARGIN = 4096
+
+
+def perFile(options):
+    """Returns True if every input file is filtered on its own, so the filter chain may 
+    filter several input files at the same time. Batch mode commands get all input files
+    at once. See filtercommand.processFilterChain()."""
+    return not filterBatches(options)
+
+
+def filterStreams(options):
+    """Returns True if the options select stream mode, where the command reads STDIN and
+    writes STDOUT."""
+    return bool(options) and options.get("stream") == True
+
+
+def filterBatches(options):
+    """Returns True if the options select batch mode, where one command filters many input
+    files."""
+    return bool(options) and "batch-command-template" in options and not filterStreams(options)
+
+
+def getCommandLengthLimit():
+    """Returns the longest command, in bytes, which can safely be passed to the shell. This
+    is the operating system limit for the command line less the size of the environment,
+    which shares the same space."""
+    argMax = 0
+    try:
+        argMax = os.sysconf("SC_ARG_MAX")
+    except (AttributeError, ValueError, OSError):
+        pass
+    if argMax <= 0:
+        # Windows and other systems without sysconf() use a 32K command line.
+        argMax = 32767
+    envSize = sum(len(name) + len(value) + 2 for name, value in os.environ.items())
+    
+    return max(COMMAND_LENGTH_MARGIN, min(argMax - envSize, MAX_ARG_STRLEN) - COMMAND_LENGTH_MARGIN)
+
+
+def getCommandLabel(options):
+    """Returns the name the command's runs are recorded under in the command report: the
+    command template for the selected mode. See commandrunner.py."""
+    if filterBatches(options):
+        return options.get("batch-command-template")
+    return options.get("command-template")
+
+
+def makeOutputName(nameIn, options):
+    """Returns the output file name for an input file name: the same name, optionally 
+    with the "out-ext" file extension."""
+    nameOut = os.path.basename(nameIn)
+    if options and "out-ext" in options:
+        nameOut = forceFileExtension(nameOut, options["out-ext"])
+    return nameOut
+
+
+def makeStreamCommand(nameIn, options, logger):
+    """Returns a tuple of (command, output file name) for a stream mode command reading
+    the input file name from STDIN, or None if there is no valid command. The command 
+    template may contain any named values in the 'command-arguments' dictionary."""
+    command = None
+    try:
+        command = options["command-template"].format(**options.get("command-arguments", {}))
+    except:
+        logger.exception("shellexec.makeStreamCommand() - Command template in options '{0}' is invalid.".format(options))
+        return None
+    if not command.strip():
+        logger.error("shellexec.makeStreamCommand() - Command '{0}' is invalid.".format(command))
+        return None
+    
+    return (command, makeOutputName(nameIn, options))
+
+
+def makeBatchCommands(pathsIn, outDir, options, logger, lengthLimit = None):
+    """Returns a list of (command, input file path list) tuples for batch mode commands 
+    writing the outputs for the input file paths to outDir, or None if there is no valid 
+    command. Each command gets as many input file paths as fit under the length limit, 
+    which defaults to getCommandLengthLimit(). The command template may contain template 
+    values for pathsIn, outDir and any named values in the 'command-arguments' dictionary."""
+    if lengthLimit is None:
+        lengthLimit = getCommandLengthLimit()
+    
+    template = options["batch-command-template"]
+    arguments = options.get("command-arguments", {})
+    quotedOutDir = shlex.quote(outDir)
+    def formatCommand(quotedPaths):
+        return template.format(pathsIn=" ".join(quotedPaths), outDir=quotedOutDir, **arguments)
+    
+    try:
+        baseLength = len(formatCommand([]).encode("utf-8"))
+    except:
+        logger.exception("shellexec.makeBatchCommands() - Batch command template in options '{0}' is invalid.".format(options))
+        return None
+    if "{pathsIn}" not in template:
+        logger.error("shellexec.makeBatchCommands() - Batch command template '{0}' does not use '{{pathsIn}}'.".format(template))
+        return None
+    
+    # Fill each command with as many paths as fit.
+    result = []
+    chunk = []
+    chunkLength = baseLength
+    for pathIn in pathsIn:
+        quotedPath = shlex.quote(pathIn)
+        pathLength = len(quotedPath.encode("utf-8")) + 1
+        if chunk and chunkLength + pathLength > lengthLimit:
+            result.append((formatCommand(chunk), chunkPaths))
+            chunk = []
+        if not chunk:
+            chunkPaths = []
+            chunkLength = baseLength
+        chunk.append(quotedPath)
+        chunkPaths.append(pathIn)
+        chunkLength = chunkLength + pathLength
+    if chunk:
+        result.append((formatCommand(chunk), chunkPaths))
+    
+    return result
+
 
 def shellExec(pathIn, pathOut, options, logger):
     """Executes a shell command and returns True if the command can be executed and 
     results in a return code of zero, otherwise returns false. The options argument is a  
     dictionary which must contain the named value 'command-template' and may optionally 
     contain the named value 'command-arguments'. The command template may contain template 
-    values for pathIn, pathOut and any named values in the 'command-arguments' dictionary."""
+    values for pathIn, pathOut and any named values in the 'command-arguments' dictionary.
+    
+    In stream mode pathIn is connected to the command's STDIN and STDOUT is written to
+    pathOut. See filterStreams()."""
+    if filterStreams(options):
+        return shellExecStream(pathIn, pathOut, options, logger)
+    
     logger.debug("shellexec.shellExec() - Processing pathIn: {pathIn} pathOut: {pathOut} options: %{options}.".format(pathIn=pathIn, pathOut=pathOut, options=options))
     
     # Create the command to execute.
     command = None
     if "command-template" in options:
         command = options["command-template"]
-        # TODO: Verify "command-arguments" is a dict.
+        # NOTE: validateOptions() checks "command-arguments" is a dict.
         if "command-arguments" in options:
             command = command.format(pathIn=pathIn, pathOut=pathOut, **options["command-arguments"])
         else:
@@ -77,20 +252,64 @@ def shellExec(pathIn, pathOut, options, logger):
         logger.error("shellexec.shellExec() - Command '{0}' is invalid.".format(command))
         return False
     
+    # Execute the command.
+    return runCommand(command, getCommandLabel(options), options.get("timeout"), logger)
+
+
+def shellExecStream(pathIn, pathOut, options, logger):
+    """Executes a stream mode shell command reading pathIn from STDIN and writing STDOUT 
+    to pathOut. Returns True if the command results in a return code of zero, otherwise 
+    returns False."""
+    logger.debug("shellexec.shellExecStream() - Processing pathIn: {pathIn} pathOut: {pathOut} options: %{options}.".format(pathIn=pathIn, pathOut=pathOut, options=options))
+    
+    streamCommand = makeStreamCommand(pathIn, options, logger)
+    if not streamCommand:
+        return False
+    command = streamCommand[0]
+    
     # Execute the command.
     try:
-        retcode = subprocess.call(command, shell=True)
-        if retcode < 0:
-            logger.error("shellexec.shellExec() - Command '{0}' was terminated by a signal. Return code: {1}.".format(
-                    command, -retcode))
-        elif retcode != 0:
-            logger.error("shellexec.shellExec() - Command '{0}' resulted in a non-zero return code. Return code: {1}.".format(
-                    command, retcode))
+        with open(pathIn, 'rb') as stdin, open(pathOut, 'wb') as stdout:
+            return runCommand(command, getCommandLabel(options), options.get("timeout"), logger, stdin, stdout)
     except OSError:
-            logger.exception("shellexec.shellExec() - Command '{0}' failed with an exception.".format(command))
+        logger.exception("shellexec.shellExecStream() - Could not open '{0}' or '{1}'.".format(pathIn, pathOut))
     
-    # Done!
-    return retcode == 0
+    return False
+
+
+def validateOptions(options, logger):
+    """SQS validate options function. Returns True if the options have a command template 
+    for the selected mode which can be filled in, otherwise logs the problem and returns 
+    False."""
+    if not isValidTimeout(options.get("timeout")):
+        logger.error("shellexec.validateOptions() - 'timeout' must be a positive number of seconds.")
+        return False
+    arguments = options.get("command-arguments", {})
+    if not isinstance(arguments, dict):
+        logger.error("shellexec.validateOptions() - 'command-arguments' must be an object.")
+        return False
+    
+    # Fill in the template with stand-in values, so missing names are found now.
+    if filterBatches(options):
+        templateName = "batch-command-template"
+        values = {"pathsIn": "a b", "outDir": "out"}
+    elif filterStreams(options):
+        templateName = "command-template"
+        values = {}
+    else:
+        templateName = "command-template"
+        values = {"pathIn": "a", "pathOut": "b"}
+    template = options.get(templateName)
+    if not isinstance(template, str) or not template.strip():
+        logger.error("shellexec.validateOptions() - No or invalid '{0}' option supplied.".format(templateName))
+        return False
+    try:
+        template.format(**dict(arguments, **values))
+    except (KeyError, IndexError, ValueError) as e:
+        logger.error("shellexec.validateOptions() - Could not fill in '{0}' template '{1}': {2!r}.".format(templateName, template, e))
+        return False
+    
+    return True
 
 
 def filterFiles(inputs, outputs, options, logger):
@@ -101,18 +320,16 @@ def filterFiles(inputs, outputs, options, logger):
     
     logger.debug("shellexec.filterFiles().")
     
+    if filterBatches(options):
+        return shellExecBatch(inputs, outputs, options, logger)
+    
     # Setup
     result = 0
-    outExt = None
-    if "out-ext" in options:
-        outExt = options["out-ext"]
 
     # Process input files.
     for pathIn in inputs:
         # Output name will be same as input name, optionally with a different file extension.
-        nameOut = os.path.basename(pathIn)
-        if outExt:
-            nameOut = forceFileExtension(nameOut, outExt)
+        nameOut = makeOutputName(pathIn, options)
             
         # Filter it.
         if shellExec(pathIn, outputs(nameOut), options, logger):
@@ -120,4 +337,54 @@ def filterFiles(inputs, outputs, options, logger):
             
     # Done.
     return result
-    
\ No newline at end of file
+    
+
+
+def shellExecBatch(inputs, outputs, options, logger):
+    """Executes batch mode shell commands over all input files and returns the number of 
+    input files whose output file was written. An output file only counts if the command
+    created or changed it and the command resulted in a return code of zero."""
+    logger.debug("shellexec.shellExecBatch() - Processing {count} input files options: %{options}.".format(count=len(inputs), options=options))
+    
+    # Find every input's output path and the output directory.
+    pathsOut = [outputs(makeOutputName(pathIn, options)) for pathIn in inputs]
+    if not pathsOut:
+        return 0
+    outDir = os.path.dirname(pathsOut[0])
+    
+    commands = makeBatchCommands(inputs, outDir, options, logger)
+    if not commands:
+        return 0
+    
+    result = 0
+    start = 0
+    for command, chunkPaths in commands:
+        chunkPathsOut = pathsOut[start:start + len(chunkPaths)]
+        start = start + len(chunkPaths)
+        
+        # Remember any existing outputs, so outputs left over from before don't count.
+        before = [getModifiedTime(pathOut) for pathOut in chunkPathsOut]
+        
+        # Execute the command.
+        if not runCommand(command, getCommandLabel(options), options.get("timeout"), logger):
+            continue
+        
+        # Check the output for every input file.
+        for pathIn, pathOut, modified in zip(chunkPaths, chunkPathsOut, before):
+            after = getModifiedTime(pathOut)
+            if after is not None and after != modified:
+                result = result + 1
+            else:
+                logger.error("shellexec.shellExecBatch() - Command did not write output file '{0}' for input file '{1}'.".format(pathOut, pathIn))
+    
+    # Done!
+    return result
+
+
+def getModifiedTime(path):
+    """Returns the modified time of the file at path in nanoseconds or None if there is 
+    no file."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
@@ -28,7 +28,7 @@ import sys
 import os
 import json
 
-from common import ResourceFlavor, ResourceAction, ModuleConfiguration
+from common import ResourceFlavor, ResourceAction, ModuleConfiguration, getSharedPublisher
 from filters.cleanbabylon import cleanBabylonData
 from sqslogger import logger
 
@@ -330,86 +330,82 @@ def processModuleData(defaultConfig, moduleData):
     # Create the module processing configuration.
     modConfig = ModuleConfiguration(defaultConfig, moduleConfig)
     
-    # Open module output file.
-    mf = open(modConfig.genDir + moduleData["module-name"].lower() + ".js", "w")
-    
-    # Write module start.
-    mf.write("var " + moduleData["module-name"] + " = (function(){")
-    if modConfig.pp: mf.write("\n")
+    # Open module output file. It is only replaced if the generated code changed, and
+    # not at all if generating it fails.
+    with getSharedPublisher().openFile(modConfig.genDir + moduleData["module-name"].lower() + ".js", True) as mf:
+        # Write module start.
+        mf.write("var " + moduleData["module-name"] + " = (function(){")
+        if modConfig.pp: mf.write("\n")
         
-    # Write module publics.
-    if modConfig.pp: mf.write("\n" + modConfig.offset)
-    mf.write("return {")
+        # Write module publics.
+        if modConfig.pp: mf.write("\n" + modConfig.offset)
+        mf.write("return {")
     
-    baseOffset = modConfig.offset + modConfig.offset
+        baseOffset = modConfig.offset + modConfig.offset
     
-    # Process resouces.
-    if "resources" in moduleData:
-        resources = moduleData["resources"]
+        # Process resouces.
+        if "resources" in moduleData:
+            resources = moduleData["resources"]
         
-        # Process texture resouces.
-        if "textures" in resources:
-            if modConfig.pp: mf.write("\n" + baseOffset)
-            mf.write("textures: {")
-            for texture in resources["textures"]:
-                insertResourceData(ResourceFlavor.TEXTURE, texture, mf, modConfig, 
-                                    baseOffset + modConfig.offset)
-            mf.write("},")
+            # Process texture resouces.
+            if "textures" in resources:
+                if modConfig.pp: mf.write("\n" + baseOffset)
+                mf.write("textures: {")
+                for texture in resources["textures"]:
+                    insertResourceData(ResourceFlavor.TEXTURE, texture, mf, modConfig, 
+                                        baseOffset + modConfig.offset)
+                mf.write("},")
             
-        # Process material resouces.
-        if "materials" in resources:
-            if modConfig.pp: mf.write("\n" + baseOffset)
-            mf.write("materials: {")
-            for material in resources["materials"]:
-                insertResourceData(ResourceFlavor.MATERIAL, material, mf, 
-                                    modConfig, baseOffset + modConfig.offset)
-            mf.write("},")
-    
-        # Process object resouces.
-        if "objects" in resources:
-            if modConfig.pp: mf.write("\n" + baseOffset)
-            mf.write("objects: {")
-            for obj in resources["objects"]:
-                insertResourceData(ResourceFlavor.OBJECT, obj, mf, modConfig, 
-                                    baseOffset + modConfig.offset)
-            if modConfig.pp: mf.write("\n" + baseOffset)
-            mf.write("},")
+            # Process material resouces.
+            if "materials" in resources:
+                if modConfig.pp: mf.write("\n" + baseOffset)
+                mf.write("materials: {")
+                for material in resources["materials"]:
+                    insertResourceData(ResourceFlavor.MATERIAL, material, mf, 
+                                        modConfig, baseOffset + modConfig.offset)
+                mf.write("},")
+    
+            # Process object resouces.
+            if "objects" in resources:
+                if modConfig.pp: mf.write("\n" + baseOffset)
+                mf.write("objects: {")
+                for obj in resources["objects"]:
+                    insertResourceData(ResourceFlavor.OBJECT, obj, mf, modConfig, 
+                                        baseOffset + modConfig.offset)
+                if modConfig.pp: mf.write("\n" + baseOffset)
+                mf.write("},")
         
-        # Process mod resouces.
-        if "mods" in resources:
+            # Process mod resouces.
+            if "mods" in resources:
+                if modConfig.pp: mf.write("\n" + baseOffset)
+                mf.write("mods: {")
+                for mod in resources["mods"]:
+                    insertResourceData(ResourceFlavor.MOD, mod, mf, modConfig, 
+                                        baseOffset + modConfig.offset)
+                if modConfig.pp: mf.write("\n" + baseOffset)
+                mf.write("},")
+    
+        # Process layouts.
+        if "layouts" in moduleData:
             if modConfig.pp: mf.write("\n" + baseOffset)
-            mf.write("mods: {")
-            for mod in resources["mods"]:
-                insertResourceData(ResourceFlavor.MOD, mod, mf, modConfig, 
-                                    baseOffset + modConfig.offset)
+            mf.write("layouts: {")
+            for layout in moduleData["layouts"]:
+                if modConfig.pp: mf.write("\n" + baseOffset +  modConfig.offset)
+                insertLayoutData(layout, mf, modConfig, baseOffset + modConfig.offset)
             if modConfig.pp: mf.write("\n" + baseOffset)
-            mf.write("},")
-    
-    # Process layouts.
-    if "layouts" in moduleData:
-        if modConfig.pp: mf.write("\n" + baseOffset)
-        mf.write("layouts: {")
-        for layout in moduleData["layouts"]:
-            if modConfig.pp: mf.write("\n" + baseOffset +  modConfig.offset)
-            insertLayoutData(layout, mf, modConfig, baseOffset + modConfig.offset)
-        if modConfig.pp: mf.write("\n" + baseOffset)
-        mf.write("}")
-    
-    # Write module end.
-    if modConfig.pp: mf.write("\n" + modConfig.offset)
-    mf.write("};")
-    if modConfig.pp: mf.write("\n")
-    mf.write("})();")
-    
-    # Do we autoload this module?
-    if modConfig.autoLoad:
+            mf.write("}")
+    
+        # Write module end.
+        if modConfig.pp: mf.write("\n" + modConfig.offset)
+        mf.write("};")
         if modConfig.pp: mf.write("\n")
-        mf.write("SQUIDSPACE.addAutoloadModule(" + moduleData["module-name"] + ");")
-        
+        mf.write("})();")
+    
+        # Do we autoload this module?
+        if modConfig.autoLoad:
+            if modConfig.pp: mf.write("\n")
+            mf.write("SQUIDSPACE.addAutoloadModule(" + moduleData["module-name"] + ");")
     
-    # Clean up.
-    mf.close()
-
     logger.debug("generate.processModuleData() - Processing complete.")
 
 
@@ -453,7 +449,8 @@ def runGenerate(defaultConfig, moduleFileNames):
     # We expect to process a list of file names.
     if not isinstance(moduleFileNames, list):
         moduleFileNames = [moduleFileNames] # Force list.
-        
+    
+    getSharedPublisher().reset()
     for moduleFileName in moduleFileNames:
         if not moduleFileName is None and not moduleFileName == "":
             # Use passed Module File name.
@@ -473,4 +470,6 @@ def runGenerate(defaultConfig, moduleFileNames):
 
         if not moduleFile is None:    
             processModuleFile(defaultConfig, moduleFile)
+    
+    getSharedPublisher().logSummary("generate.runGenerate()")
     
\ No newline at end of file
@@ -15,148 +15,707 @@ assets, are copyright their respective authors."""
 
 import sys
 import os
-from urllib.parse import urlparse
 import json
+import queue
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 from sqslogger import logger
-from common import ResourceFlavor, ModuleConfiguration, ScratchDirManager, getSourceURL, getSourceFile, getDestFile, copySourceToDestAndClose
-from filtercommand import processFilterChain
+from common import ResourceFlavor, ModuleConfiguration, ScratchDirManager, getSourceURL, getSourceFile, getDestFile, copySourceToDestAndClose, copyFileToPath, hashFile, Publisher
+from copyengine import LINK_MODE_COPY
+from buildmanifest import BuildManifest, makeFingerprint, MANIFEST_FILE_NAME
+from pipelinejournal import PipelineJournal, JOURNAL_FILE_NAME, STATUS_STARTED, STATUS_DONE, STATUS_FAILED
+from archivesource import ArchiveSet, isMemberPattern
+from filtercommand import processFilterChain, compileFilterChain, getFilterBranches, getFilterOutSuffixes
+from filterhelpers import shutdownFilters, isFilterBatchable
+from commandrunner import getCommandStats, cancelCommands, COMMAND_REPORT_FILE_NAME
 
     
-def processPipelineForResource(resourceFlavor, elem, scratchDirMgr, modConfig):
-    """Processes the pipeline for one resource file element. TODO: More docs."""
-    logger.debug("pipeline.processPipelineForResource() - Processing pipeline for resource: " + elem["resource-name"])
-    #logger.debug("pipeline.processPipelineForResource() - Processing pipeline for {0} resource: %{1}s".format( resourceFlavor, elem))
+def makeProcessingConfigKey(modConfig):
+    """Returns a list of the module configuration values used to fetch, stage and filter
+    a resource source, so resources are only merged if they would be processed the same
+    way. Values used only to publish, such as the destination directories, are left out."""
+    return [modConfig.bldDir, modConfig.downloadCache, modConfig.downloadOptions, modConfig.memoryThreshold, 
+            modConfig.filterJobs, modConfig.stepCacheSize, modConfig.filterDirs, modConfig.linkMode]
+
+    
+class PipelineResource(object):
+    """A resource element resolved to everything the pipeline needs to fetch, filter, 
+    and publish it."""
+    def __init__(self, name, resourceFlavor, modConfig, sourceKind, source, filters, outputPath, 
+            manifest = None, journal = None, member = None, archives = None):
+        self.name = name
+        self.resourceFlavor = resourceFlavor
+        self.modConfig = modConfig
+        self.sourceKind = sourceKind # One of "file-source", "url-source" or "archive-source".
+        self.source = source
+        self.filters = filters
+        self.outputPath = outputPath
+        self.manifest = manifest
+        self.journal = journal
+        self.member = member # Archive member name or glob, only for "archive-source".
+        self.archives = archives # ArchiveSet used for "archive-source".
+        self.publishedPaths = None # Paths of the published output files, once published.
+        
+        # Resources with the same key produce the same bytes and only need to be
+        # fetched and filtered once. A group is fetched and filtered with its first 
+        # resource's configuration, so the configuration values used for that are part 
+        # of the key; resources from modules configured differently are not merged.
+        self.key = json.dumps([sourceKind, source, member, filters, makeProcessingConfigKey(modConfig)], sort_keys=True)
+        
+    def getDestDirAndStem(self):
+        """Returns a tuple with the destination directory and the destination file name 
+        without the extension."""
+        destDir, destName = os.path.split(self.outputPath)
+        return (destDir, os.path.splitext(destName)[0])
+
+
+def resolveResource(resourceFlavor, elem, modConfig, manifest = None, journal = None, archives = None):
+    """Resolves one resource file element to a PipelineResource. Returns a tuple of 
+    (result, resource), where the resource is None if there is nothing to process. The 
+    result is False if the resource element is invalid, otherwise True. Resources with an 
+    "archive-source" read their archive through the passed ArchiveSet."""
+    logger.debug("pipeline.resolveResource() - Resolving resource: " + str(elem.get("resource-name")))
     
     # Get the element config.
     if not "config" in elem:
         # No need to process!
-        logger.debug("pipeline.processPipelineForResource() - No 'config'; process abort with 'True'.")
-        return True
+        logger.debug("pipeline.resolveResource() - No 'config'; process abort with 'True'.")
+        return (True, None)
     config = elem["config"]
     
     # Get the cache options from the config.
     if not "cache-options" in config:
         # No need to process!
-        logger.debug("pipeline.processPipelineForResource() - No 'cache-options' in 'config'; process abort with 'True'.")
-        return True
+        logger.debug("pipeline.resolveResource() - No 'cache-options' in 'config'; process abort with 'True'.")
+        return (True, None)
     cacheOptions = config["cache-options"]
     
     # Are there any cache options to process?
     if not bool(cacheOptions): # PYTHON TIP: Empty dictionaries evaluate to 'False'. 
         # No need to process!
-        logger.warning("pipeline.processPipelineForResource() - Empty 'cache-options' in 'config'; process abort with 'True'.")
-        return True
+        logger.warning("pipeline.resolveResource() - Empty 'cache-options' in 'config'; process abort with 'True'.")
+        return (True, None)
     
     # Try to get the destination file path.
-    destPath = modConfig.makeResourceFilePath(resourceFlavor, config.get("file-name"))
-    if not destPath:
-        logger.error("pipeline.processPipelineForResource() - Could not determine output file path. Invalid or unspecified file name or configuration.")
+    outputPath = modConfig.makeResourceFilePath(resourceFlavor, config.get("file-name"))
+    if not outputPath:
+        logger.error("pipeline.resolveResource() - Could not determine output file path. Invalid or unspecified file name or configuration.")
+        return (False, None)
+    
+    # Try to get the source.
+    if cacheOptions.get("file-source"):
+        sourceKind = "file-source"
+    elif cacheOptions.get("url-source"):
+        sourceKind = "url-source"
+    elif cacheOptions.get("archive-source"):
+        sourceKind = "archive-source"
+        if not cacheOptions.get("archive-member"):
+            logger.error("pipeline.resolveResource() - No 'archive-member' for 'archive-source' in 'cache-options'.")
+            return (False, None)
+        if not archives:
+            logger.error("pipeline.resolveResource() - No archive set for 'archive-source'.")
+            return (False, None)
+    else:
+        logger.error("pipeline.resolveResource() - Invalid or unspecified file, URL or archive source in 'cache-options'.")
+        return (False, None)
+    
+    # Resolve and check the filter chain before anything is fetched.
+    filters = modConfig.getFilters(cacheOptions.get("filters"), cacheOptions.get("filter-profile"))
+    if filters is None and cacheOptions.get("filter-profile") is not None:
+        logger.error("pipeline.resolveResource() - Unknown filter profile '{0}'.".format(cacheOptions.get("filter-profile")))
+        return (False, None)
+    if filters and compileFilterChain(filters) is None:
+        logger.error("pipeline.resolveResource() - Invalid filter chain for resource '{0}'.".format(elem.get("resource-name")))
+        return (False, None)
+    
+    return (True, PipelineResource(elem.get("resource-name"), resourceFlavor, modConfig, sourceKind, 
+            cacheOptions[sourceKind], filters, outputPath, manifest, journal, 
+            cacheOptions.get("archive-member") if sourceKind == "archive-source" else None, archives))
+
+
+def isGroupCurrent(group, fingerprint):
+    """Returns True if every resource in the group has a manifest showing its output 
+    was built from the fingerprint."""
+    return all(resource.manifest and resource.manifest.isCurrent(resource.outputPath, fingerprint) 
+            for resource in group)
+
+
+# Publishes the outputs to their destinations, counting the files changed by a run. The
+# filter chains publish to the scratch directory with the shared publisher.
+outputPublisher = Publisher()
+
+
+def publishGroupOutputs(group, outputs, stagedStem):
+    """Publishes a list of filter chain output file paths to the destination of every 
+    resource in the group. Output files named after the staged source, or after it plus 
+    a filter branch "out-suffix", are renamed to match each resource's file name, keeping 
+    the suffix; other output files keep their names. The destination paths
+    are kept in each resource's publishedPaths. Returns True on success, otherwise 
+    returns False.
+    
+    NOTE: Outputs are published atomically, and destination files whose bytes don't 
+    change are left alone, see common.Publisher. They are copied or linked as the 
+    resource's "link-mode" configuration value allows."""
+    if not outputs:
+        logger.error("pipeline.publishGroupOutputs() - Filters produced no output for '{0}'.".format(group[0].source))
         return False
     
-    # Try to get the source file path, source file name, and open it as a file.
-    sourcePath = cacheOptions.get("file-source")
-    sourceFile = None
-    if sourcePath:
-        sourceFile = getSourceFile(sourcePath)
+    result = True
+    suffixes = getFilterOutSuffixes(group[0].filters)
+    for resource in group:
+        destDir, destStem = resource.getDestDirAndStem()
+        resource.publishedPaths = []
+        for outputPath in outputs:
+            stem, ext = os.path.splitext(os.path.basename(outputPath))
+            if any(stem == stagedStem + suffix for suffix in suffixes):
+                stem = destStem + stem[len(stagedStem):]
+            destPath = os.path.join(destDir, stem + ext)
+            resource.publishedPaths.append(destPath)
+            if not outputPublisher.publishFile(outputPath, destPath, resource.modConfig.linkMode):
+                logger.error("pipeline.publishGroupOutputs() - Could not publish '{0}'.".format(destPath))
+                result = False
+    
+    return result
+
+
+def updateGroupManifests(group, result, sourceDigest, fingerprint):
+    """Records the outputs of a group in their build manifests on success, with the 
+    paths actually published, such as filter branch outputs, or removes them from the 
+    manifests on failure, so they are rebuilt next time."""
+    for resource in group:
+        if resource.manifest:
+            if result and fingerprint:
+                resource.manifest.record(resource.outputPath, fingerprint, resource.source, sourceDigest, resource.filters,
+                        resource.publishedPaths)
+            else:
+                resource.manifest.forget(resource.outputPath)
+
+
+def recordGroupsInJournal(groups, status):
+    """Records a status for every resource in a list of groups in its journal, if any. 
+    Done resources are recorded with their published paths; for resources which were
+    already up to date, the paths in the manifest."""
+    for group in groups:
+        for resource in group:
+            if resource.journal:
+                outputs = None
+                if status == STATUS_DONE:
+                    outputs = resource.publishedPaths
+                    if outputs is None and resource.manifest:
+                        outputs = resource.manifest.getOutputs(resource.outputPath)
+                resource.journal.record(resource.outputPath, status, outputs)
+
+
+STAGE_FAILED = 0
+STAGE_CURRENT = 1
+STAGE_READY = 2
+
+
+def hashStagedFiles(stagedPaths):
+    """Returns a SHA-256 hex digest for a list of staged source files or None if one of 
+    them could not be read. A single file has the same digest as common.hashFile()."""
+    if len(stagedPaths) == 1:
+        return hashFile(stagedPaths[0])
+    
+    digest = hashlib.sha256()
+    for stagedPath in stagedPaths:
+        fileDigest = hashFile(stagedPath)
+        if not fileDigest:
+            return None
+        digest.update("{0} {1}\n".format(os.path.basename(stagedPath), fileDigest).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def stageArchiveMembers(resource, stagedStem, scratchDirMgr):
+    """Streams the archive members matching a resource's "archive-member" into the 
+    scratch directory. If only one member matches, it is named after the staged stem 
+    with the member file extension; otherwise the members keep their file names. Returns 
+    the list of staged paths or None on failure."""
+    archive = resource.archives.getArchive(resource.source, resource.modConfig)
+    if not archive:
+        logger.error("pipeline.stageArchiveMembers() - Could not open archive '{0}'.".format(resource.source))
+        return None
+    
+    names = archive.getMemberNames(resource.member)
+    if not names:
+        logger.error("pipeline.stageArchiveMembers() - No member matching '{0}' in archive '{1}'.".format(resource.member, resource.source))
+        return None
+    
+    stagedPaths = []
+    for name in names:
+        memberStem, memberExt = os.path.splitext(os.path.basename(name))
+        stagedPath = scratchDirMgr.makeFilePath((stagedStem if len(names) == 1 else memberStem) + memberExt)
+        if stagedPath in stagedPaths:
+            logger.error("pipeline.stageArchiveMembers() - More than one member named '{0}' matches '{1}'.".format(memberStem + memberExt, resource.member))
+            return None
+        memberFile = archive.openMember(name)
+        if not memberFile or not copySourceToDestAndClose(memberFile, getDestFile(stagedPath)):
+            logger.error("pipeline.stageArchiveMembers() - Unable to copy member '{0}' to scratch directory.".format(name))
+            return None
+        stagedPaths.append(stagedPath)
+    
+    return stagedPaths
+
+
+def stageGroupSource(group, scratchDirMgr):
+    """Copies the source shared by a group of resources into the scratch directory, 
+    named after the first resource's file name with the source file extension. Returns 
+    a tuple of (stage status, staged paths, source digest, fingerprint). The status is 
+    STAGE_CURRENT if the build manifests show every output in the group was already 
+    built from the same source bytes and filter chain, STAGE_READY if the source was 
+    staged, or STAGE_FAILED.
+    
+    NOTE: There is only more than one staged path for an "archive-source" with an 
+          "archive-member" glob matching more than one member."""
+    first = group[0]
+    useManifest = any(resource.manifest for resource in group)
+    sourceDigest = None
+    fingerprint = None
+    destDir, stagedStem = first.getDestDirAndStem()
+    
+    if first.sourceKind == "archive-source":
+        # Stream the members straight out of the archive.
+        stagedPaths = stageArchiveMembers(first, stagedStem, scratchDirMgr)
+        if not stagedPaths:
+            return (STAGE_FAILED, None, None, None)
     else:
-        # Try to get the source from a URL.
-        sourcePath = cacheOptions.get("url-source")
-        if sourcePath:
-            url = urlparse(sourcePath)
-            sourceFile = getSourceURL(sourcePath)
+        # Try to open the source as a file. Local files may be linked instead, see 
+        # copyengine.copyFile().
+        sourceFile = None
+        linkSource = first.sourceKind == "file-source" and first.modConfig.linkMode != LINK_MODE_COPY
+        if first.sourceKind == "file-source":
+            # Local files can be checked against the manifest before copying anything.
+            if useManifest:
+                sourceDigest = hashFile(first.source)
+                if sourceDigest:
+                    fingerprint = makeFingerprint(sourceDigest, first.filters)
+                if isGroupCurrent(group, fingerprint):
+                    logger.debug("pipeline.stageGroupSource() - Output '{0}' is up to date; skipping.".format(first.outputPath))
+                    return (STAGE_CURRENT, None, sourceDigest, fingerprint)
+            if not linkSource:
+                sourceFile = getSourceFile(first.source)
         else:
-            logger.error("pipeline.processPipelineForResource() - Invalid or unspecified file or URL source in 'cache-options'.")
-            return False
+            sourceFile = getSourceURL(first.source, first.modConfig.getDownloadCache(), first.modConfig.getDownloader())
+        
+        # Did we get a source file?
+        if not sourceFile and not linkSource:
+            logger.error("pipeline.stageGroupSource() - Could not open source file.")
+            return (STAGE_FAILED, None, None, None)
+        
+        # Re-create the source path from the destination file name and the input file extension.
+        # This way we are starting processing from the name we want to end up with.
+        # NOTE: If the filters change the name we will not have the expected result.
+        # TODO: Need to make this more robust, but not sure how to handle filters which
+        #       do odd things.
+        sourceName, sourceExt = os.path.splitext(os.path.basename(first.source))
+        stagedPath = scratchDirMgr.makeFilePath(stagedStem + sourceExt)
+        
+        # Copy the source to the scratch dir.
+        if linkSource:
+            # Filters may write to their input files, so the source is only hard linked
+            # when there are no filters to change it.
+            if not copyFileToPath(first.source, stagedPath, first.modConfig.linkMode, not first.filters):
+                logger.error("pipeline.stageGroupSource() - Unable to copy source file to scratch directory.")
+                return (STAGE_FAILED, None, None, None)
+        else:
+            scratchDest = getDestFile(stagedPath)
+            if scratchDest:
+                if not copySourceToDestAndClose(sourceFile, scratchDest):
+                    logger.error("pipeline.stageGroupSource() - Unable to copy source file to scratch directory.")
+                    return (STAGE_FAILED, None, None, None)
+            else:
+                sourceFile.close()
+                logger.error("pipeline.stageGroupSource() - Unable to create source file in scratch directory.")
+                return (STAGE_FAILED, None, None, None)
+        stagedPaths = [stagedPath]
     
-    # Did we get a source file?
-    if not sourceFile:
-        logger.error("pipeline.processPipelineForResource() - Could not open source file.")
-        return False
+    # Is the output already up to date? (Remote and archive sources can only be checked 
+    # once fetched.)
+    if useManifest and not sourceDigest:
+        sourceDigest = hashStagedFiles(stagedPaths)
+        if sourceDigest:
+            fingerprint = makeFingerprint(sourceDigest, first.filters)
+        if isGroupCurrent(group, fingerprint):
+            logger.debug("pipeline.stageGroupSource() - Output '{0}' is up to date; skipping filters.".format(first.outputPath))
+            return (STAGE_CURRENT, None, sourceDigest, fingerprint)
+    
+    return (STAGE_READY, stagedPaths, sourceDigest, fingerprint)
+
+
+def processResourceGroup(group, scratchDirMgr):
+    """Fetches and filters the source shared by a group of resources once and publishes 
+    the result to every resource in the group. All resources in the group must have the 
+    same key. Returns True on success, otherwise returns False.
+    
+    The filter chain is skipped if the build manifests show every output in the group 
+    was already built from the same source bytes and filter chain.
     
-    # Clear the scratch dir.
-    # TODO: Determine if we really want to do this here.
+    The start and the outcome of every resource are recorded in its journal, if any."""
+    recordGroupsInJournal([group], STATUS_STARTED)
+    
+    result = False
+    try:
+        result = processResourceGroupSource(group, scratchDirMgr)
+    finally:
+        recordGroupsInJournal([group], STATUS_DONE if result else STATUS_FAILED)
+    
+    return result
+
+
+def processResourceGroupSource(group, scratchDirMgr):
+    """Does the work for processResourceGroup()."""
+    logger.debug("pipeline.processResourceGroupSource() - Processing pipeline for resource: " + str(group[0].name))
+    
+    # Clear the scratch dir and stage the source.
     scratchDirMgr.clear()
+    status, stagedPaths, sourceDigest, fingerprint = stageGroupSource(group, scratchDirMgr)
+    if status != STAGE_READY:
+        return status == STAGE_CURRENT
     
-    # Re-create the source path from the destination file name and the input file extension.
-    # Also strip the name portion from the destination path, so we can use it as a pure path.
-    # This way we are starting processing from the name we want to end up with and providing
-    # a directory path for the result.
-    # NOTE: If the filters change the name we will not have the expected result.
-    # TODO: Need to make this more robust, but not sure how to handle filters which
-    #       do odd things.
-    sourceName, sourceExt = os.path.splitext(os.path.basename(sourcePath))
-    destPath, destName = os.path.split(destPath)
-    destName, destExt = os.path.splitext(destName)
-    sourcePath = scratchDirMgr.makeFilePath(destName + sourceExt)
-    
-    # Copy the source to the scratch dir.
-    scratchDest = getDestFile(sourcePath)
-    if scratchDest:
-        if not copySourceToDestAndClose(sourceFile, scratchDest):
-            logger.error("pipeline.processPipelineForResource() - Unable to copy source file to scratch directory.")
-            return False
-    else:
-        logger.error("pipeline.processPipelineForResource() - Unable to create source file in scratch directory.")
-        return False
+    # Filter the resource file, then publish the result to every destination.
+    publishDir = scratchDirMgr.makeSubDir("publish")
+    result = processFilterChain(stagedPaths, publishDir, scratchDirMgr, group[0].filters, 
+            group[0].modConfig.memoryThreshold, group[0].modConfig.filterJobs, group[0].modConfig.getStepCache(), group[0].modConfig.linkMode)
+    if result:
+        stagedStem = group[0].getDestDirAndStem()[1]
+        result = publishGroupOutputs(group, scratchDirMgr.listFiles("publish"), stagedStem)
     
-    # Filter the resource file.
-    return processFilterChain([sourcePath], destPath, scratchDirMgr,
-            modConfig.getFilters(cacheOptions.get("filters"), cacheOptions.get("filter-profile")))
+    # Update the manifests.
+    updateGroupManifests(group, result, sourceDigest, fingerprint)
+    
+    return result
 
 
-def processModuleData(defaultConfig, moduleData):
-    """Processes the Module Data to manage an asset pipeline."""
+def processResourceBatch(groups, scratchDirMgr):
+    """Processes a batch of resource groups which all use the same filter chain and 
+    have different file names. Every source is staged in the scratch directory and the 
+    filter chain runs once over all of them, then the outputs are mapped back to each 
+    group by file name. Returns a list of results in the same order as the groups.
     
-    #logger.debug("pipeline.processModuleData() - Processing module data %{0}s.".format(moduleData))
-    logger.debug("pipeline.processModuleData() - Processing pipeline for module: " + moduleData["module-name"])
+    If the batched filter chain fails, or writes an output which can't be matched back to
+    a group, the staged groups are processed again one at a time, so failures are 
+    attributed to the right resources."""
+    if len(groups) == 1:
+        return [processResourceGroup(groups[0], scratchDirMgr)]
     
-    # Get module configuration.
-    moduleConfig = {} # Default config is empty dict.
-    if "config" in moduleData:
-        moduleConfig = moduleData["config"]
+    logger.debug("pipeline.processResourceBatch() - Processing batch of {0} resources.".format(len(groups)))
+    recordGroupsInJournal(groups, STATUS_STARTED)
+    results = [False] * len(groups)
+    try:
+        # Stage all sources.
+        scratchDirMgr.clear()
+        staged = [] # Tuples of (group index, staged paths, source digest, fingerprint).
+        for i, group in enumerate(groups):
+            status, stagedPaths, sourceDigest, fingerprint = stageGroupSource(group, scratchDirMgr)
+            if status == STAGE_READY:
+                staged.append((i, stagedPaths, sourceDigest, fingerprint))
+            else:
+                results[i] = status == STAGE_CURRENT
         
-    # Create the module processing configuration.
-    modConfig = ModuleConfiguration(defaultConfig, moduleConfig)
+        if staged:
+            # Filter everything in one pass.
+            publishDir = scratchDirMgr.makeSubDir("publish")
+            if processFilterChain([stagedPath for i, stagedPaths, sourceDigest, fingerprint in staged for stagedPath in stagedPaths], 
+                    publishDir, scratchDirMgr, groups[0][0].filters, 
+                    groups[0][0].modConfig.memoryThreshold, groups[0][0].modConfig.filterJobs, groups[0][0].modConfig.getStepCache(),
+                    groups[0][0].modConfig.linkMode):
+                # Map the outputs back to the groups by file name: the staged name, plus 
+                # one of the filter branch "out-suffix" values, if any. Outputs matching 
+                # no group, or more than one, are not guessed at.
+                stagedStems = [groups[i][0].getDestDirAndStem()[1] for i, stagedPaths, sourceDigest, fingerprint in staged]
+                suffixes = getFilterOutSuffixes(groups[0][0].filters)
+                outputs = {}
+                matched = True
+                for outputPath in scratchDirMgr.listFiles("publish"):
+                    stem = os.path.splitext(os.path.basename(outputPath))[0]
+                    matches = [stagedStem for stagedStem in stagedStems if any(stem == stagedStem + suffix for suffix in suffixes)]
+                    if len(matches) == 1:
+                        outputs.setdefault(matches[0], []).append(outputPath)
+                    elif matches:
+                        logger.warning("pipeline.processResourceBatch() - Batch output '{0}' matches more than one resource.".format(stem))
+                        matched = False
+                    else:
+                        logger.warning("pipeline.processResourceBatch() - Batch output '{0}' does not match a resource.".format(stem))
+                        matched = False
+                if matched:
+                    for stagedStem, (i, stagedPaths, sourceDigest, fingerprint) in zip(stagedStems, staged):
+                        results[i] = publishGroupOutputs(groups[i], outputs.get(stagedStem, []), stagedStem)
+                        updateGroupManifests(groups[i], results[i], sourceDigest, fingerprint)
+            else:
+                matched = False
+                logger.warning("pipeline.processResourceBatch() - Batch filter chain failed.")
+            
+            if not matched:
+                logger.warning("pipeline.processResourceBatch() - Processing the batch's resources one at a time.")
+                for i, stagedPaths, sourceDigest, fingerprint in staged:
+                    results[i] = processResourceGroupSource(groups[i], scratchDirMgr)
+    finally:
+        for i, group in enumerate(groups):
+            recordGroupsInJournal([group], STATUS_DONE if results[i] else STATUS_FAILED)
+    
+    return results
+
     
-    # Create scratchDirMgr.
-    scratchDirMgr = modConfig.getScratchDirManager()
+def processPipelineForResource(resourceFlavor, elem, scratchDirMgr, modConfig, manifest = None):
+    """Processes the pipeline for one resource file element. If a build manifest is 
+    passed, the filter chain is skipped when the manifest shows the same source bytes 
+    and filter chain already produced the output file. Returns True on success, 
+    otherwise returns False."""
+    archives = ArchiveSet(ScratchDirManager(scratchDirMgr.path + "-archives"))
+    try:
+        modConfig.addFilterDirs()
+        result, resource = resolveResource(resourceFlavor, elem, modConfig, manifest, None, archives)
+        if resource is None:
+            return result
+        
+        return processResourceGroup([resource], scratchDirMgr)
+    finally:
+        archives.close()
+        archives.scratchDirMgr.remove()
+
+
+def collectResources(moduleData):
+    """Returns a list of (resource flavor, resource element) tuples for every resource 
+    in the Module Data, in the order the pipeline processes them: textures, materials, 
+    objects, and then mods."""
+    result = []
     
-    # Process resouces.
     if "resources" in moduleData:
         resources = moduleData["resources"]
+        for sectionName, resourceFlavor in (("textures", ResourceFlavor.TEXTURE), 
+                ("materials", ResourceFlavor.MATERIAL), ("objects", ResourceFlavor.OBJECT),
+                ("mods", ResourceFlavor.MOD)):
+            if sectionName in resources:
+                for elem in resources[sectionName]:
+                    result.append((resourceFlavor, elem))
+    
+    return result
+
+
+def planResourceGroups(resources):
+    """Groups a list of PipelineResources by key, so each unique (source, filter chain) 
+    pair is processed exactly once. Returns a list of resource lists in the order each 
+    key was first seen."""
+    groups = {}
+    for resource in resources:
+        groups.setdefault(resource.key, []).append(resource)
+    
+    # PYTHON TIP: Dictionaries keep insertion order.
+    return list(groups.values())
+
+
+def isChainBatchable(filterChain):
+    """Returns True if every filter in the filter chain, including the filters of any 
+    branches, is batchable, so the outputs of a batch can be matched back to their 
+    resources by file name. See filterhelpers.isFilterBatchable()."""
+    if not filterChain:
+        return True
+    branches = getFilterBranches(filterChain)
+    if branches is not None:
+        filterChain = filterChain[:-1]
+        if not all(isinstance(branch, dict) and isChainBatchable(branch.get("filters") or []) for branch in branches):
+            return False
+    return all(isinstance(fd, dict) and isFilterBatchable(fd.get("filter"), fd.get("options")) for fd in filterChain)
+
+
+def planResourceBatches(groups):
+    """Collects resource groups which use the same filter chain and processing 
+    configuration into batches. Groups are staged by file name, so a group is only added 
+    to a batch if no other group in the batch has the same file name. Groups taking members from an archive by glob pattern 
+    are never batched, and neither are groups whose filter chain has many-to-one filters, 
+    such as 'merge', since their outputs can't be matched back by file name. Returns a 
+    list of group lists."""
+    batches = {}
+    unbatched = []
+    for group in groups:
+        if (group[0].member and isMemberPattern(group[0].member)) or not isChainBatchable(group[0].filters):
+            unbatched.append([group])
+            continue
+        chainKey = json.dumps([group[0].filters, makeProcessingConfigKey(group[0].modConfig)], sort_keys=True)
+        stem = group[0].getDestDirAndStem()[1]
+        for stems, batch in batches.setdefault(chainKey, []):
+            if not stem in stems:
+                stems.add(stem)
+                batch.append(group)
+                break
+        else:
+            batches[chainKey].append(({stem}, [group]))
+    
+    return [batch for chainBatches in batches.values() for stems, batch in chainBatches] + unbatched
 
-        # TODO: Determine if we should check processPipelineForResource() return value and stop all 
-        #       processing on failure. Currently will continue processing with next resource.
+
+def processResourceGroups(groups, scratchDirMgr, jobs = 1, batch = False):
+    """Processes a list of resource groups and returns a list of results in the same 
+    order as the passed groups, no matter what order they were processed in.
+    
+    If batch is True, groups using the same filter chain are processed together with a
+    single filter chain run. See processResourceBatch().
+    
+    If jobs is greater than one, up to that many groups (or batches) are processed 
+    concurrently by a pool of worker threads. Each worker gets its own scratch sub 
+    directory, so workers never clear or overwrite each other's intermediate files.
+    
+    NOTE: Most of the pipeline time is spent waiting on downloads and external filter
+    commands, which release the GIL, so threads are enough to keep the cores busy."""
+    # TODO: Determine if we should stop all processing on failure. Currently will 
+    #       continue processing with next resource.
+    units = [[group] for group in groups]
+    if batch:
+        units = planResourceBatches(groups)
+    
+    if jobs <= 1 or len(units) <= 1:
+        unitResults = [processResourceBatch(unit, scratchDirMgr) for unit in units]
+    else:
+        # Each worker checks a scratch dir manager out of the queue for the duration of 
+        # one unit, so no two units in flight ever share a scratch directory.
+        jobs = min(jobs, len(units))
+        workerScratch = queue.Queue()
+        for i in range(jobs):
+            workerScratch.put(scratchDirMgr.makeSubScratchDirManager("worker-{0}".format(i)))
         
-        # Process texture resouces.
-        if "textures" in resources:
-            for texture in resources["textures"]:
-                processPipelineForResource(ResourceFlavor.TEXTURE, texture, scratchDirMgr, modConfig)
-            
-        # Process material resouces.
-        if "materials" in resources:
-            for material in resources["materials"]:
-                processPipelineForResource(ResourceFlavor.MATERIAL, material, scratchDirMgr, modConfig)
+        def processUnit(unit):
+            workerScratchDirMgr = workerScratch.get()
+            try:
+                return processResourceBatch(unit, workerScratchDirMgr)
+            except:
+                logger.exception("pipeline.processResourceGroups() - Processing resource '{0}' failed with an exception.".format(unit[0][0].name))
+                return [False] * len(unit)
+            finally:
+                workerScratch.put(workerScratchDirMgr)
+        
+        # PYTHON TIP: Executor.map() returns results in the order of the inputs.
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            unitResults = list(executor.map(processUnit, units))
+    
+    # Put the results back in group order.
+    results = {}
+    for unit, unitResult in zip(units, unitResults):
+        for group, result in zip(unit, unitResult):
+            results[group[0].key] = result
+    
+    return [results[group[0].key] for group in groups]
+
+
+def logResultsSummary(moduleName, results):
+    """Logs a summary of the (resource name, result) tuples for one module."""
+    failed = [name for name, result in results if not result]
+    logger.info("pipeline.processModules() - Module '{0}': {1} resources processed, {2} succeeded, {3} failed.".format(
+            moduleName, len(results), len(results) - len(failed), len(failed)))
+    for name in failed:
+        logger.warning("pipeline.processModules() - Module '{0}': resource '{1}' failed.".format(moduleName, name))
+
+
+def processModules(defaultConfig, moduleDataList, jobs = 1, force = False, resume = False, batch = False):
+    """Processes a list of Module Data objects as one pipeline run. Returns a list with 
+    one list of (resource name, result) tuples per module, in resource order.
+    
+    The whole run is planned up front: when resources in any of the modules share the 
+    same source and the same filter chain, the source is fetched and filtered once and 
+    the result is published to every destination file name.
+    
+    Resources are tracked in a build manifest in each module's 'build-dir', so resources 
+    whose source and filter chain did not change since the last run are not filtered 
+    again. If force is True all resources are rebuilt.
+    
+    Every run records the status of each output in a journal in the 'build-dir'. If 
+    resume is True, outputs the journal shows as done are skipped without fetching their 
+    sources, so only missing, failed, or interrupted resources are processed.
     
-        # Process object resouces.
-        if "objects" in resources:
-            for obj in resources["objects"]:
-                processPipelineForResource(ResourceFlavor.OBJECT, obj, scratchDirMgr, modConfig)
+    Up to jobs unique (source, filter chain) pairs are processed concurrently. If batch 
+    is True, resources using the same filter chain are filtered together with one 
+    filter chain run. See processResourceGroups()."""
+    manifests = {}
+    journals = {}
+    resumed = 0
+    moduleResults = []
+    pending = [] # Tuples of (module index, resource index, resource).
+    
+    # Archives are opened once for the whole run; downloaded archives are kept in their
+    # own scratch directory, so workers clearing theirs don't remove them.
+    runScratchDirMgr = ModuleConfiguration(defaultConfig, {}).getScratchDirManager()
+    archives = ArchiveSet(runScratchDirMgr.makeSubScratchDirManager("archives"))
+    
+    # Resolve every resource of every module.
+    for moduleIndex, moduleData in enumerate(moduleDataList):
+        logger.debug("pipeline.processModules() - Planning pipeline for module: " + moduleData["module-name"])
+        
+        # Create the module processing configuration and find its plug-in filters.
+        modConfig = ModuleConfiguration(defaultConfig, moduleData.get("config", {}))
+        modConfig.addFilterDirs()
+        
+        # Get the build manifest. Modules with the same 'build-dir' share it.
+        manifestPath = os.path.join(modConfig.bldDir, MANIFEST_FILE_NAME)
+        if not manifestPath in manifests:
+            manifests[manifestPath] = BuildManifest(manifestPath, force)
+        manifest = manifests[manifestPath]
         
-        # Process mod resouces.
-        if "mods" in resources:
-            for mod in resources["mods"]:
-                processPipelineForResource(ResourceFlavor.MOD, mod, scratchDirMgr, modConfig)
+        # Get the journal, also shared by modules with the same 'build-dir'.
+        journalPath = os.path.join(modConfig.bldDir, JOURNAL_FILE_NAME)
+        if not journalPath in journals:
+            journals[journalPath] = PipelineJournal(journalPath)
+        journal = journals[journalPath]
+        
+        results = []
+        for resourceFlavor, elem in collectResources(moduleData):
+            result, resource = resolveResource(resourceFlavor, elem, modConfig, manifest, journal, archives)
+            if resource:
+                if resume and journal.isDone(resource.outputPath):
+                    resumed = resumed + 1
+                else:
+                    pending.append((moduleIndex, len(results), resource))
+            results.append((elem.get("resource-name"), result))
+        moduleResults.append(results)
+    
+    # Plan and process.
+    if resume:
+        logger.info("pipeline.processModules() - Resuming: {0} resources already done, {1} to process.".format(resumed, len(pending)))
+    groups = planResourceGroups([resource for moduleIndex, resourceIndex, resource in pending])
+    logger.debug("pipeline.processModules() - {0} resources use {1} unique source and filter pairs.".format(len(pending), len(groups)))
+    scratchDirMgr = runScratchDirMgr.makeSubScratchDirManager("work")
+    getCommandStats().reset()
+    outputPublisher.reset()
+    try:
+        groupResults = dict(zip((group[0].key for group in groups), processResourceGroups(groups, scratchDirMgr, jobs, batch)))
+    except KeyboardInterrupt:
+        # Commands run in their own process groups, so they didn't get the interrupt.
+        cancelCommands()
+        raise
+    finally:
+        # Cleanup.
+        for manifest in manifests.values():
+            manifest.save()
+        for journal in journals.values():
+            journal.close()
+        archives.close()
+        shutdownFilters()
+        runScratchDirMgr.remove()
     
-    # Cleanup.
-    scratchDirMgr.remove()
+    # Fan the results back out to the resources.
+    for moduleIndex, resourceIndex, resource in pending:
+        results = moduleResults[moduleIndex]
+        results[resourceIndex] = (results[resourceIndex][0], groupResults[resource.key])
+    
+    # Report the cost of the commands run.
+    getCommandStats().logReport()
+    getCommandStats().writeReport(os.path.join(ModuleConfiguration(defaultConfig, {}).bldDir, COMMAND_REPORT_FILE_NAME))
+    outputPublisher.logSummary("pipeline.processModules()")
     
     # Done.
-    logger.debug("pipeline.processModuleData() - Processing complete.")
+    for moduleData, results in zip(moduleDataList, moduleResults):
+        logResultsSummary(moduleData["module-name"], results)
+    logger.debug("pipeline.processModules() - Processing complete.")
+    
+    return moduleResults
+
 
+def processModuleData(defaultConfig, moduleData, jobs = 1, force = False, resume = False, batch = False):
+    """Processes the Module Data to manage an asset pipeline. Returns a list of 
+    (resource name, result) tuples in resource order. See processModules()."""
+    return processModules(defaultConfig, [moduleData], jobs, force, resume, batch)[0]
 
-def processModuleString(defaultConfig, moduleDataString):
+
+def processModuleString(defaultConfig, moduleDataString, jobs = 1, force = False, resume = False, batch = False):
     """Loads JSON Module Data from a string and processes it."""
 
     # Assume failure.
@@ -169,10 +728,10 @@ def processModuleString(defaultConfig, moduleDataString):
         return
         
     if not moduleData is None:    
-        processModuleData(defaultConfig, moduleData)
+        processModuleData(defaultConfig, moduleData, jobs, force, resume, batch)
         
 
-def processModuleFile(defaultConfig, moduleFile):
+def processModuleFile(defaultConfig, moduleFile, jobs = 1, force = False, resume = False, batch = False):
     """Loads JSON module data from a file-like object and processes it."""
         
     # Assume failure.
@@ -185,13 +744,20 @@ def processModuleFile(defaultConfig, moduleFile):
         return
         
     if not moduleData is None:    
-        processModuleData(defaultConfig, moduleData)
+        processModuleData(defaultConfig, moduleData, jobs, force, resume, batch)
 
 
-def runPipeline(defaultConfig, moduleFileNames):
-    """SQS pipeline command."""
+def runPipeline(defaultConfig, moduleFileNames, jobs = 1, force = False, resume = False, batch = False):
+    """SQS pipeline command. All module files are loaded first and processed as one 
+    run, so sources shared between modules are fetched and filtered once. The jobs 
+    argument is the maximum number of resources processed concurrently. If force is 
+    True, resources are rebuilt even if the build manifest shows they are up to date.
+    If resume is True, only resources which are missing, failed or were interrupted in 
+    an earlier run are processed. If batch is True, resources sharing a filter chain 
+    are filtered together. Returns the results from processModules()."""
     # Assume Failure.
     moduleFile = None
+    moduleDataList = []
 
     # We expect to process a list of file names.
     if not isinstance(moduleFileNames, list):
@@ -215,5 +781,14 @@ def runPipeline(defaultConfig, moduleFileNames):
             moduleFile = sys.stdin
 
         if not moduleFile is None:    
-            processModuleFile(defaultConfig, moduleFile)
+            try:
+                moduleDataList.append(json.load(moduleFile))
+            except json.JSONDecodeError:
+                logger.exception("pipeline.runPipeline() - Error loading Module File.")
+            finally:
+                if moduleFile is not sys.stdin:
+                    moduleFile.close()
+            moduleFile = None
+    
+    return processModules(defaultConfig, moduleDataList, jobs, force, resume, batch)
     
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""## SQS Pipeline Journal API
+
+The pipeline journal is an append-only log in the 'build-dir' recording what happened
+to every resource output. Each line is a JSON object:
+
+    {"output": "assets/textures/foo.png", "status": "started", "time": 1602020202.5}
+
+The status is one of:
+
+* "started" – Processing of the output began
+
+* "done" – The output was published successfully
+
+* "failed" – Processing failed
+
+"done" lines also list the files actually published for the output in "outputs", when
+they are not just the output file, such as the files of a filter chain ending with
+'branches' with an "out-suffix". An output is only done if all of them exist.
+
+Every line is flushed as soon as it is written, so if a run is killed the journal still
+shows which outputs finished. An output whose last status is "started" was interrupted.
+The pipeline '--resume' mode uses the journal to process only outputs which are
+missing, failed or interrupted.
+
+When a run finishes, the journal is compacted to the last line for each output.
+
+Several pipeline runs can share the journal. Lines are appended under a shared lock on
+'pipeline.journal.lock' and the journal is compacted under an exclusive lock, keeping
+the lines of every run; a run whose journal file was compacted by another run reopens
+it before appending.
+"""
+
+
+copyright = """SquidSpace.js, the associated tooling, and the documentation are copyright
+Jack William Bell 2020 except where noted. All other content, including HTML files and 3D
+assets, are copyright their respective authors."""
+
+
+import os
+import json
+import time
+import threading
+from sqslogger import logger
+from filelock import FileLock, LOCK_FILE_SUFFIX
+
+
+JOURNAL_FILE_NAME = "pipeline.journal"
+
+STATUS_STARTED = "started"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class PipelineJournal(object):
+    """Reads and appends to a pipeline journal. Safe to use from multiple threads in the
+    same process."""
+    def __init__(self, journalPath):
+        """Loads the existing journal at the passed path, if any."""
+        self.path = journalPath
+        self.lock = threading.Lock()
+        self.file = None
+        self.status = {}
+        self.outputs = {}
+        self.load()
+
+    def makeLock(self, shared = False):
+        """Returns a FileLock on the journal's lock file."""
+        return FileLock(self.path + LOCK_FILE_SUFFIX, shared)
+
+    def isFileCurrent(self):
+        """Returns True if the open journal file is still the one at the journal path."""
+        try:
+            return os.path.samestat(os.fstat(self.file.fileno()), os.stat(self.path))
+        except FileNotFoundError:
+            return False
+
+    def setStatus(self, outputPath, status, outputs):
+        """Sets the status and published files of the output path in memory."""
+        self.status[outputPath] = status
+        if outputs:
+            self.outputs[outputPath] = outputs
+        else:
+            self.outputs.pop(outputPath, None)
+
+    def load(self):
+        """Loads the last status of every output from the journal file. Lines which
+        can't be parsed, such as a line cut off by a crash, are ignored."""
+        self.status = {}
+        self.outputs = {}
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.setStatus(entry["output"], entry["status"], entry.get("outputs"))
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        pass
+        except:
+            logger.warning("pipelinejournal.PipelineJournal.load() - Could not read journal '{0}'.".format(self.path))
+
+    def getStatus(self, outputPath):
+        """Returns the last recorded status for the output path or None."""
+        with self.lock:
+            return self.status.get(outputPath)
+
+    def isDone(self, outputPath):
+        """Returns True if the output was last recorded as done and all of its published
+        files still exist."""
+        with self.lock:
+            status = self.status.get(outputPath)
+            outputs = self.outputs.get(outputPath) or [outputPath]
+        return status == STATUS_DONE and all(os.path.isfile(filePath) for filePath in outputs)
+
+    def record(self, outputPath, status, outputs = None):
+        """Appends a status line for the output path, with the list of files published
+        for it if they are not just the output path, and flushes it."""
+        entry = {"output": outputPath, "status": status, "time": time.time()}
+        if outputs:
+            outputs = sorted(outputs)
+            entry["outputs"] = outputs
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            self.setStatus(outputPath, status, outputs)
+            try:
+                dirPath = os.path.dirname(self.path)
+                if dirPath: os.makedirs(dirPath, exist_ok=True)
+                with self.makeLock(True):
+                    # Reopen the journal if another run compacted it.
+                    if self.file is not None and not self.isFileCurrent():
+                        self.file.close()
+                        self.file = None
+                    if self.file is None:
+                        self.file = open(self.path, 'a')
+                    self.file.write(line)
+                    self.file.flush()
+            except:
+                logger.exception("pipelinejournal.PipelineJournal.record() - Could not write journal '{0}'.".format(self.path))
+
+    def close(self):
+        """Closes the journal and compacts it to the last status of each output, 
+        including the lines other runs appended."""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            if not self.status:
+                return
+            tempPath = "{0}.tmp-{1}".format(self.path, os.getpid())
+            try:
+                with self.makeLock():
+                    self.load()
+                    with open(tempPath, 'w') as f:
+                        for outputPath in sorted(self.status):
+                            entry = {"output": outputPath, "status": self.status[outputPath]}
+                            if outputPath in self.outputs:
+                                entry["outputs"] = self.outputs[outputPath]
+                            f.write(json.dumps(entry) + "\n")
+                    os.replace(tempPath, self.path)
+            except:
+                logger.exception("pipelinejournal.PipelineJournal.close() - Could not compact journal '{0}'.".format(self.path))
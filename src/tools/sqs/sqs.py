@@ -35,8 +35,8 @@ Usage:
   sqs.py generate <file>... [--config=<cfg>] [--dir=<path>]
   sqs.py build <file>... [--config=<cfg>] [--dir=<path>] 
   sqs.py package <file>... [--config=<cfg>] [--dir=<path>]
-  sqs.py filter <output_directory> <filter_profile> <file>... [--config=<cfg>] [--dir=<path>]
-  sqs.py pipeline <file>... [--config=<cfg>] [--dir=<path>]
+  sqs.py filter <output_directory> <filter_profile> <file>... [--config=<cfg>] [--dir=<path>] [--jobs=<n>]
+  sqs.py pipeline <file>... [--config=<cfg>] [--dir=<path>] [--jobs=<n>] [--force] [--resume] [--batch]
   sqs.py scaffold <project-name> [--config=<cfg>] [--dir=<path>]
   sqs.py serve [--dir=<path>]
   sqs.py explain <command>
@@ -48,6 +48,13 @@ Options:
   --version      Show version
   --config <cfg> Module file to use for default configuration
   --dir <path>   Working directory to use instead of current directory
+  --jobs <n>     Number of pipeline resources, or files for the filter command, to
+                 process concurrently; defaults to 1 for the pipeline command and to
+                 the "filter-jobs" configuration value for the filter command
+  --force        Rebuild pipeline resources even if they are up to date
+  --resume       Only process pipeline resources which are missing, failed or were
+                 interrupted in an earlier run
+  --batch        Run each pipeline filter chain once for all resources using it
 
 """
 
@@ -73,6 +80,18 @@ from servecommand import runServer, __doc__ as serveDoc
 ver = "sqs v0.5"
 
 
+def getJobsArgument(arguments, default):
+    """Returns the '--jobs' argument as an integer, or the default if not supplied. 
+    Exits if the argument is not a valid integer."""
+    if arguments['--jobs'] == None:
+        return default
+    try:
+        return int(arguments['--jobs'])
+    except ValueError:
+        logger.error("Invalid '--jobs' value '{0}'. Must be an integer.".format(arguments['--jobs']))
+        sys.exit(1)
+
+
 if __name__ == '__main__':
     arguments = docopt(__doc__, version=ver)
     
@@ -118,10 +137,13 @@ if __name__ == '__main__':
     elif arguments['package']:
         logger.warning("Command 'package' not yet implemented.")
     elif arguments['filter']:
+        jobs = getJobsArgument(arguments, None)
         runFilter(defaultConfig, arguments['<filter_profile>'], arguments['<file>'],
-                    arguments['<output_directory>'])
+                    arguments['<output_directory>'], jobs)
     elif arguments['pipeline']:
-        runPipeline(defaultConfig, arguments['<file>'])
+        jobs = getJobsArgument(arguments, 1)
+        runPipeline(defaultConfig, arguments['<file>'], jobs, arguments['--force'], arguments['--resume'],
+                arguments['--batch'])
     elif arguments['scaffold']:
         logger.warning("Command 'scaffold' not yet implemented.")
     elif arguments['serve']:
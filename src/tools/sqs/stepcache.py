@@ -0,0 +1,256 @@
+"""## SQS Filter Step Cache API
+
+An on-disk cache of filter step results, so when only the end of a filter chain changes
+the unchanged steps before it are not run again. Each cache entry holds the output files
+of one filter step and is keyed by a SHA-256 digest of:
+
+* the name and content digest of every input file, in order
+
+* the filter name and options of every filter in the step
+
+So an entry is only used when a step gets exactly the same input bytes and settings.
+Each entry is a directory in the cache directory named with its key, holding the output
+files plus a 'step.json' file with the file count the filter returned and the output
+file names. Entries are written to a temporary directory first and renamed into place,
+so a partly written entry is never used.
+
+The cache is limited to a size budget in bytes. When it grows past the budget the least
+recently used entries are removed until it fits. Using an entry marks it as recently
+used by touching its 'step.json' file, so the order survives between runs.
+
+Several processes can share the cache directory. Entries are added and removed under an
+exclusive lock on 'cache.lock' in the cache directory, and read under a shared lock, so
+an entry is never removed while another process copies its files. Hold the lock from 
+reading() while using the paths returned by get(). See filelock.py.
+
+NOTE: Filters must be deterministic for their results to be cached: the same input
+files and options must always give the same output files. For shell commands, clear the
+cache directory after upgrading the tools the commands run.
+
+Usage:
+
+    cache = getSharedStepCache("build/cache/steps/", 1024 * 1024 * 1024)
+    key = makeStepKey(step, [("foo.png", digest)])
+    with cache.reading():
+        cached = cache.get(key)
+        ...
+    if cached is None:
+        ...
+        cache.putFiles(key, count, outputPaths)
+"""
+
+
+copyright = """SquidSpace.js, the associated tooling, and the documentation are copyright
+Jack William Bell 2020 except where noted. All other content, including HTML files and 3D
+assets, are copyright their respective authors."""
+
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+from sqslogger import logger
+from filelock import FileLock
+
+
+# Change when the entry layout or key changes, so old entries are not used.
+STEP_CACHE_VERSION = 1
+
+STEP_FILE_NAME = "step.json"
+
+STEP_CACHE_LOCK_NAME = "cache.lock"
+
+
+def makeStepKey(step, inputs):
+    """Returns the cache key for a filter step, a list of filter declarations, run on a
+    list of (file name, content digest) tuples."""
+    keyData = {
+        "version": STEP_CACHE_VERSION,
+        "filters": [[fd.get("filter"), fd.get("options")] for fd in step],
+        "inputs": [[name, digest] for name, digest in inputs]
+    }
+    return hashlib.sha256(json.dumps(keyData, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def isStepCacheable(step):
+    """Returns True unless a filter declaration in the step turns caching off with
+    "cache": false."""
+    return all(fd.get("cache", True) for fd in step)
+
+
+class StepCache(object):
+    """Manages a directory of cached filter step results. Safe to use from multiple
+    threads in the same process."""
+    def __init__(self, cachePath, maxSize):
+        self.path = cachePath
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        self.entries = None # Key to [size, last used time], loaded when first needed.
+        self.loadedTime = None # Modified time of the cache directory when the entries were loaded.
+        self.tempCount = 0
+
+    def getEntryPath(self, key):
+        return os.path.join(self.path, key)
+
+    def makeFileLock(self, shared = False):
+        """Returns a FileLock on the cache, shared between processes. Take it before the 
+        thread lock."""
+        os.makedirs(self.path, exist_ok=True)
+        return FileLock(os.path.join(self.path, STEP_CACHE_LOCK_NAME), shared)
+
+    def reading(self):
+        """Returns the shared FileLock to hold while using entries, e.g. 'with 
+        cache.reading():', so other processes don't remove them."""
+        return self.makeFileLock(True)
+
+    def getDirTime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def loadEntries(self, refresh = False):
+        """Reads the size and last used time of every entry. If refresh is True, reads 
+        them again if other processes added or removed entries since. Call with the lock 
+        held."""
+        if self.entries is not None and not (refresh and self.getDirTime() != self.loadedTime):
+            return
+        self.entries = {}
+        self.loadedTime = self.getDirTime()
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+        for key in names:
+            if key == STEP_CACHE_LOCK_NAME:
+                continue
+            stepPath = os.path.join(self.getEntryPath(key), STEP_FILE_NAME)
+            try:
+                with open(stepPath, 'r') as f:
+                    step = json.load(f)
+                self.entries[key] = [step["size"], os.path.getmtime(stepPath)]
+            except (OSError, ValueError, KeyError, TypeError):
+                # Not an entry, or a damaged one.
+                if key != "tmp":
+                    shutil.rmtree(self.getEntryPath(key), ignore_errors=True)
+
+    def getSize(self):
+        """Returns the total size in bytes of all entries."""
+        with self.lock:
+            self.loadEntries()
+            return sum(size for size, lastUsed in self.entries.values())
+
+    def get(self, key):
+        """Returns a tuple of (file count, list of output file paths) for the key or None
+        if the key is not cached. Marks the entry as recently used."""
+        entryPath = self.getEntryPath(key)
+        stepPath = os.path.join(entryPath, STEP_FILE_NAME)
+        with self.lock:
+            self.loadEntries()
+            if key not in self.entries and not os.path.isfile(stepPath):
+                return None
+            try:
+                # The entry may have been added by another process.
+                with open(stepPath, 'r') as f:
+                    step = json.load(f)
+                filePaths = [os.path.join(entryPath, name) for name in step["outputs"]]
+                if not all(os.path.isfile(filePath) for filePath in filePaths):
+                    raise ValueError("Missing output file.")
+                os.utime(stepPath)
+                self.entries[key] = [step["size"], os.path.getmtime(stepPath)]
+                return (step["count"], filePaths)
+            except FileNotFoundError:
+                # Removed by another process.
+                self.entries.pop(key, None)
+                return None
+            except (OSError, ValueError, KeyError, TypeError):
+                logger.warning("stepcache.StepCache.get() - Removing damaged cache entry '{0}'.".format(entryPath))
+                self.entries.pop(key, None)
+                shutil.rmtree(entryPath, ignore_errors=True)
+
+        return None
+
+    def makeTempPath(self):
+        with self.lock:
+            self.tempCount = self.tempCount + 1
+            return os.path.join(self.path, "tmp", "{0}-{1}".format(os.getpid(), self.tempCount))
+
+    def putFiles(self, key, count, filePaths):
+        """Caches a list of output files for the key. Returns True on success, otherwise
+        returns False."""
+        def writeOutputs(tempPath):
+            for filePath in filePaths:
+                shutil.copyfile(filePath, os.path.join(tempPath, os.path.basename(filePath)))
+        return self.put(key, count, [os.path.basename(filePath) for filePath in filePaths],
+                sum(os.path.getsize(filePath) for filePath in filePaths), writeOutputs)
+
+    def putBuffers(self, key, count, buffers):
+        """Caches a list of (file name, bytes) output tuples for the key. Returns True on
+        success, otherwise returns False."""
+        def writeOutputs(tempPath):
+            for name, data in buffers:
+                with open(os.path.join(tempPath, name), 'wb') as f:
+                    f.write(data)
+        return self.put(key, count, [name for name, data in buffers], sum(len(data) for name, data in buffers), writeOutputs)
+
+    def put(self, key, count, names, size, writeOutputs):
+        """Writes an entry with writeOutputs(entry directory path) and renames it into
+        place, then removes least recently used entries until the cache fits its budget."""
+        if size > self.maxSize:
+            logger.debug("stepcache.StepCache.put() - Step outputs are larger than the cache.")
+            return False
+
+        tempPath = self.makeTempPath()
+        try:
+            os.makedirs(tempPath)
+            writeOutputs(tempPath)
+            with open(os.path.join(tempPath, STEP_FILE_NAME), 'w') as f:
+                json.dump({"count": count, "outputs": names, "size": size}, f)
+
+            with self.makeFileLock(), self.lock:
+                self.loadEntries(True)
+                if key in self.entries:
+                    # Another thread or process got there first.
+                    shutil.rmtree(tempPath, ignore_errors=True)
+                    return True
+                os.rename(tempPath, self.getEntryPath(key))
+                self.entries[key] = [size, os.path.getmtime(os.path.join(self.getEntryPath(key), STEP_FILE_NAME))]
+                self.evict()
+                self.loadedTime = self.getDirTime()
+            return True
+        except:
+            logger.exception("stepcache.StepCache.put() - Could not write cache entry '{0}'.".format(key))
+            shutil.rmtree(tempPath, ignore_errors=True)
+
+        return False
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits its budget. Call with
+        the file lock and the lock held."""
+        total = sum(size for size, lastUsed in self.entries.values())
+        if total <= self.maxSize:
+            return
+        for key in sorted(self.entries, key=lambda key: self.entries[key][1]):
+            logger.debug("stepcache.StepCache.evict() - Removing cache entry '{0}'.".format(key))
+            total = total - self.entries.pop(key)[0]
+            shutil.rmtree(self.getEntryPath(key), ignore_errors=True)
+            if total <= self.maxSize:
+                break
+
+
+sharedStepCaches = {}
+sharedStepCachesLock = threading.Lock()
+
+
+def getSharedStepCache(cachePath, maxSize):
+    """Returns the StepCache for the cache directory, shared by every caller in the
+    process, so the cache size is tracked across a whole run. The size budget of the
+    most recent call is used."""
+    with sharedStepCachesLock:
+        cache = sharedStepCaches.get(cachePath)
+        if cache is None:
+            cache = StepCache(cachePath, maxSize)
+            sharedStepCaches[cachePath] = cache
+        cache.maxSize = maxSize
+        return cache
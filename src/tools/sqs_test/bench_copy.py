@@ -0,0 +1,134 @@
+"""## SQS Copy Engine Benchmark
+
+Compares the copy engine with the 4 KB read/write loop the tools used before. Writes a
+synthetic file to the scratch directory and times copying it with each method:
+
+* legacy – 4 KB read() and write() calls, the old copySourceToDestAndClose() loop
+
+* buffered – copyengine.copyStream() without kernel copies, readinto() a reused buffer
+
+* kernel – copyengine.copyStream() between files, copied by the kernel
+
+* merge – the 'merge' filter combining several copies of the file
+
+The 'stream' rows copy from a source without a file descriptor, like a URL response, so
+only the legacy and buffered methods apply. The file is read once before timing, so the
+numbers measure copying rather than the disk.
+
+Run from the 'src' directory, like the tests:
+
+    python3 tools/sqs_test/bench_copy.py --size=268435456
+
+Usage:
+  bench_copy.py [--size=<bytes>] [--merge-files=<n>] [--repeat=<n>]
+  bench_copy.py (-h | --help)
+
+Options:
+  -h --help            Show this screen
+  --size=<bytes>       Size of the file copied [default: 67108864]
+  --merge-files=<n>    Number of files the merge filter combines [default: 4]
+  --repeat=<n>         Runs per measurement; the fastest is reported [default: 3]
+"""
+
+
+import sys
+from os import path
+# NOTE: I needed to fix the sys.path to point up and over to sqs directory for imports.
+#       This is a huge hack that works under certain particular circumstances and will
+#       probably need modifying in the future.
+sys.path.append(  path.abspath("tools/sqs/") )
+
+import os
+import time
+from docopt import docopt
+from common import ScratchDirManager
+from copyengine import copyStream
+from filters.merge import mergeFiles
+from sqslogger import logger
+
+
+benchDir = "tools/sqs_test/scr/bench-copy"
+
+
+class StreamSource(object):
+    """A source without a file descriptor, like a URL response."""
+    def __init__(self, filePath):
+        self.f = open(filePath, 'rb', buffering=0)
+
+    def read(self, size = -1):
+        return self.f.read(size)
+
+    def readinto(self, buffer):
+        return self.f.readinto(buffer)
+
+    def close(self):
+        self.f.close()
+
+
+def copyLegacy(sourceFile, destFile):
+    """The 4 KB loop copySourceToDestAndClose() used before the copy engine."""
+    chunk = sourceFile.read(4096)
+    while chunk:
+        destFile.write(chunk)
+        chunk = sourceFile.read(4096)
+
+
+def copyBufferedEngine(sourceFile, destFile):
+    copyStream(sourceFile, destFile, kernelCopy=False)
+
+
+def timeCopy(copyFunc, inPath, outPath, stream):
+    """Copies the file once and returns the seconds taken."""
+    sourceFile = StreamSource(inPath) if stream else open(inPath, 'rb')
+    start = time.perf_counter()
+    with open(outPath, 'wb') as destFile:
+        copyFunc(sourceFile, destFile)
+    seconds = time.perf_counter() - start
+    sourceFile.close()
+    return seconds
+
+
+def timeMerge(inPaths, outPath):
+    start = time.perf_counter()
+    mergeFiles(inPaths, outPath, {}, logger)
+    return time.perf_counter() - start
+
+
+def best(func, repeat):
+    return min(func() for i in range(repeat))
+
+
+def runBenchmark(arguments):
+    size = int(arguments["--size"])
+    repeat = max(1, int(arguments["--repeat"]))
+    sd = ScratchDirManager(benchDir)
+    try:
+        inPath = sd.makeFilePath("in.bin")
+        outPath = sd.makeFilePath("out.bin")
+        with open(inPath, 'wb') as f:
+            block = os.urandom(1024 * 1024)
+            for i in range(size // len(block)):
+                f.write(block)
+            f.write(block[:size % len(block)])
+        with open(inPath, 'rb') as f:
+            while f.read(1024 * 1024):
+                pass
+
+        print("{0:>8} {1:>10} {2:>10} {3:>10}".format("source", "method", "seconds", "MB/s"))
+        def report(source, method, seconds, byteCount):
+            print("{0:>8} {1:>10} {2:>10.3f} {3:>10.1f}".format(source, method, seconds, byteCount / seconds / 1000000))
+
+        for method, copyFunc in (("legacy", copyLegacy), ("buffered", copyBufferedEngine), ("kernel", copyStream)):
+            report("file", method, best(lambda: timeCopy(copyFunc, inPath, outPath, False), repeat), size)
+        for method, copyFunc in (("legacy", copyLegacy), ("buffered", copyStream)):
+            report("stream", method, best(lambda: timeCopy(copyFunc, inPath, outPath, True), repeat), size)
+
+        mergeCount = max(1, int(arguments["--merge-files"]))
+        report("file", "merge", best(lambda: timeMerge([inPath] * mergeCount, outPath), repeat), size * mergeCount)
+    finally:
+        sd.remove()
+
+
+if __name__ == '__main__':
+    logger.setLevel("ERROR")
+    runBenchmark(docopt(__doc__))
@@ -0,0 +1,127 @@
+"""## SQS Pipeline Fetch Benchmark
+
+Measures 'url-source' fetching through the whole pipeline, offline and repeatably. Writes
+synthetic module files whose resources all come from a local HTTPFixture server, then
+times 'runPipeline()' over them for each '--jobs' value:
+
+* cold – empty download cache, so every resource is downloaded
+
+* warm – cache filled by the cold run, so every resource is revalidated
+
+Run from the 'src' directory, like the tests:
+
+    python3 tools/sqs_test/bench_pipeline.py --resources=64 --latency=0.05 --jobs=1,4,8
+
+Usage:
+  bench_pipeline.py [--resources=<n>] [--modules=<n>] [--size=<bytes>] [--latency=<s>]
+                    [--bandwidth=<bps>] [--error-rate=<r>] [--jobs=<list>] [--repeat=<n>]
+                    [--batch]
+  bench_pipeline.py (-h | --help)
+
+Options:
+  -h --help            Show this screen
+  --resources=<n>      Number of url-source resources [default: 32]
+  --modules=<n>        Number of module files the resources are split across [default: 1]
+  --size=<bytes>       Size of each resource file [default: 65536]
+  --latency=<s>        Server latency per request in seconds [default: 0.02]
+  --bandwidth=<bps>    Server bandwidth per response in bytes per second, 0 is
+                       unlimited [default: 0]
+  --error-rate=<r>     Fraction of requests answered with a 503 error [default: 0]
+  --jobs=<list>        Comma separated '--jobs' values to measure [default: 1,4,8]
+  --repeat=<n>         Runs per measurement; the fastest is reported [default: 3]
+  --batch              Run the pipeline with '--batch'
+"""
+
+
+import sys
+from os import path
+# NOTE: I needed to fix the sys.path to point up and over to sqs directory for imports.
+#       This is a huge hack that works under certain particular circumstances and will
+#       probably need modifying in the future.
+sys.path.append(  path.abspath("tools/sqs/") )
+sys.path.append(  path.abspath("tools/sqs_test/") )
+
+import os
+import json
+import time
+import shutil
+from docopt import docopt
+from common import ScratchDirManager
+from pipelinecommand import runPipeline
+from sqslogger import logger
+from httpfixture import HTTPFixture
+
+
+benchDir = "tools/sqs_test/scr/bench"
+
+
+def makeModuleFiles(server, resourceCount, moduleCount, size):
+    """Adds synthetic files to the server and writes module files using them. Returns the
+    list of module file paths."""
+    textures = [[] for i in range(moduleCount)]
+    for i in range(resourceCount):
+        urlPath = "/textures/tex{0}.png".format(i)
+        server.files[urlPath] = bytes([i % 256]) * size
+        textures[i % moduleCount].append({
+            "resource-name": "tex{0}".format(i),
+            "config": {
+                "file-name": "tex{0}.png".format(i),
+                "cache-options": {"url-source": server.makeURL(urlPath)}
+            }
+        })
+
+    moduleFiles = []
+    for i in range(moduleCount):
+        fp = path.join(benchDir, "bench{0}.module.json".format(i))
+        with open(fp, "w") as f:
+            json.dump({"module-name": "bench{0}".format(i), "resources": {"textures": textures[i]}}, f)
+        moduleFiles.append(fp)
+
+    return moduleFiles
+
+
+def timeRun(server, config, moduleFiles, jobs, batch, cold):
+    """Runs the pipeline once and returns a tuple of (seconds, successful resources)."""
+    if cold:
+        shutil.rmtree(config["build-dir"], ignore_errors=True)
+    shutil.rmtree(config["texture-dir"], ignore_errors=True)
+    server.resetStats()
+
+    start = time.perf_counter()
+    moduleResults = runPipeline(config, moduleFiles, jobs, True, False, batch)
+    seconds = time.perf_counter() - start
+
+    return (seconds, sum(1 for results in moduleResults for name, result in results if result))
+
+
+def runBenchmark(arguments):
+    resourceCount = int(arguments["--resources"])
+    repeat = max(1, int(arguments["--repeat"]))
+    sd = ScratchDirManager(benchDir)
+    config = {
+        "build-dir": path.join(benchDir, "build"),
+        "texture-dir": path.join(benchDir, "textures")
+    }
+
+    server = HTTPFixture(latency=float(arguments["--latency"]), bandwidth=float(arguments["--bandwidth"]),
+            errorRate=float(arguments["--error-rate"])).start()
+    try:
+        moduleFiles = makeModuleFiles(server, resourceCount, int(arguments["--modules"]), int(arguments["--size"]))
+        print("{0:>6} {1:>6} {2:>10} {3:>10} {4:>10} {5:>8}".format("jobs", "cache", "seconds", "ok", "requests", "304s"))
+        for jobs in [int(jobs) for jobs in arguments["--jobs"].split(",")]:
+            for cold in (True, False):
+                best = None
+                for i in range(repeat):
+                    seconds, ok = timeRun(server, config, moduleFiles, jobs, arguments["--batch"], cold)
+                    if best is None or seconds < best[0]:
+                        best = (seconds, ok, server.requests, server.notModifiedCount)
+                print("{0:>6} {1:>6} {2:>10.3f} {3:>10} {4:>10} {5:>8}".format(jobs, "cold" if cold else "warm",
+                        best[0], "{0}/{1}".format(best[1], resourceCount), best[2], best[3]))
+    finally:
+        server.stop()
+        sd.remove()
+
+
+if __name__ == '__main__':
+    logger.setLevel("ERROR")
+    runBenchmark(docopt(__doc__))
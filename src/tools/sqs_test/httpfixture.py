@@ -0,0 +1,239 @@
+"""## SQS Test HTTP Fixture
+
+A local stand-in HTTP/1.1 server for testing and benchmarking 'url-source' fetching
+offline. It serves the bytes in its 'files' dictionary, keyed by URL path, and can be
+set up to behave like a slow, flaky or picky real-world server:
+
+* latency – seconds to wait before answering each request
+
+* bandwidth – maximum body bytes per second for each response; 0 is unlimited
+
+* errors – a dictionary of URL path to a list of HTTP status codes; each request for the
+  path gets the next status code from the list until it is empty
+
+* errorRate – fraction of requests, 0 to 1, answered with status 503 at random
+
+* etags – if True, responses have an 'ETag' and 'Last-Modified' header and matching
+  conditional requests are answered with '304 Not Modified'
+
+* ranges – if True, single byte range requests are answered with '206 Partial Content',
+  honoring 'If-Range'
+
+* gzip – if True, responses for text paths (see downloader.isTextURL()) are gzip
+  compressed when the client sends 'Accept-Encoding: gzip'
+
+* cutAfter – if not 0, the next response is cut off after that many body bytes
+
+The server keeps statistics for tests to check: connections, requests, fullCount (200
+responses), rangeCount (206 responses), notModifiedCount (304 responses), errorCount,
+bytesSent, and peak (the most requests answered at the same time).
+
+Usage:
+
+    with HTTPFixture({"/foo.png": data}, latency=0.05) as server:
+        url = server.makeURL("/foo.png")
+        ...
+        self.assertEqual(server.requests, 1)
+"""
+
+
+import gzip
+import time
+import random
+import hashlib
+import threading
+import http.server
+from email.utils import formatdate
+from downloader import isTextURL
+
+
+class HTTPFixtureHandler(http.server.BaseHTTPRequestHandler):
+    """Request handler for HTTPFixture. Settings and statistics live on the server."""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.fixture.count("connections")
+
+    def do_GET(self):
+        fixture = self.server.fixture
+        fixture.count("requests")
+        fixture.enter()
+        try:
+            self.answer(fixture)
+        finally:
+            fixture.leave()
+
+    def answer(self, fixture):
+        if fixture.latency:
+            time.sleep(fixture.latency)
+
+        # Injected errors.
+        status = fixture.takeError(self.path)
+        if status:
+            fixture.count("errorCount")
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        data = fixture.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+
+        # Conditional requests.
+        etag = '"' + hashlib.sha256(data).hexdigest() + '"'
+        if fixture.etags and self.headers.get("If-None-Match") == etag:
+            fixture.count("notModifiedCount")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        # Range requests.
+        rangeHeader = self.headers.get("Range")
+        ifRange = self.headers.get("If-Range")
+        if fixture.ranges and rangeHeader and rangeHeader.startswith("bytes=") and (not ifRange or ifRange == etag):
+            start, end = rangeHeader[len("bytes="):].split("-")
+            start = int(start)
+            end = min(int(end), len(data) - 1) if end else len(data) - 1
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{0}".format(len(data)))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            fixture.count("rangeCount")
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(start, end, len(data)))
+            body = data[start:end + 1]
+        else:
+            fixture.count("fullCount")
+            self.send_response(200)
+            body = data
+            if fixture.gzip and isTextURL(self.path) and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+                body = gzip.compress(body)
+                self.send_header("Content-Encoding", "gzip")
+
+        if fixture.etags:
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", fixture.lastModified)
+        if fixture.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        cutAfter = fixture.takeCutAfter()
+        if cutAfter:
+            self.writeBody(fixture, body[:cutAfter])
+            self.close_connection = True
+            return
+        self.writeBody(fixture, body)
+
+    def writeBody(self, fixture, body):
+        """Writes the body, throttled to the fixture bandwidth."""
+        if not fixture.bandwidth:
+            self.wfile.write(body)
+            fixture.count("bytesSent", len(body))
+            return
+
+        chunkSize = max(1024, int(fixture.bandwidth / 20))
+        for i in range(0, len(body), chunkSize):
+            chunk = body[i:i + chunkSize]
+            self.wfile.write(chunk)
+            fixture.count("bytesSent", len(chunk))
+            time.sleep(len(chunk) / fixture.bandwidth)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPFixture(object):
+    """A local HTTP server running on its own thread. See the module doc string for the
+    settings, which may be changed while the server is running."""
+    def __init__(self, files = None, latency = 0, bandwidth = 0, errors = None, errorRate = 0,
+            etags = True, ranges = True, gzip = True, seed = 0):
+        self.files = files if files != None else {}
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.errors = errors if errors != None else {}
+        self.errorRate = errorRate
+        self.etags = etags
+        self.ranges = ranges
+        self.gzip = gzip
+        self.cutAfter = 0
+        self.lastModified = formatdate(usegmt=True)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.resetStats()
+        self.server = None
+        self.thread = None
+
+    def resetStats(self):
+        """Sets all statistics back to zero."""
+        with self.lock:
+            self.connections = 0
+            self.requests = 0
+            self.fullCount = 0
+            self.rangeCount = 0
+            self.notModifiedCount = 0
+            self.errorCount = 0
+            self.bytesSent = 0
+            self.active = 0
+            self.peak = 0
+
+    def count(self, name, amount = 1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def enter(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+
+    def takeError(self, path):
+        """Returns the injected error status for the next request for the path or None."""
+        with self.lock:
+            statuses = self.errors.get(path)
+            if statuses:
+                return statuses.pop(0)
+            if self.errorRate and self.random.random() < self.errorRate:
+                return 503
+        return None
+
+    def takeCutAfter(self):
+        with self.lock:
+            cutAfter = self.cutAfter
+            self.cutAfter = 0
+            return cutAfter
+
+    def start(self):
+        """Starts the server on a free local port."""
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), HTTPFixtureHandler)
+        self.server.daemon_threads = True
+        self.server.fixture = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stops the server."""
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def makeURL(self, path):
+        """Returns the URL for a path on the server."""
+        return "http://127.0.0.1:{0}{1}".format(self.server.server_address[1], path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, excType, excValue, traceback):
+        self.stop()
@@ -0,0 +1,96 @@
+import sys
+from os import path
+# NOTE: I needed to fix the sys.path to point up and over to sqs directory for imports.
+#       This is a huge hack that works under certain particular circumstances and will
+#       probably need modifying in the future.
+#sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+#sys.path.append(  path.abspath("../sqs/") )
+sys.path.append(  path.abspath("tools/sqs/") )
+#import pprint;pprint.pprint(sys.path)
+
+import io
+import tarfile
+import zipfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from common import ScratchDirManager, ModuleConfiguration
+from archivesource import ArchiveSet, isMemberPattern
+from sqslogger import logger
+
+
+testScratchDir = "tools/sqs_test/scr/archives"
+
+memberData = {
+    "textures/a.png": b"This is temporary test member a.",
+    "textures/b.png": b"This is temporary test member b.",
+    "textures/c.jpg": b"This is temporary test member c.",
+    "readme.txt": b"This is temporary test readme."
+}
+
+def makeZip(fp):
+    with zipfile.ZipFile(fp, "w") as zf:
+        for name, data in memberData.items():
+            zf.writestr(name, data)
+    return fp
+
+def makeTar(fp):
+    with tarfile.open(fp, "w:gz") as tf:
+        for name, data in memberData.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return fp
+
+class TestArchiveSource(unittest.TestCase):
+
+    def setUp(self):
+        self.sd = ScratchDirManager(testScratchDir)
+        self.archives = ArchiveSet(self.sd.makeSubScratchDirManager("downloads"))
+        self.modConfig = ModuleConfiguration({}, {})
+
+    def tearDown(self):
+        self.archives.close()
+        self.sd.remove()
+
+    def readMember(self, archive, name):
+        memberFile = archive.openMember(name)
+        data = memberFile.read()
+        memberFile.close()
+        return data
+
+    def checkArchive(self, archivePath):
+        archive = self.archives.getArchive(archivePath, self.modConfig)
+        self.assertIsNotNone(archive)
+        self.assertEqual(archive.getMemberNames("readme.txt"), ["readme.txt"])
+        self.assertEqual(archive.getMemberNames("textures/*.png"), ["textures/a.png", "textures/b.png"])
+        self.assertEqual(archive.getMemberNames("missing.txt"), [])
+
+        # Members are read in parallel, each thread with its own archive handle.
+        names = sorted(memberData) * 4
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda name: self.readMember(archive, name), names))
+        self.assertEqual(results, [memberData[name] for name in names])
+
+        # The archive is only opened once.
+        self.assertIs(self.archives.getArchive(archivePath, self.modConfig), archive)
+
+    def test_zip(self):
+        self.checkArchive(makeZip(self.sd.makeFilePath("set.zip")))
+
+    def test_tar(self):
+        self.checkArchive(makeTar(self.sd.makeFilePath("set.tar.gz")))
+
+    def test_notArchive(self):
+        fp = self.sd.makeFilePath("set.zip")
+        with open(fp, "w") as f:
+            f.write("Not an archive.")
+        self.assertIsNone(self.archives.getArchive(fp, self.modConfig))
+        self.assertIsNone(self.archives.getArchive(self.sd.makeFilePath("missing.zip"), self.modConfig))
+
+    def test_isMemberPattern(self):
+        self.assertFalse(isMemberPattern("textures/a.png"))
+        self.assertTrue(isMemberPattern("textures/*.png"))
+        self.assertTrue(isMemberPattern("textures/[ab].png"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+import sys
+from os import path
+# NOTE: I needed to fix the sys.path to point up and over to sqs directory for imports.
+#       This is a huge hack that works under certain particular circumstances and will
+#       probably need modifying in the future.
+sys.path.append(  path.abspath("tools/sqs/") )
+
+import os
+import unittest
+from common import ScratchDirManager, ModuleConfiguration, Publisher, makeProcessScratchDirManager, getSharedBackgroundDeleter, TMPFS_DIR
+from filelock import FileLock, LOCKING_SUPPORTED
+
+
+class TestScratchDirManager(unittest.TestCase):
+
+    def setUp(self):
+        self.sd = ScratchDirManager("tools/sqs_test/scr/common")
+
+    def tearDown(self):
+        self.sd.remove()
+        getSharedBackgroundDeleter().wait()
+
+    def test_clear(self):
+        scratch = self.sd.makeSubScratchDirManager("scratch")
+        sub = scratch.makeSubDir("sub")
+        for i in range(20):
+            with open(os.path.join(sub, "file{0}.txt".format(i)), "w") as f:
+                f.write("scratch data")
+        with open(scratch.makeFilePath("top.txt"), "w") as f:
+            f.write("scratch data")
+
+        # The directory is empty right away; the old files are deleted in the background.
+        scratch.clear()
+        self.assertEqual(os.listdir(scratch.path), [])
+        getSharedBackgroundDeleter().wait()
+        self.assertEqual(os.listdir(self.sd.path), ["scratch"])
+        self.assertEqual(self.sd.listSubdirs(), [os.path.join(self.sd.path, "scratch")])
+
+        scratch.remove()
+        self.assertFalse(os.path.exists(scratch.path))
+        getSharedBackgroundDeleter().wait()
+        self.assertEqual(os.listdir(self.sd.path), [])
+
+    def test_processScratchDirs(self):
+        baseDir = self.sd.makeSubDir("base")
+
+        # Left behind by processes which are no longer running, and something else.
+        stale = ["999999999-abc", ".trash-999999999-1-def"]
+        for name in stale + ["notours"]:
+            os.makedirs(os.path.join(baseDir, name, "sub"))
+        with open(os.path.join(baseDir, "999999998.lock"), "w") as f:
+            pass
+        
+        # A process holding its scratch lock is running, whatever its process ID.
+        running = []
+        if LOCKING_SUPPORTED:
+            running = ["999999997-ghi", "999999997.lock"]
+            os.makedirs(os.path.join(baseDir, running[0]))
+            runningLock = FileLock(os.path.join(baseDir, running[1]))
+            self.assertTrue(runningLock.acquire())
+
+        # Every manager gets its own directory named after the process.
+        sd1 = makeProcessScratchDirManager(baseDir)
+        sd2 = makeProcessScratchDirManager(baseDir)
+        self.assertNotEqual(sd1.path, sd2.path)
+        for sd in (sd1, sd2):
+            self.assertEqual(os.path.dirname(sd.path), baseDir)
+            self.assertTrue(os.path.basename(sd.path).startswith("{0}-".format(os.getpid())))
+
+        getSharedBackgroundDeleter().wait()
+        self.assertEqual(sorted(os.listdir(baseDir)), sorted([os.path.basename(sd1.path), os.path.basename(sd2.path), "notours", 
+                "{0}.lock".format(os.getpid())] + running))
+        
+        # Once it lets go, its directories are stale.
+        if LOCKING_SUPPORTED:
+            runningLock.release()
+            makeProcessScratchDirManager(baseDir)
+            getSharedBackgroundDeleter().wait()
+            for name in running:
+                self.assertFalse(os.path.exists(os.path.join(baseDir, name)))
+
+        # A running process's directories are kept.
+        sd1.clear()
+        makeProcessScratchDirManager(baseDir)
+        getSharedBackgroundDeleter().wait()
+        self.assertTrue(os.path.isdir(sd1.path))
+        self.assertTrue(os.path.isdir(sd2.path))
+
+    def test_configuration(self):
+        config = ModuleConfiguration({"build-dir": self.sd.path}, {})
+        self.assertEqual(config.getScratchBaseDir(), os.path.join(self.sd.path, "scratch"))
+        sd = config.getScratchDirManager()
+        self.assertEqual(os.path.dirname(sd.path), os.path.join(self.sd.path, "scratch"))
+
+        config = ModuleConfiguration({"build-dir": self.sd.path}, {"scratch-tmpfs": True})
+        if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK):
+            self.assertTrue(config.getScratchBaseDir().startswith(TMPFS_DIR))
+            sd = config.getScratchDirManager()
+            self.assertTrue(os.path.isdir(sd.path))
+            sd.remove()
+        else:
+            self.assertEqual(config.getScratchBaseDir(), os.path.join(self.sd.path, "scratch"))
+
+
+class TestPublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.sd = ScratchDirManager("tools/sqs_test/scr/publisher")
+        self.publisher = Publisher()
+        self.destPath = self.sd.makeFilePath("out.txt")
+
+    def tearDown(self):
+        self.sd.remove()
+        getSharedBackgroundDeleter().wait()
+
+    def write(self, data):
+        with self.publisher.openFile(self.destPath) as f:
+            f.write(data)
+        return f.published
+
+    def check(self, data):
+        with open(self.destPath, "rb") as f:
+            self.assertEqual(f.read(), data)
+        # No temporary files are left behind.
+        self.assertEqual(os.listdir(self.sd.path), ["out.txt"])
+
+    def test_openFile(self):
+        self.assertTrue(self.write(b"first"))
+        self.check(b"first")
+        before = os.stat(self.destPath)
+
+        # The same bytes leave the file alone.
+        self.assertTrue(self.write(b"first"))
+        self.assertTrue(self.publisher.publishBytes(b"first", self.destPath))
+        after = os.stat(self.destPath)
+        self.assertEqual((before.st_ino, before.st_mtime_ns), (after.st_ino, after.st_mtime_ns))
+        self.assertEqual(self.publisher.getCounts(), (1, 2))
+
+        # Other bytes replace it.
+        self.assertTrue(self.write(b"second"))
+        self.check(b"second")
+        self.assertEqual(self.publisher.getCounts(), (2, 2))
+
+        # Discarded files and files left by an exception are never published.
+        f = self.publisher.openFile(self.destPath)
+        f.write(b"discarded")
+        f.discard()
+        with self.assertRaises(ValueError):
+            with self.publisher.openFile(self.destPath) as f:
+                f.write(b"partial")
+                raise ValueError()
+        self.check(b"second")
+
+        # Text files too, also when dropped without closing.
+        with self.publisher.openFile(self.destPath, True) as f:
+            f.write("third")
+        self.check(b"third")
+        with self.assertRaises(ValueError):
+            with self.publisher.openFile(self.destPath, True) as f:
+                f.write("partial")
+                raise ValueError()
+        f = self.publisher.openFile(self.destPath, True)
+        f.write("dropped")
+        del f
+        self.check(b"third")
+        self.assertEqual(os.listdir(os.path.dirname(self.destPath)), [os.path.basename(self.destPath)])
+        self.assertEqual(self.publisher.getCounts(), (3, 2))
+        self.publisher.reset()
+        self.assertEqual(self.publisher.getCounts(), (0, 0))
+
+    def test_publishFile(self):
+        sourcePath = self.sd.makeFilePath("in.txt")
+        with open(sourcePath, "wb") as f:
+            f.write(b"source")
+        self.assertTrue(self.publisher.publishFile(sourcePath, self.destPath))
+        before = os.stat(self.destPath)
+        self.assertTrue(self.publisher.publishFile(sourcePath, self.destPath))
+        after = os.stat(self.destPath)
+        self.assertEqual((before.st_ino, before.st_mtime_ns), (after.st_ino, after.st_mtime_ns))
+        self.assertEqual(self.publisher.getCounts(), (1, 1))
+
+        # Moving a changed file renames it.
+        with open(sourcePath, "wb") as f:
+            f.write(b"changed")
+        self.assertTrue(self.publisher.publishFile(sourcePath, self.destPath, move=True))
+        self.check(b"changed")
+        self.assertEqual(self.publisher.getCounts(), (2, 1))
+
+        self.assertFalse(self.publisher.publishFile(sourcePath, self.destPath))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import sys
+from os import path
+# NOTE: I needed to fix the sys.path to point up and over to sqs directory for imports.
+#       This is a huge hack that works under certain particular circumstances and will
+#       probably need modifying in the future.
+sys.path.append(  path.abspath("tools/sqs/") )
+
+import os
+import json
+import subprocess
+import unittest
+from common import ScratchDirManager
+from buildmanifest import MANIFEST_FILE_NAME
+from pipelinejournal import JOURNAL_FILE_NAME
+
+
+# Stress test: many 'sqs.py pipeline' processes at once, sharing one build directory,
+# step cache and asset directory, and writing the same outputs.
+testDir = "tools/sqs_test/scr/concurrent"
+buildDir = testDir + "/build"
+assetDir = testDir + "/assets"
+
+processCount = 8
+sharedCount = 12
+
+copyFilterProfile = "testcopy"
+
+testConfig = {
+    "build-dir": buildDir,
+    "texture-dir": assetDir,
+    "step-cache-size": 1024 * 1024,
+    "filter-profiles": {
+        copyFilterProfile: [
+            {"filter": "shellexec", "options": {"command-template": "cp {pathIn} {pathOut}"}}
+        ]
+    }
+}
+
+
+def makeTextureElem(name, sourcePath, fileName, filterProfile = None):
+    cacheOptions = {"file-source": sourcePath}
+    if filterProfile:
+        cacheOptions["filter-profile"] = filterProfile
+    return {"resource-name": name, "config": {"cache-options": cacheOptions, "file-name": fileName}}
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "Needs a POSIX system.")
+class TestConcurrentRuns(unittest.TestCase):
+
+    def setUp(self):
+        self.sd = ScratchDirManager(testDir)
+        sourceDir = self.sd.makeSubDir("sources")
+        self.expected = {}
+
+        # Every process builds the shared resources, half of them filtered, plus its own.
+        shared = []
+        for i in range(sharedCount):
+            sourcePath = os.path.join(sourceDir, "shared{0}.txt".format(i))
+            with open(sourcePath, "w") as f:
+                f.write("Shared test file {0}.\n".format(i) * 100)
+            shared.append(makeTextureElem("shared{0}".format(i), sourcePath, "shared{0}.txt".format(i),
+                    copyFilterProfile if i % 2 else None))
+            self.expected["shared{0}.txt".format(i)] = sourcePath
+
+        self.modulePaths = []
+        for p in range(processCount):
+            textures = list(shared)
+            for i in range(2):
+                sourcePath = os.path.join(sourceDir, "own{0}-{1}.txt".format(p, i))
+                with open(sourcePath, "w") as f:
+                    f.write("Process {0} test file {1}.\n".format(p, i))
+                textures.append(makeTextureElem("own{0}".format(i), sourcePath, "own{0}-{1}.txt".format(p, i), copyFilterProfile))
+                self.expected["own{0}-{1}.txt".format(p, i)] = sourcePath
+            modulePath = self.sd.makeFilePath("module{0}.json".format(p))
+            with open(modulePath, "w") as f:
+                json.dump({"module-name": "module{0}".format(p), "resources": {"textures": textures}}, f)
+            self.modulePaths.append(modulePath)
+
+        self.configPath = self.sd.makeFilePath("world.module.json")
+        with open(self.configPath, "w") as f:
+            json.dump({"config": testConfig}, f)
+
+    def tearDown(self):
+        self.sd.remove()
+
+    def runPipelines(self, *options):
+        """Runs a pipeline process per module file, all at once."""
+        procs = [subprocess.Popen([sys.executable, "tools/sqs/sqs.py", "pipeline", modulePath, "--config=" + self.configPath,
+                "--jobs=3"] + list(options), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) for modulePath in self.modulePaths]
+        for proc in procs:
+            stderr = proc.communicate(timeout=120)[1]
+            self.assertEqual(proc.returncode, 0, msg=stderr.decode("utf-8", "replace"))
+
+    def checkOutputs(self):
+        # Every output is complete, and nothing else is left in the asset directory.
+        self.assertEqual(sorted(os.listdir(assetDir)), sorted(self.expected))
+        for name, sourcePath in self.expected.items():
+            with open(os.path.join(assetDir, name)) as f, open(sourcePath) as s:
+                self.assertEqual(f.read(), s.read(), msg=name)
+
+        # Every run's manifest entries and journal lines were kept.
+        outputPaths = sorted(os.path.join(assetDir, name) for name in self.expected)
+        with open(os.path.join(buildDir, MANIFEST_FILE_NAME)) as f:
+            self.assertEqual(sorted(json.load(f)), outputPaths)
+        with open(os.path.join(buildDir, JOURNAL_FILE_NAME)) as f:
+            journal = [json.loads(line) for line in f]
+        self.assertEqual(sorted(entry["output"] for entry in journal), outputPaths)
+        self.assertTrue(all(entry["status"] == "done" for entry in journal))
+
+        # Scratch directories and their locks are gone, and no cache entry was damaged.
+        self.assertEqual(os.listdir(os.path.join(buildDir, "scratch")), [])
+        stepsDir = os.path.join(buildDir, "cache/steps")
+        for name in os.listdir(stepsDir):
+            if name == "tmp":
+                self.assertEqual(os.listdir(os.path.join(stepsDir, name)), [])
+            elif os.path.isdir(os.path.join(stepsDir, name)):
+                self.assertTrue(os.path.isfile(os.path.join(stepsDir, name, "step.json")))
+
+    def test_concurrentPipelines(self):
+        self.runPipelines()
+        self.checkOutputs()
+
+        # Forced rebuilds of the same outputs don't change them.
+        times = {name: os.stat(os.path.join(assetDir, name)).st_mtime_ns for name in self.expected}
+        self.runPipelines("--force")
+        self.checkOutputs()
+        self.assertEqual({name: os.stat(os.path.join(assetDir, name)).st_mtime_ns for name in self.expected}, times)
+
+if __name__ == '__main__':
+    unittest.main()
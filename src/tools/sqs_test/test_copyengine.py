@@ -0,0 +1,137 @@
+import sys
+from os import path
+# NOTE: I needed to fix the sys.path to point up and over to sqs directory for imports.
+#       This is a huge hack that works under certain particular circumstances and will
+#       probably need modifying in the future.
+sys.path.append(  path.abspath("tools/sqs/") )
+
+import io
+import os
+import errno
+import unittest
+from unittest import mock
+from common import ScratchDirManager
+import copyengine
+from copyengine import copyStream, copyFile, COPY_BUFFER_SIZE
+
+
+class TestCopyEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.sd = ScratchDirManager("tools/sqs_test/scr/copyengine")
+        # Bigger than the copy buffer and not a multiple of it.
+        self.data = bytes(range(256)) * (COPY_BUFFER_SIZE // 256 * 3 + 7)
+        self.inPath = self.sd.makeFilePath("in.bin")
+        with open(self.inPath, "wb") as f:
+            f.write(self.data)
+        self.outPath = self.sd.makeFilePath("out.bin")
+
+    def tearDown(self):
+        self.sd.remove()
+
+    def copyWithPrefix(self, **kwargs):
+        """Copies the input after a buffered write and partial read, so the positions of
+        the file objects and their descriptors differ."""
+        with open(self.inPath, "rb") as sourceFile, open(self.outPath, "wb") as destFile:
+            self.assertEqual(sourceFile.read(10), self.data[:10])
+            destFile.write(b"prefix")
+            self.assertEqual(copyStream(sourceFile, destFile, **kwargs), len(self.data) - 10)
+            self.assertEqual(sourceFile.read(), b"")
+            destFile.write(b"suffix")
+        with open(self.outPath, "rb") as f:
+            self.assertEqual(f.read(), b"prefix" + self.data[10:] + b"suffix")
+
+    def test_kernelCopy(self):
+        self.copyWithPrefix()
+
+    def test_fallbacks(self):
+        # The next method is used when the kernel can't copy between the files.
+        def refuse(*args):
+            raise OSError(errno.EXDEV, "Cross-device link")
+        def refuseLater(sourceFd, destFd, sourceOffset, destOffset):
+            # Copies part of the file before refusing.
+            if sourceOffset > COPY_BUFFER_SIZE:
+                refuse()
+            return os.pwrite(destFd, os.pread(sourceFd, 65536, sourceOffset), destOffset)
+
+        with mock.patch("copyengine.getKernelCopyFuncs", return_value=[refuse, copyengine.sendFile]):
+            self.copyWithPrefix()
+        with mock.patch("copyengine.getKernelCopyFuncs", return_value=[refuseLater]):
+            self.copyWithPrefix()
+        with mock.patch("copyengine.getKernelCopyFuncs", return_value=[]):
+            self.copyWithPrefix()
+        self.copyWithPrefix(kernelCopy=False)
+
+        # Other errors are raised.
+        def fail(*args):
+            raise OSError(errno.EIO, "I/O error")
+        with mock.patch("copyengine.getKernelCopyFuncs", return_value=[fail]):
+            with self.assertRaises(OSError):
+                self.copyWithPrefix()
+
+    def test_streams(self):
+        # Streams without a file descriptor use the buffer.
+        destFile = io.BytesIO()
+        self.assertEqual(copyStream(io.BytesIO(self.data), destFile), len(self.data))
+        self.assertEqual(destFile.getvalue(), self.data)
+
+        # Streams which only support read() work too.
+        class ReadOnly(object):
+            def __init__(self, data):
+                self.f = io.BytesIO(data)
+            def read(self, size):
+                return self.f.read(size)
+        destFile = io.BytesIO()
+        self.assertEqual(copyStream(ReadOnly(self.data), destFile), len(self.data))
+        self.assertEqual(destFile.getvalue(), self.data)
+
+        # A file to a stream and a stream to a file.
+        destFile = io.BytesIO()
+        with open(self.inPath, "rb") as sourceFile:
+            copyStream(sourceFile, destFile)
+        self.assertEqual(destFile.getvalue(), self.data)
+        with open(self.outPath, "wb") as f:
+            copyStream(io.BytesIO(self.data), f)
+        with open(self.outPath, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_copyFile(self):
+        def isLinked():
+            return path.samefile(self.inPath, self.outPath)
+        def check():
+            with open(self.outPath, "rb") as f:
+                self.assertEqual(f.read(), self.data)
+
+        self.assertEqual(copyFile(self.inPath, self.outPath), "copy")
+        check()
+        self.assertFalse(isLinked())
+
+        # Hard links only where allowed.
+        self.assertEqual(copyFile(self.inPath, self.outPath, "hardlink"), "hardlink")
+        self.assertTrue(isLinked())
+        self.assertEqual(copyFile(self.inPath, self.outPath, "hardlink", False), "copy")
+        self.assertFalse(isLinked())
+
+        # Clones where the file system supports them, otherwise a link or a copy.
+        self.assertIn(copyFile(self.inPath, self.outPath, "reflink"), ("reflink", "copy"))
+        self.assertFalse(isLinked())
+        check()
+        self.assertIn(copyFile(self.inPath, self.outPath, "auto"), ("reflink", "hardlink"))
+        check()
+
+        # Copying over a hard link replaces it instead of changing the source.
+        otherPath = self.sd.makeFilePath("other.bin")
+        with open(otherPath, "wb") as f:
+            f.write(b"other data")
+        copyFile(self.inPath, self.outPath, "hardlink")
+        self.assertEqual(copyFile(otherPath, self.outPath), "copy")
+        with open(self.inPath, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        with open(self.outPath, "rb") as f:
+            self.assertEqual(f.read(), b"other data")
+
+        with self.assertRaises(OSError):
+            copyFile(self.sd.makeFilePath("missing.bin"), self.outPath, "auto")
+
+if __name__ == '__main__':
+    unittest.main()
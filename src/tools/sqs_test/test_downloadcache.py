@@ -0,0 +1,98 @@
+import sys
+from os import path
+# NOTE: I needed to fix the sys.path to point up and over to sqs directory for imports.
+#       This is a huge hack that works under certain particular circumstances and will
+#       probably need modifying in the future.
+#sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+#sys.path.append(  path.abspath("../sqs/") )
+sys.path.append(  path.abspath("tools/sqs/") )
+sys.path.append(  path.abspath("tools/sqs_test/") )
+#import pprint;pprint.pprint(sys.path)
+
+import unittest
+from common import ScratchDirManager, getSourceURL
+from downloadcache import DownloadCache
+from downloader import Downloader
+from httpfixture import HTTPFixture
+from sqslogger import logger
+
+
+testCacheDir = "tools/sqs_test/scr/downloads"
+
+fileData1 = b"This is temporary test file data 1."
+fileData2 = b"This is temporary test file data 2."
+
+
+class TestDownloadCache(unittest.TestCase):
+
+    def setUp(self):
+        # Compressed responses are never resumed, so serve the text file as-is.
+        self.server = HTTPFixture({"/file1.txt": fileData1}, gzip=False).start()
+        self.url = self.server.makeURL("/file1.txt")
+        self.sd = ScratchDirManager(testCacheDir)
+
+    def tearDown(self):
+        self.server.stop()
+        self.sd.remove()
+
+    def readURL(self, cache):
+        sourceFile = getSourceURL(self.url, cache)
+        self.assertIsNotNone(sourceFile)
+        data = sourceFile.read()
+        sourceFile.close()
+        return data
+
+    def test_revalidation(self):
+        cache = DownloadCache(testCacheDir)
+
+        self.assertEqual(self.readURL(cache), fileData1)
+        self.assertEqual((self.server.fullCount, self.server.notModifiedCount), (1, 0))
+
+        # Unchanged, so the server answers 304 and the cached bytes are used.
+        self.assertEqual(self.readURL(cache), fileData1)
+        self.assertEqual((self.server.fullCount, self.server.notModifiedCount), (1, 1))
+
+        # Changed, so the new bytes are downloaded.
+        self.server.files["/file1.txt"] = fileData2
+        self.assertEqual(self.readURL(cache), fileData2)
+        self.assertEqual((self.server.fullCount, self.server.notModifiedCount), (2, 1))
+
+    def test_missingURL(self):
+        cache = DownloadCache(testCacheDir)
+        self.assertIsNone(getSourceURL(self.url + ".missing", cache))
+
+    def test_resume(self):
+        bigData = bytes(range(256)) * 400
+        self.server.files["/file1.txt"] = bigData
+        self.server.cutAfter = 30000
+        cache = DownloadCache(testCacheDir, Downloader(retries=2, backoff=0.01, maxSegments=1))
+
+        # The first response is cut off, the rest is fetched with a range request.
+        self.assertEqual(self.readURL(cache), bigData)
+        self.assertEqual((self.server.fullCount, self.server.rangeCount), (1, 1))
+
+    def test_resumeChanged(self):
+        bigData = bytes(range(256)) * 400
+        self.server.files["/file1.txt"] = bigData
+        self.server.cutAfter = 30000
+        cache = DownloadCache(testCacheDir, Downloader(retries=0, backoff=0.01, maxSegments=1))
+
+        # No retries, so the interrupted download fails and is left partial.
+        self.assertIsNone(getSourceURL(self.url, cache))
+
+        # The file changes on the server, so the range request is answered with the whole
+        # file. The partial download is discarded and the file is downloaded again.
+        self.server.files["/file1.txt"] = fileData2
+        self.assertEqual(self.readURL(cache), fileData2)
+        self.assertEqual((self.server.fullCount, self.server.rangeCount), (3, 0))
+
+    def test_segments(self):
+        bigData = bytes(range(256)) * 400
+        self.server.files["/file1.txt"] = bigData
+        cache = DownloadCache(testCacheDir, Downloader(maxSegments=4, segmentSize=10000))
+
+        self.assertEqual(self.readURL(cache), bigData)
+        self.assertEqual((self.server.fullCount, self.server.rangeCount), (1, 4))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import sys
+from os import path
+# NOTE: I needed to fix the sys.path to point up and over to sqs directory for imports.
+#       This is a huge hack that works under certain particular circumstances and will
+#       probably need modifying in the future.
+#sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+#sys.path.append(  path.abspath("../sqs/") )
+sys.path.append(  path.abspath("tools/sqs/") )
+sys.path.append(  path.abspath("tools/sqs_test/") )
+#import pprint;pprint.pprint(sys.path)
+
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from downloader import Downloader, DownloadError
+from httpfixture import HTTPFixture
+from sqslogger import logger
+
+
+fileData = b"This is temporary test file data. " * 100
+
+
+class TestDownloader(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPFixture({}).start()
+        for name in ["file{0}.png".format(i) for i in range(10)] + ["file.json", "flaky.png"]:
+            self.server.files["/" + name] = fileData
+        self.baseURL = self.server.makeURL("/")
+
+    def tearDown(self):
+        self.server.stop()
+
+    def fetch(self, downloader, name):
+        with downloader.open(self.baseURL + name) as response:
+            self.assertEqual(response.status, 200)
+            return response.read()
+
+    def test_keepAlive(self):
+        downloader = Downloader()
+        for i in range(10):
+            self.assertEqual(self.fetch(downloader, "file{0}.png".format(i)), fileData)
+        downloader.close()
+
+        self.assertEqual(self.server.requests, 10)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_perHostLimit(self):
+        self.server.latency = 0.05
+        downloader = Downloader(maxPerHost=2)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda i: self.fetch(downloader, "file{0}.png".format(i % 10)), range(16)))
+        downloader.close()
+
+        self.assertEqual(results, [fileData] * 16)
+        self.assertLessEqual(self.server.peak, 2)
+        self.assertLessEqual(self.server.connections, 2)
+
+    def test_gzipText(self):
+        downloader = Downloader()
+        self.assertEqual(self.fetch(downloader, "file.json"), fileData)
+        downloader.close()
+        self.assertLess(self.server.bytesSent, len(fileData))
+
+    def test_readinto(self):
+        # Plain and gzip encoded bodies read into a small reused buffer.
+        downloader = Downloader()
+        for name in ("file0.png", "file.json"):
+            data = bytearray()
+            buffer = bytearray(1000)
+            with downloader.open(self.baseURL + name) as response:
+                count = response.readinto(buffer)
+                while count:
+                    data += buffer[:count]
+                    count = response.readinto(buffer)
+            self.assertEqual(bytes(data), fileData, msg=name)
+        downloader.close()
+
+    def test_retry(self):
+        self.server.errors["/flaky.png"] = [503, 503]
+        downloader = Downloader(retries=3, backoff=0.01)
+        self.assertEqual(self.fetch(downloader, "flaky.png"), fileData)
+        downloader.close()
+        self.assertEqual(self.server.requests, 3)
+
+    def test_retryExhausted(self):
+        self.server.errors["/flaky.png"] = [503] * 5
+        downloader = Downloader(retries=1, backoff=0.01)
+        with downloader.open(self.baseURL + "flaky.png") as response:
+            self.assertEqual(response.status, 503)
+        downloader.close()
+
+    def test_unreachable(self):
+        downloader = Downloader(retries=1, backoff=0.01, timeout=1)
+        with self.assertRaises(DownloadError):
+            downloader.open("http://127.0.0.1:1/file.png")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import sys
+from os import path
+# NOTE: I needed to fix the sys.path to point up and over to sqs directory for imports.
+#       This is a huge hack that works under certain particular circumstances and will
+#       probably need modifying in the future.
+sys.path.append(  path.abspath("tools/sqs/") )
+
+import os
+import threading
+import subprocess
+import unittest
+from common import ScratchDirManager
+from filelock import FileLock, LOCKING_SUPPORTED
+
+
+holdLockScript = """
+import sys, fcntl, time
+f = open(sys.argv[1], 'w')
+fcntl.flock(f, fcntl.LOCK_EX)
+print("locked", flush=True)
+time.sleep(60)
+"""
+
+
+@unittest.skipUnless(LOCKING_SUPPORTED, "File locking not supported.")
+class TestFileLock(unittest.TestCase):
+
+    def setUp(self):
+        self.sd = ScratchDirManager("tools/sqs_test/scr/filelock")
+        self.lockPath = self.sd.makeFilePath("test.lock")
+
+    def tearDown(self):
+        self.sd.remove()
+
+    def test_exclusiveAndShared(self):
+        with FileLock(self.lockPath):
+            # Every FileLock opens its own file, so they exclude each other in one process.
+            self.assertFalse(FileLock(self.lockPath).acquire(blocking=False))
+            self.assertFalse(FileLock(self.lockPath, True).acquire(blocking=False))
+
+        shared1 = FileLock(self.lockPath, True)
+        shared2 = FileLock(self.lockPath, True)
+        self.assertTrue(shared1.acquire(blocking=False))
+        self.assertTrue(shared2.acquire(blocking=False))
+        self.assertFalse(FileLock(self.lockPath).acquire(blocking=False))
+        shared1.release()
+        shared2.release()
+
+        # Directories can be locked too.
+        with FileLock(self.sd.path):
+            self.assertFalse(FileLock(self.sd.path).acquire(blocking=False))
+
+    def test_removedWhileWaiting(self):
+        holder = FileLock(self.lockPath)
+        self.assertTrue(holder.acquire())
+        waiter = FileLock(self.lockPath)
+        thread = threading.Thread(target=waiter.acquire)
+        thread.start()
+
+        # The waiter locks the new lock file, not the removed one.
+        holder.release(remove=True)
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(os.path.samestat(os.fstat(waiter.fd), os.stat(self.lockPath)))
+        self.assertFalse(FileLock(self.lockPath).acquire(blocking=False))
+        waiter.release()
+
+    def test_otherProcess(self):
+        proc = subprocess.Popen([sys.executable, "-c", holdLockScript, self.lockPath], stdout=subprocess.PIPE)
+        try:
+            self.assertEqual(proc.stdout.readline().strip(), b"locked")
+            self.assertFalse(FileLock(self.lockPath).acquire(blocking=False))
+        finally:
+            proc.kill()
+            proc.wait()
+            proc.stdout.close()
+
+        # A killed process doesn't leave the lock held.
+        lock = FileLock(self.lockPath)
+        self.assertTrue(lock.acquire(blocking=False))
+        lock.release()
+
+if __name__ == '__main__':
+    unittest.main()
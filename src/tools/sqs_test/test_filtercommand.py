@@ -9,10 +9,15 @@ sys.path.append(  path.abspath("tools/sqs/") )
 #import pprint;pprint.pprint(sys.path)
 
 import os
+import json
+import time
 import unittest
+from unittest import mock
 from filecmp import cmp
-from common import ScratchDirManager, ModuleConfiguration
-from filtercommand import processFilterChain, runFilter
+from common import ScratchDirManager, ModuleConfiguration, getSharedPublisher
+import filtercommand
+from filtercommand import processFilterChain, runFilter, compileFilterChain
+from stepcache import StepCache
 from sqslogger import logger
 
 
@@ -113,6 +118,323 @@ class TestFilterCommand(unittest.TestCase):
         sd1.remove()
         sd2.remove()
 
+    def test_filterChainUnchangedOutputs(self):
+        modConfig = ModuleConfiguration(testConfig, {})
+        sd1 = ScratchDirManager(testDir1)
+        sd2 = ScratchDirManager(testDir2)
+        inFile = makeTestFile(sd1.makeFilePath("temp_testfile.txt"), fileData1)
+        outFile = sd2.makeFilePath("temp_testfile.txt")
+        publisher = getSharedPublisher()
+        def run():
+            publisher.reset()
+            self.assertTrue(processFilterChain([inFile], testDir2, sd1.makeSubScratchDirManager("scratch"), 
+                    modConfig.getFilters(None, copyFilterProfile)))
+            stat = os.stat(outFile)
+            return (publisher.getCounts(), stat.st_ino, stat.st_mtime_ns)
+        
+        # Running again with the same input doesn't touch the output file.
+        counts, ino, mtime = run()
+        self.assertEqual(counts, (1, 0))
+        self.assertEqual(run(), ((0, 1), ino, mtime))
+        self.assertEqual(os.listdir(testDir2), ["temp_testfile.txt"])
+        
+        # A changed input replaces it.
+        makeTestFile(inFile, fileData2)
+        counts, ino, mtime = run()
+        self.assertEqual(counts, (1, 0))
+        with open(outFile) as f:
+            self.assertEqual(f.read(), fileData2)
+        
+        # Clean up dirs.
+        sd1.remove()
+        sd2.remove()
+
+    def runMergeChain(self, memoryThreshold):
+        # Two in-memory filters in a row.
+        filterChain = [
+            {"filter": "merge", "options": {"out-name": "testmerged.txt", "file-separator": "\n\n"}},
+            {"filter": "merge", "options": {"out-name": "testfinal.txt"}}
+        ]
+        sd1 = ScratchDirManager(testDir1)
+        sd2 = ScratchDirManager(testDir2)
+        inFiles = [makeTestFile(sd1.makeFilePath("test{0}.txt".format(i)), data) for i, data in 
+                enumerate([fileData1, fileData2, fileData3, fileData4])]
+        scratch = sd1.makeSubScratchDirManager("scratch")
+        
+        with mock.patch("filtercommand.readFilesToBuffers", wraps=filtercommand.readFilesToBuffers) as readFiles, \
+                mock.patch("filtercommand.writeBuffersToDir", wraps=filtercommand.writeBuffersToDir) as writeBuffers, \
+                mock.patch("filtercommand.publishBuffersToDir", wraps=filtercommand.publishBuffersToDir) as publishBuffers:
+            self.assertTrue(processFilterChain(inFiles, testDir2, scratch, filterChain, memoryThreshold))
+        
+        with open(sd2.makeFilePath("testfinal.txt")) as f:
+            fileData = f.read()
+        self.assertEqual(os.listdir(testDir2), ["testfinal.txt"])
+        
+        # Clean up dirs.
+        sd1.remove()
+        sd2.remove()
+        
+        return (fileData, readFiles.call_count, writeBuffers.call_count + publishBuffers.call_count)
+
+    def test_filterChainInMemory(self):
+        # The inputs are read once and only the final output is written.
+        self.assertEqual(self.runMergeChain(1024 * 1024), (combinedData, 1, 1))
+
+    def test_filterChainSpill(self):
+        # The merged data is bigger than the threshold, so it is written to the scratch 
+        # dir and the second merge works on files.
+        self.assertEqual(self.runMergeChain(len(combinedData) - 1), (combinedData, 2, 1))
+
+    def test_filterChainNoMemory(self):
+        # All files.
+        self.assertEqual(self.runMergeChain(0), (combinedData, 0, 0))
+
+    def test_filterChainStreams(self):
+        # Three stream steps piped together, then a file step.
+        def streamStep(command, outExt = None):
+            options = {"stream": True, "command-template": command}
+            if outExt: options["out-ext"] = outExt
+            return {"filter": "shellexec", "options": options}
+        filterChain = [
+            streamStep("tr a-z A-Z"),
+            streamStep("tr T t", "dat"),
+            streamStep("tr . !", "md"),
+            {"filter": "shellexec", "options": {"command-template": "cp {pathIn} {pathOut}"}}
+        ]
+        self.assertEqual([len(step) for step in filtercommand.planFilterSteps(filterChain)], [3, 1])
+        
+        sd1 = ScratchDirManager(testDir1)
+        sd2 = ScratchDirManager(testDir2)
+        inFiles = [makeTestFile(sd1.makeFilePath("test{0}.txt".format(i)), data) for i, data in 
+                enumerate([fileData1, fileData2])]
+        scratch = sd1.makeSubScratchDirManager("scratch")
+        
+        with mock.patch("filtercommand.runStreamCommands", wraps=filtercommand.runStreamCommands) as runStream:
+            self.assertTrue(processFilterChain(inFiles, testDir2, scratch, filterChain))
+        
+        # One pipeline per file, with the file name carried through every step.
+        self.assertEqual(runStream.call_count, 2)
+        with open(sd2.makeFilePath("test1.md")) as f:
+            self.assertEqual(f.read(), "tHIS IS tEMPORARY tESt tEXt FILE 2!")
+        
+        # A failing command in the middle fails the step.
+        filterChain[1] = streamStep("false")
+        self.assertFalse(processFilterChain(inFiles, testDir2, scratch, filterChain))
+        
+        # Clean up dirs.
+        sd1.remove()
+        sd2.remove()
+
+    def test_filterChainPerFile(self):
+        # Each command takes a while, so running them one at a time would be slow.
+        filterChain = [{"filter": "shellexec", "options": {"command-template": "sleep 0.3 && cp {pathIn} {pathOut}"}}]
+        sd1 = ScratchDirManager(testDir1)
+        sd2 = ScratchDirManager(testDir2)
+        inFiles = [makeTestFile(sd1.makeFilePath("test{0}.txt".format(i)), "Test file {0}.".format(i)) for i in range(6)]
+        scratch = sd1.makeSubScratchDirManager("scratch")
+        
+        start = time.time()
+        self.assertTrue(processFilterChain(inFiles, testDir2, scratch, filterChain, jobs=6))
+        self.assertLess(time.time() - start, 1.5)
+        for i in range(6):
+            self.assertTrue(cmp(inFiles[i], sd2.makeFilePath("test{0}.txt".format(i))))
+        
+        # Clean up dirs.
+        sd1.remove()
+        sd2.remove()
+
+    def test_filterChainPerFileOrder(self):
+        # Babylon files cleaned in parallel in memory, then merged; the merged file must 
+        # have the inputs in order no matter which finished first.
+        filterChain = [
+            {"filter": "cleanbabylon"},
+            {"filter": "merge", "options": {"out-name": "merged.babylon"}}
+        ]
+        sd1 = ScratchDirManager(testDir1)
+        sd2 = ScratchDirManager(testDir2)
+        inFiles = [makeTestFile(sd1.makeFilePath("test{0}.babylon".format(i)), 
+                json.dumps({"lights": [1], "meshes": [i] * (20 - i)})) for i in range(20)]
+        scratch = sd1.makeSubScratchDirManager("scratch")
+        
+        self.assertTrue(processFilterChain(inFiles, testDir2, scratch, filterChain, jobs=8))
+        with open(sd2.makeFilePath("merged.babylon")) as f:
+            merged = f.read()
+        self.assertEqual(merged, "".join(json.dumps({"lights": [], "meshes": [i] * (20 - i)}) for i in range(20)))
+        
+        # Clean up dirs.
+        sd1.remove()
+        sd2.remove()
+
+    def test_filterChainStepCache(self):
+        sd1 = ScratchDirManager(testDir1)
+        sd2 = ScratchDirManager(testDir2)
+        runLog = sd1.makeFilePath("runs.log")
+        def makeStep(name, template):
+            return {"filter": "shellexec", "options": {"command-template": "echo " + name + " >> {log}; " + template,
+                    "command-arguments": {"log": runLog}}}
+        upper = makeStep("upper", "tr a-z A-Z < {pathIn} > {pathOut}")
+        merge = {"filter": "merge", "options": {"out-name": "merged.txt"}}
+        inFiles = [makeTestFile(sd1.makeFilePath("test{0}.txt".format(i)), "Test file {0}.".format(i)) for i in range(3)]
+        scratch = sd1.makeSubScratchDirManager("scratch")
+        stepCache = StepCache(sd1.makeSubDir("cache"), 1024 * 1024)
+        def getRuns():
+            with open(runLog) as f:
+                runs = f.read().split()
+            os.remove(runLog)
+            return runs
+        
+        # The first run fills the cache.
+        filterChain = [upper, merge, makeStep("copy", "cp {pathIn} {pathOut}")]
+        self.assertTrue(processFilterChain(inFiles, testDir2, scratch, filterChain, stepCache=stepCache))
+        self.assertEqual(getRuns(), ["upper"] * 3 + ["copy"])
+        with open(sd2.makeFilePath("merged.txt")) as f:
+            self.assertEqual(f.read(), "TEST FILE 0.TEST FILE 1.TEST FILE 2.")
+        
+        # Changing the last step only runs the last step.
+        sd2.clear()
+        filterChain[2] = makeStep("lower", "tr A-Z a-z < {pathIn} > {pathOut}")
+        self.assertTrue(processFilterChain(inFiles, testDir2, scratch, filterChain, stepCache=stepCache))
+        self.assertEqual(getRuns(), ["lower"])
+        with open(sd2.makeFilePath("merged.txt")) as f:
+            self.assertEqual(f.read(), "test file 0.test file 1.test file 2.")
+        
+        # Nothing runs when nothing changed, including the last step.
+        sd2.clear()
+        self.assertTrue(processFilterChain(inFiles, testDir2, scratch, filterChain, stepCache=stepCache))
+        self.assertFalse(path.exists(runLog))
+        with open(sd2.makeFilePath("merged.txt")) as f:
+            self.assertEqual(f.read(), "test file 0.test file 1.test file 2.")
+        
+        # Changed input bytes run everything again; so does turning the cache off.
+        makeTestFile(inFiles[1], "Changed.")
+        self.assertTrue(processFilterChain(inFiles, testDir2, scratch, filterChain, stepCache=stepCache))
+        self.assertEqual(getRuns(), ["upper"] * 3 + ["lower"])
+        filterChain[0] = dict(upper, cache=False)
+        self.assertTrue(processFilterChain(inFiles, testDir2, scratch, filterChain, stepCache=stepCache))
+        self.assertEqual(getRuns(), ["upper"] * 3)
+        
+        # Clean up dirs.
+        sd1.remove()
+        sd2.remove()
+
+    def test_compileFilterChain(self):
+        steps = compileFilterChain(testConfig["filter-profiles"][copyMergeFilterProfile])
+        self.assertEqual([step.name for step in steps], ["merge", "shellexec"])
+        self.assertIsNotNone(steps[0].filterBuffersFunc)
+        self.assertTrue(steps[1].perFile)
+        
+        # Stream filters are compiled into one step.
+        streamStep = {"filter": "shellexec", "options": {"stream": True, "command-template": "cat"}}
+        self.assertEqual([len(step.fds) for step in compileFilterChain([streamStep, streamStep])], [2])
+        
+        # Unknown filters, bad declarations and bad options are all found.
+        self.assertIsNone(compileFilterChain([{"filter": "split"}]))
+        self.assertIsNone(compileFilterChain([{"filter": "nosuchfilter"}]))
+        self.assertIsNone(compileFilterChain([{"options": {}}]))
+        self.assertIsNone(compileFilterChain([{"filter": "merge", "options": {}}]))
+        self.assertIsNone(compileFilterChain([{"filter": "shellexec", "options": {"command-template": "cp {pathIn} {dest}"}}]))
+        self.assertIsNone(compileFilterChain([{"filter": "shellexec", "options": {"command-template": "cp {pathIn} {pathOut}", "command-arguments": []}}]))
+        self.assertIsNone(compileFilterChain([{"filter": "coprocess", "options": {"worker-command": "worker", "workers": 0}}]))
+        self.assertIsNone(compileFilterChain({"filter": "merge"}))
+
+    def test_filterChainInvalid(self):
+        sd1 = ScratchDirManager(testDir1)
+        sd2 = ScratchDirManager(testDir2)
+        runLog = sd1.makeFilePath("runs.log")
+        inFiles = [makeTestFile(sd1.makeFilePath("test1.txt"), fileData1)]
+        scratch = sd1.makeSubScratchDirManager("scratch")
+        
+        # A bad last filter fails the chain before the first filter runs.
+        filterChain = [
+            {"filter": "shellexec", "options": {"command-template": "cp {pathIn} {pathOut}; echo x >> " + runLog}},
+            {"filter": "nosuchfilter"}
+        ]
+        self.assertFalse(processFilterChain(inFiles, testDir2, scratch, filterChain))
+        self.assertFalse(path.exists(runLog))
+        
+        # Clean up dirs.
+        sd1.remove()
+        sd2.remove()
+
+    def test_filterChainExactOutputs(self):
+        sd1 = ScratchDirManager(testDir1)
+        sd2 = ScratchDirManager(testDir2)
+        inFiles = [makeTestFile(sd1.makeFilePath("test1.txt"), fileData1), makeTestFile(sd1.makeFilePath("test2.txt"), fileData2)]
+        scratch = sd1.makeSubScratchDirManager("scratch")
+        
+        # The first filter leaves a stray file next to each output, which the merge must 
+        # not pick up.
+        filterChain = [
+            {"filter": "shellexec", "options": {"command-template": "cp {pathIn} {pathOut} && echo stray > {pathOut}.stray"}},
+            {"filter": "merge", "options": {"out-name": "merged.txt"}}
+        ]
+        self.assertTrue(processFilterChain(inFiles, testDir2, scratch, filterChain))
+        with open(sd2.makeFilePath("merged.txt")) as f:
+            self.assertEqual(f.read(), fileData1 + fileData2)
+        
+        # Clean up dirs.
+        sd1.remove()
+        sd2.remove()
+
+    def test_filterChainBranchesUnchangedOutputs(self):
+        sd1 = ScratchDirManager(testDir1)
+        sd2 = ScratchDirManager(testDir2)
+        inFile = makeTestFile(sd1.makeFilePath("test.txt"), fileData1)
+        scratch = sd1.makeSubScratchDirManager("scratch")
+        copyFD = {"filter": "shellexec", "options": {"command-template": "cp {pathIn} {pathOut}"}}
+        filterChain = [copyFD, {"branches": [{"out-suffix": "_a", "filters": [copyFD]}, {"out-suffix": "_b", "filters": [copyFD]}]}]
+        publisher = getSharedPublisher()
+        def run():
+            publisher.reset()
+            scratch.clear()
+            self.assertTrue(processFilterChain([inFile], testDir2, scratch, filterChain))
+            return publisher.getCounts()
+        
+        # Only the two outputs are counted, not the files moved between scratch directories.
+        self.assertEqual(run(), (2, 0))
+        self.assertEqual(run(), (0, 2))
+        self.assertEqual(sorted(os.listdir(testDir2)), ["test_a.txt", "test_b.txt"])
+        
+        # Clean up dirs.
+        sd1.remove()
+        sd2.remove()
+
+    def test_filterChainBranches(self):
+        sd1 = ScratchDirManager(testDir1)
+        sd2 = ScratchDirManager(testDir2)
+        runLog = sd1.makeFilePath("runs.log")
+        inFiles = [makeTestFile(sd1.makeFilePath("test{0}.txt".format(i)), "Test file {0}.".format(i)) for i in range(2)]
+        scratch = sd1.makeSubScratchDirManager("scratch")
+        
+        # The shared filter runs once per file, then three variants are made.
+        filterChain = [
+            {"filter": "shellexec", "options": {"command-template": "cp {pathIn} {pathOut}; echo x >> " + runLog}},
+            {"branches": [
+                {"filters": []},
+                {"out-suffix": "-upper", "filters": [{"filter": "shellexec", "options": {"command-template": "tr a-z A-Z < {pathIn} > {pathOut}"}}]},
+                {"out-suffix": "-merged", "filters": [{"filter": "merge", "options": {"out-name": "all.txt"}}]}
+            ]}
+        ]
+        self.assertTrue(processFilterChain(inFiles, testDir2, scratch, filterChain, jobs=2))
+        with open(runLog) as f:
+            self.assertEqual(len(f.readlines()), 2)
+        self.assertEqual(sorted(os.listdir(testDir2)), ["all-merged.txt", "test0-upper.txt", "test0.txt", "test1-upper.txt", "test1.txt"])
+        self.assertTrue(cmp(inFiles[0], sd2.makeFilePath("test0.txt")))
+        with open(sd2.makeFilePath("test1-upper.txt")) as f:
+            self.assertEqual(f.read(), "TEST FILE 1.")
+        with open(sd2.makeFilePath("all-merged.txt")) as f:
+            self.assertEqual(f.read(), "Test file 0.Test file 1.")
+        
+        # Branches must come last and have different suffixes.
+        self.assertIsNone(compileFilterChain([{"branches": [{"filters": []}]}, {"filter": "merge", "options": {"out-name": "a"}}]))
+        self.assertIsNone(compileFilterChain([{"branches": [{"filters": []}, {"filters": []}]}]))
+        self.assertIsNone(compileFilterChain([{"branches": [{"out-suffix": "-a", "filters": [{"filter": "nosuchfilter"}]}]}]))
+        self.assertEqual(compileFilterChain([{"branches": [{"filters": []}]}]), [])
+        
+        # Clean up dirs.
+        sd1.remove()
+        sd2.remove()
+
     # TODO: More tests.
     # TODO: Make sure to clean up any scratch dirs that might be left out there if a test fails.
 
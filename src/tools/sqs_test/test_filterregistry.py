@@ -0,0 +1,130 @@
+import sys
+from os import path
+# NOTE: I needed to fix the sys.path to point up and over to sqs directory for imports.
+#       This is a huge hack that works under certain particular circumstances and will
+#       probably need modifying in the future.
+sys.path.append(  path.abspath("tools/sqs/") )
+
+import os
+import json
+import unittest
+from unittest import mock
+from common import ScratchDirManager
+import filterregistry
+from filterregistry import FilterRegistry, PLUGIN_PACKAGE
+from filtercommand import runFilter
+
+
+pluginSource = '''"""Upper cases text files."""
+import os
+from common import forceFileExtension
+
+perFile = True
+
+def filterFiles(inputs, outputs, options, logger):
+    for pathIn in inputs:
+        with open(pathIn) as f:
+            data = f.read()
+        with open(outputs(os.path.basename(pathIn)), "w") as f:
+            f.write(data.upper())
+    return len(inputs)
+'''
+
+
+class TestFilterRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.sd = ScratchDirManager("tools/sqs_test/scr/registry")
+        self.pluginDir = self.sd.makeSubDir("plugins")
+        self.indexPath = self.sd.makeFilePath("filters.json")
+        for name in ("testupper", "merge", "_private"):
+            with open(path.join(self.pluginDir, name + ".py"), "w") as f:
+                f.write(pluginSource)
+
+    def tearDown(self):
+        sys.modules.pop(PLUGIN_PACKAGE + ".testupper", None)
+        self.sd.remove()
+
+    def test_builtIn(self):
+        registry = FilterRegistry()
+        self.assertIn("shellexec", registry.getFilterNames())
+        self.assertEqual(registry.getLoadedModules(), [])
+
+        # Built-in filters are the same modules as a normal import.
+        from filters import merge
+        self.assertIs(registry.getModule("merge"), merge)
+        self.assertIsNone(registry.getModule("nosuchfilter"))
+
+        # Placeholder modules without filterFiles() are not filters.
+        for name in ("jsminify", "split", "template"):
+            self.assertNotIn(name, registry.getFilterNames())
+        for name in registry.getFilterNames():
+            self.assertIsNotNone(registry.getModule(name), msg=name)
+
+    def test_pluginDir(self):
+        registry = FilterRegistry()
+        registry.addFilterDirs([self.pluginDir], self.indexPath)
+
+        # The plug-in is known but not imported until it is used; built-ins win.
+        self.assertIn("testupper", registry.getFilterNames())
+        self.assertNotIn("_private", registry.getFilterNames())
+        self.assertNotIn(PLUGIN_PACKAGE + ".testupper", sys.modules)
+        module = registry.getModule("testupper")
+        self.assertTrue(module.perFile)
+        self.assertIn(PLUGIN_PACKAGE + ".testupper", sys.modules)
+        self.assertIsNot(registry.getModule("merge"), module)
+        self.assertEqual(registry.getLoadedModules(), [module, registry.getModule("merge")])
+
+        # The index records the scan.
+        with open(self.indexPath) as f:
+            index = json.load(f)
+        entry = index[path.abspath(self.pluginDir)]
+        self.assertEqual(sorted(entry["filters"]), ["merge", "testupper"])
+        self.assertEqual(entry["filters"]["testupper"], path.join(path.abspath(self.pluginDir), "testupper.py"))
+
+        # A new registry uses the index without scanning, until the directory changes.
+        with mock.patch("filterregistry.scanFilterDir", wraps=filterregistry.scanFilterDir) as scan:
+            registry = FilterRegistry()
+            registry.addFilterDirs([self.pluginDir], self.indexPath)
+            self.assertEqual(scan.call_count, 0)
+            self.assertIn("testupper", registry.getFilterNames())
+
+            os.rename(path.join(self.pluginDir, "testupper.py"), path.join(self.pluginDir, "testlower.py"))
+            os.utime(self.pluginDir, ns=(1, 1))
+            registry = FilterRegistry()
+            registry.addFilterDirs([self.pluginDir], self.indexPath)
+            self.assertEqual(scan.call_count, 1)
+            self.assertIn("testlower", registry.getFilterNames())
+            self.assertNotIn("testupper", registry.getFilterNames())
+
+            # Indexes from before filter paths were stored on their own are scanned again.
+            with open(self.indexPath) as f:
+                index = json.load(f)
+            entry = index[path.abspath(self.pluginDir)]
+            entry["filters"] = {name: {"path": filePath, "mtime": 1} for name, filePath in entry["filters"].items()}
+            with open(self.indexPath, "w") as f:
+                json.dump(index, f)
+            registry = FilterRegistry()
+            registry.addFilterDirs([self.pluginDir], self.indexPath)
+            self.assertEqual(scan.call_count, 2)
+            self.assertIn("testlower", registry.getFilterNames())
+
+    def test_runFilterPlugin(self):
+        inPath = self.sd.makeFilePath("in.txt")
+        with open(inPath, "w") as f:
+            f.write("plug-in text")
+        outDir = self.sd.makeSubDir("out")
+        config = {
+            "build-dir": self.sd.makeFilePath("build"),
+            "filter-dirs": [self.pluginDir],
+            "filter-profiles": {"upper": [{"filter": "testupper"}]}
+        }
+
+        runFilter(config, "upper", [inPath], outDir)
+
+        with open(path.join(outDir, "in.txt")) as f:
+            self.assertEqual(f.read(), "PLUG-IN TEXT")
+        self.assertTrue(path.isfile(path.join(config["build-dir"], "cache", "filters.json")))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import sys
+from os import path
+# NOTE: I needed to fix the sys.path to point up and over to sqs directory for imports. 
+#       This is a huge hack that works under certain particular circumstances and will 
+#       probably need modifying in the future.
+#sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+#sys.path.append(  path.abspath("../sqs/") )
+sys.path.append(  path.abspath("tools/sqs/") )
+#import pprint;pprint.pprint(sys.path)
+
+import json
+import unittest
+from common import ScratchDirManager, makeOutputBuffersFunc
+from sqslogger import logger
+from filterhelpers import getFilterModule, getFilterBuffersFunc
+
+babylonData = {
+    "cameras": [{"name": "camera1"}],
+    "activeCameraID": "camera1",
+    "gravity": [0, -9.81, 0],
+    "lights": [{"name": "light1"}],
+    "meshes": [{"name": "mesh1"}]
+}
+
+cleanData = {
+    "cameras": [],
+    "lights": [],
+    "meshes": [{"name": "mesh1"}]
+}
+
+class TestFilterCleanBabylon(unittest.TestCase):
+
+    def test_cleanbabylonfilter(self):
+        filterFunc, filterDoc = getFilterModule("cleanbabylon")
+        self.assertIsNotNone(filterFunc)
+        
+        # Create scratch dir and add files.
+        sd = ScratchDirManager("tools/sqs_test/scr/scratch")
+        sdOut = sd.makeSubScratchDirManager("out")
+        fp = sd.makeFilePath("test.babylon")
+        with open(fp, "w") as f:
+            json.dump(babylonData, f)
+        notBabylon = sd.makeFilePath("test.txt")
+        with open(notBabylon, "w") as f:
+            f.write("Not a Babylon file.")
+        
+        # Only the .babylon file is processed.
+        self.assertEqual(filterFunc([fp, notBabylon], sdOut.makeOutputFilesFunc(), {}, logger), 1)
+        with open(sdOut.makeFilePath("test.babylon")) as f:
+            self.assertEqual(json.load(f), cleanData)
+        
+        # Clean up scratch dir.
+        sd.remove()
+
+    def test_cleanbabylonfilterBuffers(self):
+        filterBuffersFunc = getFilterBuffersFunc("cleanbabylon")
+        self.assertIsNotNone(filterBuffersFunc)
+        
+        inputs = [("test.babylon", json.dumps(babylonData).encode("utf-8")),
+                ("bad.babylon", b"{Not JSON."), ("test.txt", b"Not a Babylon file.")]
+        buffers = {}
+        
+        self.assertEqual(filterBuffersFunc(inputs, makeOutputBuffersFunc(buffers), {}, logger), 1)
+        self.assertEqual(list(buffers), ["test.babylon"])
+        self.assertEqual(json.loads(buffers["test.babylon"]), cleanData)
+
+if __name__ == '__main__':
+    unittest.main()
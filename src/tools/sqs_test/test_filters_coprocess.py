@@ -0,0 +1,153 @@
+import sys
+from os import path
+# NOTE: I needed to fix the sys.path to point up and over to sqs directory for imports.
+#       This is a huge hack that works under certain particular circumstances and will
+#       probably need modifying in the future.
+sys.path.append(  path.abspath("tools/sqs/") )
+
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from common import ScratchDirManager, makeOutputFilesFuncForDir
+from sqslogger import logger
+from filterhelpers import getFilterModule, getFilterValidateFunc, isFilterPerFile
+from filters.coprocess import shutdownWorkers, Worker
+
+# Upper cases files. Logs each start to the 'starts' file and exits, or for 'hang*' hangs,
+# without answering for input files named 'crash*' until the 'crashed' file exists.
+workerScript = """
+import os, sys, json, time
+with open(sys.argv[1], "a") as f:
+    f.write("start\\n")
+print("Worker ready.", flush=True)
+for line in sys.stdin:
+    job = json.loads(line)
+    if os.path.basename(job["pathIn"]).startswith("crash") and not os.path.exists(sys.argv[2]):
+        open(sys.argv[2], "w").close()
+        sys.exit(1)
+    if os.path.basename(job["pathIn"]).startswith("hang") and not os.path.exists(sys.argv[2]):
+        open(sys.argv[2], "w").close()
+        time.sleep(60)
+    if os.path.basename(job["pathIn"]).startswith("bad"):
+        print(json.dumps({"id": job["id"], "ok": False, "error": "bad file"}), flush=True)
+        continue
+    with open(job["pathIn"]) as f:
+        data = f.read()
+    with open(job["pathOut"], "w") as f:
+        f.write(data.upper() + job["arguments"].get("suffix", ""))
+    print(json.dumps({"id": job["id"], "ok": True}), flush=True)
+"""
+
+
+class TestFilterCoprocess(unittest.TestCase):
+
+    def setUp(self):
+        self.sd = ScratchDirManager("tools/sqs_test/scr/scratch")
+        self.script = self.sd.makeFilePath("worker.py")
+        with open(self.script, "w") as f:
+            f.write(workerScript)
+        self.starts = self.sd.makeFilePath("starts")
+        self.crashed = self.sd.makeFilePath("crashed")
+        self.options = {
+            "out-ext": "md",
+            "worker-command": "{python} {script} {starts} {crashed}",
+            "command-arguments": {"python": sys.executable, "script": self.script,
+                    "starts": self.starts, "crashed": self.crashed}
+        }
+        self.inDir = self.sd.makeSubDir("in")
+        self.outDir = self.sd.makeSubDir("out")
+
+    def tearDown(self):
+        shutdownWorkers()
+        self.sd.remove()
+
+    def makeInputs(self, names):
+        inFiles = []
+        for name in names:
+            inFiles.append(path.join(self.inDir, name))
+            with open(inFiles[-1], "w") as f:
+                f.write(name)
+        return inFiles
+
+    def getStartCount(self):
+        with open(self.starts) as f:
+            return len(f.readlines())
+
+    def test_reuseworker(self):
+        filterFunc, filterDoc = getFilterModule("coprocess")
+        self.assertIsNotNone(filterFunc)
+        self.assertTrue(isFilterPerFile("coprocess"))
+
+        # One warm worker filters every file, across filter calls.
+        inFiles = self.makeInputs(["a.txt", "b.txt", "c.txt"])
+        options = dict(self.options, **{"job-arguments": {"suffix": "!"}})
+        outputs = makeOutputFilesFuncForDir(self.outDir)
+        self.assertEqual(filterFunc(inFiles[:2], outputs, options, logger), 2)
+        self.assertEqual(filterFunc(inFiles[2:], outputs, options, logger), 1)
+        self.assertEqual(self.getStartCount(), 1)
+        with open(path.join(self.outDir, "b.md")) as f:
+            self.assertEqual(f.read(), "B.TXT!")
+
+        # Workers start again after a shutdown.
+        shutdownWorkers()
+        self.assertEqual(filterFunc(inFiles[:1], outputs, options, logger), 1)
+        self.assertEqual(self.getStartCount(), 2)
+
+    def test_crashrestart(self):
+        filterFunc, filterDoc = getFilterModule("coprocess")
+        inFiles = self.makeInputs(["a.txt", "crash.txt", "bad.txt", "d.txt"])
+        outputs = makeOutputFilesFuncForDir(self.outDir)
+
+        # The worker crashes on 'crash.txt' once and is restarted; 'bad.txt' fails.
+        self.assertEqual(filterFunc(inFiles, outputs, self.options, logger), 3)
+        self.assertEqual(self.getStartCount(), 2)
+        self.assertTrue(path.isfile(path.join(self.outDir, "crash.md")))
+        self.assertFalse(path.isfile(path.join(self.outDir, "bad.md")))
+
+        # Without restarts a crash fails the file.
+        os.remove(self.crashed)
+        options = dict(self.options, restarts=0)
+        self.assertEqual(filterFunc(inFiles[1:2], outputs, options, logger), 0)
+
+    def test_timeout(self):
+        filterFunc, filterDoc = getFilterModule("coprocess")
+        inFiles = self.makeInputs(["a.txt", "hang.txt"])
+        outputs = makeOutputFilesFuncForDir(self.outDir)
+        options = dict(self.options, timeout=1)
+        self.assertTrue(getFilterValidateFunc("coprocess")(options, logger))
+        self.assertFalse(getFilterValidateFunc("coprocess")(dict(self.options, timeout=0), logger))
+
+        # The worker hangs on 'hang.txt' once, is killed and restarted.
+        self.assertEqual(filterFunc(inFiles, outputs, options, logger), 2)
+        self.assertEqual(self.getStartCount(), 2)
+        self.assertTrue(path.isfile(path.join(self.outDir, "hang.md")))
+
+        # Without restarts a hung worker fails the file.
+        os.remove(self.crashed)
+        options = dict(options, restarts=0)
+        self.assertEqual(filterFunc(inFiles[1:], outputs, options, logger), 0)
+
+        # A job timer firing after the answer came leaves the worker running.
+        worker = Worker(sys.executable + " " + self.script + " " + self.starts + " " + self.crashed)
+        self.assertTrue(worker.start(logger))
+        try:
+            self.assertTrue(worker.runJob(path.abspath(inFiles[0]), path.abspath(path.join(self.outDir, "late.md")), {}, logger, 30))
+            worker.expire(worker.process)
+            self.assertTrue(worker.isRunning())
+        finally:
+            worker.stop()
+
+    def test_pool(self):
+        filterFunc, filterDoc = getFilterModule("coprocess")
+        inFiles = self.makeInputs(["f{0}.txt".format(i) for i in range(12)])
+        outputs = makeOutputFilesFuncForDir(self.outDir)
+        options = dict(self.options, workers=3)
+
+        # Files sent at the same time share the pool without starting extra workers.
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            counts = list(executor.map(lambda pathIn: filterFunc([pathIn], outputs, options, logger), inFiles))
+        self.assertEqual(counts, [1] * 12)
+        self.assertLessEqual(self.getStartCount(), 3)
+
+if __name__ == '__main__':
+    unittest.main()
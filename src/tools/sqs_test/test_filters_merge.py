@@ -9,9 +9,9 @@ sys.path.append(  path.abspath("tools/sqs/") )
 #import pprint;pprint.pprint(sys.path)
 
 import unittest
-from common import ScratchDirManager, forceFileExtension, makeOutputFilesFuncForDir
+from common import ScratchDirManager, forceFileExtension, makeOutputFilesFuncForDir, makeOutputBuffersFunc
 from sqslogger import logger
-from filterhelpers import getFilterModule
+from filterhelpers import getFilterModule, getFilterBuffersFunc
 
 filterOptions = {
     "out-name": "testmerged.txt",
@@ -64,6 +64,18 @@ class TestFilterShellExec(unittest.TestCase):
         # Clean up scratch dir.
         sd.remove()
 
+    def test_mergefilterBuffers(self):
+        filterBuffersFunc = getFilterBuffersFunc("merge")
+        self.assertIsNotNone(filterBuffersFunc)
+        
+        inputs = [("test{0}.txt".format(i), data.encode("utf-8")) for i, data in 
+                enumerate([fileData1, fileData2, fileData3, fileData4])]
+        buffers = {}
+        
+        # Same result as the filter files function, without touching the disk.
+        self.assertEqual(filterBuffersFunc(inputs, makeOutputBuffersFunc(buffers), filterOptions, logger), 4)
+        self.assertEqual(buffers, {"testmerged.txt": combinedData.encode("utf-8")})
+
     # TODO: More tests. 
 
 if __name__ == '__main__':
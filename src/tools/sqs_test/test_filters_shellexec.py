@@ -8,11 +8,17 @@ from os import path
 sys.path.append(  path.abspath("tools/sqs/") )
 #import pprint;pprint.pprint(sys.path)
 
+import os
+import json
+import time
 import unittest
 from filecmp import cmp
 from common import ScratchDirManager, forceFileExtension, makeOutputFilesFuncForDir
 from sqslogger import logger
-from filterhelpers import getFilterModule
+from filterhelpers import getFilterModule, isFilterPerFile
+from filters.shellexec import makeBatchCommands, validateOptions
+from unittest import mock
+from commandrunner import getCommandStats, waitStatusToExitCode, startCommand, reapCommand, killCommand
 
 copyFilterOptions = {
     "in-ext": "txt",
@@ -65,6 +71,159 @@ class TestFilterShellExec(unittest.TestCase):
         outputs = makeOutputFilesFuncForDir("tools/sqs_test/scr/scratch")
         self.assertEqual(filterFunc([fp1], outputs, copyFilterOptions, logger), 0)
 
+    def test_streamfilter(self):
+        filterFunc, filterDoc = getFilterModule("shellexec")
+        
+        # Create scratch dir and add file.
+        sd = ScratchDirManager("tools/sqs_test/scr/scratch")
+        fp1 = sd.makeFilePath("test.txt")
+        outputs = sd.makeOutputFilesFunc()
+        with open(fp1, "w") as f:
+            f.write("This is a temporary test text file.")
+        
+        # STDIN is the input file and STDOUT goes to the output file.
+        options = {"out-ext": "md", "stream": True, "command-template": "tr {src} {dst}",
+                "command-arguments": {"src": "a-z", "dst": "A-Z"}}
+        self.assertEqual(filterFunc([fp1], outputs, options, logger), 1)
+        with open(sd.makeFilePath("test.md")) as f:
+            self.assertEqual(f.read(), "THIS IS A TEMPORARY TEST TEXT FILE.")
+        
+        # A failing command.
+        options = {"stream": True, "command-template": "exit 1"}
+        self.assertEqual(filterFunc([fp1], makeOutputFilesFuncForDir(sd.makeSubDir("out")), options, logger), 0)
+        
+        # Clean up scratch dir.
+        sd.remove()
+
+    def test_batchfilter(self):
+        filterFunc, filterDoc = getFilterModule("shellexec")
+        
+        # Create scratch dir and add files, one with a space in its name.
+        sd = ScratchDirManager("tools/sqs_test/scr/scratch")
+        names = ["a.txt", "b c.txt", "d.txt"]
+        inFiles = []
+        for name in names:
+            inFiles.append(sd.makeFilePath(name))
+            with open(inFiles[-1], "w") as f:
+                f.write(name)
+        outDir = sd.makeSubDir("out")
+        spawnLog = sd.makeFilePath("spawns.log")
+        
+        # One command copies every file.
+        options = {"batch-command-template": "echo x >> {log}; cp {pathsIn} {outDir}",
+                "command-arguments": {"log": spawnLog}}
+        self.assertFalse(isFilterPerFile("shellexec", options))
+        self.assertEqual(filterFunc(inFiles, makeOutputFilesFuncForDir(outDir), options, logger), 3)
+        for name in names:
+            self.assertTrue(cmp(sd.makeFilePath(name), path.join(outDir, name)))
+        with open(spawnLog) as f:
+            self.assertEqual(f.read(), "x\n")
+        
+        # Outputs left over from before, or not written, don't count.
+        options = {"batch-command-template": 'for f in {pathsIn}; do case "$f" in *d.txt) ;; *) cp "$f" {outDir};; esac; done'}
+        self.assertEqual(filterFunc(inFiles, makeOutputFilesFuncForDir(outDir), options, logger), 2)
+        
+        # A failing command.
+        options = {"batch-command-template": "exit 1 {pathsIn}"}
+        self.assertEqual(filterFunc(inFiles, makeOutputFilesFuncForDir(sd.makeSubDir("out2")), options, logger), 0)
+        
+        # Clean up scratch dir.
+        sd.remove()
+
+    def test_batchcommands(self):
+        options = {"batch-command-template": "tool -o {outDir} {pathsIn}"}
+        pathsIn = ["dir/file{0}.png".format(i) for i in range(10)]
+        
+        # Everything fits in one command.
+        commands = makeBatchCommands(pathsIn, "out dir", options, logger)
+        self.assertEqual(len(commands), 1)
+        self.assertEqual(commands[0][0], "tool -o 'out dir' " + " ".join(pathsIn))
+        self.assertEqual(commands[0][1], pathsIn)
+        
+        # A short limit splits the paths across commands, in order, without going over.
+        commands = makeBatchCommands(pathsIn, "out", options, logger, 60)
+        self.assertGreater(len(commands), 1)
+        self.assertEqual([pathIn for command, chunkPaths in commands for pathIn in chunkPaths], pathsIn)
+        for command, chunkPaths in commands:
+            self.assertLessEqual(len(command), 60)
+        
+        # The template must use the input paths.
+        self.assertIsNone(makeBatchCommands(pathsIn, "out", {"batch-command-template": "tool {outDir}"}, logger))
+
+    def test_timeout(self):
+        filterFunc, filterDoc = getFilterModule("shellexec")
+        sd = ScratchDirManager("tools/sqs_test/scr/scratch")
+        fp1 = sd.makeFilePath("test.txt")
+        with open(fp1, "w") as f:
+            f.write("This is a temporary test text file.")
+        
+        # The shell and the command it started are both killed.
+        getCommandStats().reset()
+        options = {"command-template": "sleep 30 && cp {pathIn} {pathOut}", "timeout": 0.5}
+        started = time.monotonic()
+        self.assertEqual(filterFunc([fp1], sd.makeOutputFilesFunc(), options, logger), 0)
+        self.assertLess(time.monotonic() - started, 10)
+        
+        entry = getCommandStats().getReport()[0]
+        self.assertEqual(entry["command"], options["command-template"])
+        self.assertEqual((entry["runs"], entry["timeouts"], entry["failures"]), (1, 1, 0))
+        
+        self.assertFalse(validateOptions({"command-template": "cp {pathIn} {pathOut}", "timeout": 0}, logger))
+        self.assertFalse(validateOptions({"command-template": "cp {pathIn} {pathOut}", "timeout": "1"}, logger))
+        
+        sd.remove()
+
+    @unittest.skipUnless(hasattr(os, "WIFEXITED"), "Needs a POSIX system.")
+    def test_waitStatus(self):
+        # Exit codes are the same without os.waitstatus_to_exitcode() (Python 3.8).
+        for command, expected in (("exit 3", 3), ("kill -9 $$", -9)):
+            status = os.system(command)
+            self.assertEqual(waitStatusToExitCode(status), expected)
+            with mock.patch("commandrunner.os", wraps=os) as mockOS:
+                del mockOS.waitstatus_to_exitcode
+                self.assertEqual(waitStatusToExitCode(status), expected)
+
+        # A reaped command is never killed, as its process ID may have been reused.
+        proc = startCommand("exit 3")
+        self.assertIsNotNone(reapCommand(proc))
+        self.assertEqual(proc.returncode, 3)
+        with mock.patch("os.killpg") as killpg:
+            killCommand(proc)
+        killpg.assert_not_called()
+        
+    def test_commandStats(self):
+        filterFunc, filterDoc = getFilterModule("shellexec")
+        sd = ScratchDirManager("tools/sqs_test/scr/scratch")
+        paths = []
+        for i in range(3):
+            paths.append(sd.makeFilePath("test{0}.txt".format(i)))
+            with open(paths[-1], "w") as f:
+                f.write("This is a temporary test text file.")
+        
+        # Every run is added up under the command template.
+        getCommandStats().reset()
+        options = {"command-template": "cp {pathIn} {pathOut}", "timeout": 30}
+        outputs = makeOutputFilesFuncForDir(sd.makeSubDir("out"))
+        self.assertEqual(filterFunc(paths, outputs, options, logger), 3)
+        self.assertEqual(filterFunc([sd.makeFilePath("missing.txt")], outputs, options, logger), 0)
+        
+        report = getCommandStats().getReport()
+        self.assertEqual(len(report), 1)
+        entry = report[0]
+        self.assertEqual((entry["runs"], entry["failures"], entry["timeouts"]), (4, 1, 0))
+        self.assertGreaterEqual(entry["wall-time"], entry["max-wall-time"])
+        if hasattr(os, "wait4"):
+            self.assertIsNotNone(entry["cpu-time"])
+            self.assertGreater(entry["peak-rss"], 0)
+        
+        # The report is written as JSON.
+        reportPath = sd.makeFilePath("report.json")
+        self.assertTrue(getCommandStats().writeReport(reportPath))
+        with open(reportPath) as f:
+            self.assertEqual(json.load(f)["commands"][0]["runs"], 4)
+        
+        sd.remove()
+
     # TODO: More tests. Test 'command-arguments' option.
 
 if __name__ == '__main__':
@@ -0,0 +1,384 @@
+import sys
+from os import path
+# NOTE: I needed to fix the sys.path to point up and over to sqs directory for imports.
+#       This is a huge hack that works under certain particular circumstances and will
+#       probably need modifying in the future.
+#sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+#sys.path.append(  path.abspath("../sqs/") )
+sys.path.append(  path.abspath("tools/sqs/") )
+#import pprint;pprint.pprint(sys.path)
+
+import os
+import json
+import zipfile
+import unittest
+from unittest import mock
+from filecmp import cmp
+from common import ScratchDirManager, ModuleConfiguration, ResourceFlavor
+import pipelinecommand
+from pipelinecommand import processModuleData, processModules, PipelineResource
+from buildmanifest import MANIFEST_FILE_NAME
+from sqslogger import logger
+
+
+testSourceDir = "tools/sqs_test/scr/sourceDir"
+testAssetDir = "tools/sqs_test/scr/assetDir"
+
+copyFilterProfile = "testcopy"
+countFilterProfile = "testcount"
+countFilePath = "tools/sqs_test/scr/build/count.txt"
+
+testConfig = {
+    "build-dir": "tools/sqs_test/scr/build",
+    "texture-dir": testAssetDir,
+    "filter-profiles": {
+        copyFilterProfile: [
+            {
+                "filter": "shellexec",
+                "options": {
+                    "out-ext": "md",
+                    "command-template": "cp {pathIn} {pathOut}"
+                }
+            }
+        ],
+        countFilterProfile: [
+            {
+                "filter": "shellexec",
+                "options": {
+                    "command-template": "cp {pathIn} {pathOut} && echo x >> " + countFilePath
+                }
+            }
+        ]
+    }
+}
+
+def makeTestFile(fp, fileData):
+    file = open(fp, "w")
+    file.write(fileData)
+    file.close()
+    return fp
+
+def makeTextureElem(name, sourcePath, fileName, filterProfile = None):
+    cacheOptions = {"file-source": sourcePath}
+    if filterProfile:
+        cacheOptions["filter-profile"] = filterProfile
+    return {
+        "resource-name": name,
+        "config": {
+            "cache-options": cacheOptions,
+            "file-name": fileName
+        }
+    }
+
+class TestPipelineCommand(unittest.TestCase):
+
+    def setUp(self):
+        self.sdSource = ScratchDirManager(testSourceDir)
+        self.sdAsset = ScratchDirManager(testAssetDir)
+
+    def tearDown(self):
+        self.sdSource.remove()
+        self.sdAsset.remove()
+        ScratchDirManager(testConfig["build-dir"]).remove()
+
+    def makeModuleData(self, count, filterProfile = None):
+        textures = []
+        for i in range(count):
+            sourcePath = makeTestFile(self.sdSource.makeFilePath("source{0}.txt".format(i)),
+                    "This is temporary test text file {0}.".format(i))
+            textures.append(makeTextureElem("tex{0}".format(i), sourcePath, "tex{0}.txt".format(i), filterProfile))
+        textures.append(makeTextureElem("missing", self.sdSource.makeFilePath("missing.txt"), "missing.txt"))
+        return {"module-name": "testmodule", "resources": {"textures": textures}}
+
+    def test_pipelineSerial(self):
+        moduleData = self.makeModuleData(3)
+
+        results = processModuleData(testConfig, moduleData)
+
+        self.assertEqual(results, [("tex0", True), ("tex1", True), ("tex2", True), ("missing", False)])
+        for i in range(3):
+            self.assertTrue(cmp(self.sdSource.makeFilePath("source{0}.txt".format(i)),
+                    self.sdAsset.makeFilePath("tex{0}.txt".format(i))))
+
+    def test_pipelineJobs(self):
+        moduleData = self.makeModuleData(12, copyFilterProfile)
+
+        results = processModuleData(testConfig, moduleData, 4)
+
+        # Results are reported in resource order no matter which worker finished first.
+        expected = [("tex{0}".format(i), True) for i in range(12)] + [("missing", False)]
+        self.assertEqual(results, expected)
+        for i in range(12):
+            self.assertTrue(cmp(self.sdSource.makeFilePath("source{0}.txt".format(i)),
+                    self.sdAsset.makeFilePath("tex{0}.md".format(i))))
+
+    def countFilterRuns(self):
+        if not os.path.isfile(countFilePath):
+            return 0
+        with open(countFilePath) as f:
+            return len(f.readlines())
+
+    def test_pipelineSkipsUnchanged(self):
+        moduleData = self.makeModuleData(3, countFilterProfile)
+
+        processModuleData(testConfig, moduleData)
+        self.assertEqual(self.countFilterRuns(), 3)
+
+        # Nothing changed, so nothing is filtered again.
+        processModuleData(testConfig, moduleData)
+        self.assertEqual(self.countFilterRuns(), 3)
+
+        # Change one source and delete one output.
+        makeTestFile(self.sdSource.makeFilePath("source0.txt"), "Changed.")
+        os.remove(self.sdAsset.makeFilePath("tex1.txt"))
+        results = processModuleData(testConfig, moduleData)
+        self.assertEqual(self.countFilterRuns(), 5)
+        self.assertEqual(results[:3], [("tex0", True), ("tex1", True), ("tex2", True)])
+        self.assertTrue(cmp(self.sdSource.makeFilePath("source0.txt"), self.sdAsset.makeFilePath("tex0.txt")))
+
+        # Forcing rebuilds everything.
+        processModuleData(testConfig, moduleData, force=True)
+        self.assertEqual(self.countFilterRuns(), 8)
+
+    def test_pipelineDeduplicates(self):
+        sourcePath = makeTestFile(self.sdSource.makeFilePath("shared.txt"), "Shared source.")
+        module1 = {"module-name": "module1", "resources": {"textures": [
+            makeTextureElem("a", sourcePath, "a.txt", countFilterProfile),
+            makeTextureElem("b", sourcePath, "b.txt", countFilterProfile),
+            makeTextureElem("c", sourcePath, "c.txt")]}}
+        module2 = {"module-name": "module2", "resources": {"textures": [
+            makeTextureElem("d", sourcePath, "d.txt", countFilterProfile)]}}
+
+        results = processModules(testConfig, [module1, module2])
+
+        self.assertEqual(results, [[("a", True), ("b", True), ("c", True)], [("d", True)]])
+        # One filter run for the three resources with the same source and filter profile.
+        self.assertEqual(self.countFilterRuns(), 1)
+        for name in ("a.txt", "b.txt", "c.txt", "d.txt"):
+            self.assertTrue(cmp(sourcePath, self.sdAsset.makeFilePath(name)))
+
+        # Modules configured to filter differently don't share the filter run.
+        module3 = {"module-name": "module3", "config": {"link-mode": "hardlink"}, "resources": {"textures": [
+            makeTextureElem("e", sourcePath, "e.txt", countFilterProfile)]}}
+        results = processModules(testConfig, [module1, module3], force=True)
+        self.assertEqual(results, [[("a", True), ("b", True), ("c", True)], [("e", True)]])
+        self.assertEqual(self.countFilterRuns(), 3)
+
+    def test_pipelineResume(self):
+        moduleData = self.makeModuleData(3, countFilterProfile)
+
+        results = processModuleData(testConfig, moduleData)
+        self.assertEqual(results[3], ("missing", False))
+        self.assertEqual(self.countFilterRuns(), 3)
+
+        # Fix the failed resource and pretend the run was killed while tex0 was being
+        # rebuilt.
+        makeTestFile(self.sdSource.makeFilePath("missing.txt"), "Not missing now.")
+        os.remove(self.sdAsset.makeFilePath("tex0.txt"))
+        with open(path.join(testConfig["build-dir"], "pipeline.journal"), "a") as journal:
+            journal.write('{"output": "' + self.sdAsset.makeFilePath("tex0.txt") + '", "status": "started"}\n')
+
+        # Only the failed and interrupted resources are processed.
+        results = processModuleData(testConfig, moduleData, resume=True)
+        self.assertEqual(results, [("tex0", True), ("tex1", True), ("tex2", True), ("missing", True)])
+        self.assertEqual(self.countFilterRuns(), 4)
+        self.assertTrue(cmp(self.sdSource.makeFilePath("missing.txt"), self.sdAsset.makeFilePath("missing.txt")))
+
+        # No temporary files are left behind by publishing.
+        self.assertEqual(sorted(os.listdir(testAssetDir)), ["missing.txt", "tex0.txt", "tex1.txt", "tex2.txt"])
+
+    def test_pipelineInvalidFilters(self):
+        moduleData = self.makeModuleData(2, countFilterProfile)
+        textures = moduleData["resources"]["textures"]
+        textures.append(makeTextureElem("noprofile", self.sdSource.makeFilePath("source0.txt"), "noprofile.txt", "nosuchprofile"))
+        badElem = makeTextureElem("badchain", self.sdSource.makeFilePath("source1.txt"), "badchain.txt")
+        badElem["config"]["cache-options"]["filters"] = testConfig["filter-profiles"][countFilterProfile] + [{"filter": "nosuchfilter"}]
+        textures.append(badElem)
+
+        results = processModuleData(testConfig, moduleData)
+
+        # Resources with bad filters fail without running any filter.
+        self.assertEqual(results, [("tex0", True), ("tex1", True), ("missing", False), ("noprofile", False), ("badchain", False)])
+        self.assertEqual(self.countFilterRuns(), 2)
+        self.assertFalse(path.exists(self.sdAsset.makeFilePath("badchain.txt")))
+
+    def test_pipelineBatch(self):
+        moduleData = self.makeModuleData(4, copyFilterProfile)
+        moduleData["resources"]["textures"].append(makeTextureElem("plain", 
+                self.sdSource.makeFilePath("source0.txt"), "plain.txt"))
+
+        with mock.patch("pipelinecommand.processFilterChain", wraps=pipelinecommand.processFilterChain) as chain:
+            results = processModuleData(testConfig, moduleData, batch=True)
+
+        expected = [("tex{0}".format(i), True) for i in range(4)] + [("missing", False), ("plain", True)]
+        self.assertEqual(results, expected)
+        # One run for the four resources with the copy profile and one for 'plain'.
+        self.assertEqual(chain.call_count, 2)
+        for i in range(4):
+            self.assertTrue(cmp(self.sdSource.makeFilePath("source{0}.txt".format(i)),
+                    self.sdAsset.makeFilePath("tex{0}.md".format(i))))
+        self.assertTrue(cmp(self.sdSource.makeFilePath("source0.txt"), self.sdAsset.makeFilePath("plain.txt")))
+
+    def test_pipelineBatchMerge(self):
+        mergeFilters = [{"filter": "merge", "options": {"out-name": "merged.txt"}}]
+        moduleData = self.makeModuleData(2)
+        del moduleData["resources"]["textures"][-1]
+        for elem in moduleData["resources"]["textures"]:
+            elem["config"]["cache-options"]["filters"] = mergeFilters
+        
+        def check(results):
+            self.assertEqual(results, [("tex0", True), ("tex1", True)])
+            with open(self.sdAsset.makeFilePath("merged.txt")) as f:
+                self.assertEqual(f.read(), "This is temporary test text file 1.")
+            self.sdAsset.clear()
+        
+        # Many-to-one filters are never batched.
+        self.assertFalse(pipelinecommand.isChainBatchable(mergeFilters))
+        for batch in (False, True):
+            check(processModuleData(testConfig, moduleData, batch=batch, force=True))
+        
+        # Batch outputs which don't match a resource are made again one at a time.
+        with mock.patch("pipelinecommand.isChainBatchable", return_value=True), \
+                mock.patch("pipelinecommand.processResourceGroupSource", wraps=pipelinecommand.processResourceGroupSource) as perGroup:
+            check(processModuleData(testConfig, moduleData, batch=True, force=True))
+        self.assertEqual(perGroup.call_count, 2)
+
+    def test_pipelineBranches(self):
+        branchFilters = [{"branches": [
+            {"filters": []},
+            {"out-suffix": "-half", "filters": [{"filter": "shellexec", "options": {"command-template": "head -c 10 {pathIn} > {pathOut}"}}]}
+        ]}]
+        for batch in (False, True):
+            moduleData = self.makeModuleData(2)
+            textures = moduleData["resources"]["textures"]
+            # A second resource with the same source and filters gets its own variants.
+            textures.append(makeTextureElem("copy", self.sdSource.makeFilePath("source0.txt"), "copy.txt"))
+            for elem in textures:
+                elem["config"]["cache-options"]["filters"] = branchFilters
+
+            results = processModuleData(testConfig, moduleData, batch=batch, force=True)
+
+            self.assertEqual(results, [("tex0", True), ("tex1", True), ("missing", False), ("copy", True)])
+            self.assertEqual(sorted(os.listdir(testAssetDir)), 
+                    ["copy-half.txt", "copy.txt", "tex0-half.txt", "tex0.txt", "tex1-half.txt", "tex1.txt"])
+            with open(self.sdAsset.makeFilePath("tex1-half.txt")) as f:
+                self.assertEqual(f.read(), "This is te")
+            self.sdAsset.clear()
+
+    def test_pipelineBatchBranchStems(self):
+        # One resource's branch output has the other resource's file name.
+        branchFilters = [{"branches": [{"out-suffix": "_big", "filters": []}, {"out-suffix": "_small", "filters": []}]}]
+        textures = [
+            makeTextureElem("tex", makeTestFile(self.sdSource.makeFilePath("one.txt"), "ONE"), "tex.txt"),
+            makeTextureElem("texbig", makeTestFile(self.sdSource.makeFilePath("two.txt"), "TWO"), "tex_big.txt")]
+        for elem in textures:
+            elem["config"]["cache-options"]["filters"] = branchFilters
+        moduleData = {"module-name": "testmodule", "resources": {"textures": textures}}
+
+        results = processModuleData(testConfig, moduleData, batch=True)
+
+        self.assertEqual(results, [("tex", True), ("texbig", True)])
+        expected = {"tex_big.txt": "ONE", "tex_small.txt": "ONE", "tex_big_big.txt": "TWO", "tex_big_small.txt": "TWO"}
+        self.assertEqual(sorted(os.listdir(testAssetDir)), sorted(expected))
+        for name, data in expected.items():
+            with open(self.sdAsset.makeFilePath(name)) as f:
+                self.assertEqual(f.read(), data, msg=name)
+
+        # Each resource's manifest entry lists its own outputs.
+        with open(path.join(testConfig["build-dir"], MANIFEST_FILE_NAME)) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest[self.sdAsset.makeFilePath("tex.txt")]["outputs"], 
+                [self.sdAsset.makeFilePath("tex_big.txt"), self.sdAsset.makeFilePath("tex_small.txt")])
+        self.assertEqual(manifest[self.sdAsset.makeFilePath("tex_big.txt")]["outputs"], 
+                [self.sdAsset.makeFilePath("tex_big_big.txt"), self.sdAsset.makeFilePath("tex_big_small.txt")])
+
+    def test_pipelineBranchesSkipUnchanged(self):
+        # Every branch has an out-suffix, so no file is published at the output path.
+        countCommand = "cp {pathIn} {pathOut} && echo x >> " + countFilePath
+        branchFilters = [{"branches": [
+            {"out-suffix": "-a", "filters": [{"filter": "shellexec", "options": {"command-template": countCommand}}]},
+            {"out-suffix": "-b", "filters": [{"filter": "shellexec", "options": {"command-template": countCommand}}]}
+        ]}]
+        moduleData = self.makeModuleData(2)
+        for elem in moduleData["resources"]["textures"]:
+            elem["config"]["cache-options"]["filters"] = branchFilters
+
+        processModuleData(testConfig, moduleData)
+        self.assertEqual(self.countFilterRuns(), 4)
+        self.assertEqual(sorted(os.listdir(testAssetDir)), ["tex0-a.txt", "tex0-b.txt", "tex1-a.txt", "tex1-b.txt"])
+
+        # Nothing changed, so nothing is filtered again, with or without resuming.
+        processModuleData(testConfig, moduleData)
+        self.assertEqual(self.countFilterRuns(), 4)
+        processModuleData(testConfig, moduleData, resume=True)
+        self.assertEqual(self.countFilterRuns(), 4)
+
+        # Deleting one branch output rebuilds its resource.
+        os.remove(self.sdAsset.makeFilePath("tex1-b.txt"))
+        processModuleData(testConfig, moduleData, resume=True)
+        self.assertEqual(self.countFilterRuns(), 6)
+        self.assertTrue(os.path.isfile(self.sdAsset.makeFilePath("tex1-b.txt")))
+
+    def test_publishGroupOutputs(self):
+        modConfig = ModuleConfiguration(testConfig, {})
+        group = [PipelineResource(name, ResourceFlavor.TEXTURE, modConfig, "file-source", "source.txt", None, 
+                self.sdAsset.makeFilePath(name + ".txt")) for name in ("tex", "other")]
+        outputs = [makeTestFile(self.sdSource.makeFilePath(name), name) for name in ("tex.txt", "texture_normal.txt")]
+
+        # Only outputs named after the staged source are renamed for each resource.
+        self.assertTrue(pipelinecommand.publishGroupOutputs(group, outputs, "tex"))
+        self.assertEqual(sorted(os.listdir(testAssetDir)), ["other.txt", "tex.txt", "texture_normal.txt"])
+        self.assertEqual(group[1].publishedPaths, 
+                [self.sdAsset.makeFilePath("other.txt"), self.sdAsset.makeFilePath("texture_normal.txt")])
+
+    def test_pipelineLinkMode(self):
+        config = dict(testConfig, **{"link-mode": "hardlink"})
+        moduleData = self.makeModuleData(2)
+        filteredSource = makeTestFile(self.sdSource.makeFilePath("filtered.txt"), "Filtered.")
+        moduleData["resources"]["textures"].append(makeTextureElem("filtered", filteredSource, "filtered.txt", copyFilterProfile))
+
+        for i in range(2):
+            results = processModuleData(config, moduleData, force=True)
+            self.assertEqual(results, [("tex0", True), ("tex1", True), ("missing", False), ("filtered", True)])
+
+            # Unfiltered assets are the source files themselves; filtered sources are 
+            # never linked into the scratch directory, where a filter could change them.
+            for j in range(2):
+                self.assertTrue(path.samefile(self.sdSource.makeFilePath("source{0}.txt".format(j)),
+                        self.sdAsset.makeFilePath("tex{0}.txt".format(j))))
+            self.assertEqual(os.stat(filteredSource).st_nlink, 1)
+            self.assertTrue(cmp(filteredSource, self.sdAsset.makeFilePath("filtered.md")))
+            self.assertEqual(sorted(os.listdir(testAssetDir)), ["filtered.md", "tex0.txt", "tex1.txt"])
+
+        # Copying again replaces the links rather than writing through them.
+        results = processModuleData(dict(config, **{"link-mode": "copy"}), moduleData, force=True)
+        self.assertEqual(results[0], ("tex0", True))
+        self.assertFalse(path.samefile(self.sdSource.makeFilePath("source0.txt"), self.sdAsset.makeFilePath("tex0.txt")))
+        self.assertTrue(cmp(self.sdSource.makeFilePath("source0.txt"), self.sdAsset.makeFilePath("tex0.txt")))
+
+    def test_pipelineArchive(self):
+        archivePath = self.sdSource.makeFilePath("set.zip")
+        with zipfile.ZipFile(archivePath, "w") as zf:
+            zf.writestr("set/diffuse.png", "Diffuse.")
+            zf.writestr("set/normal.png", "Normal.")
+            zf.writestr("set/readme.txt", "Readme.")
+        def makeArchiveElem(name, member, fileName):
+            return {"resource-name": name, "config": {"file-name": fileName, "cache-options": 
+                    {"archive-source": archivePath, "archive-member": member}}}
+        moduleData = {"module-name": "testmodule", "resources": {"textures": [
+            makeArchiveElem("diffuse", "set/diffuse.png", "wall.png"),
+            makeArchiveElem("all", "set/*.png", "all.png"),
+            makeArchiveElem("missing", "set/missing.png", "missing.png"),
+            {"resource-name": "nomember", "config": {"file-name": "x.png", "cache-options": 
+                    {"archive-source": archivePath}}}]}}
+
+        results = processModuleData(testConfig, moduleData, 2)
+
+        self.assertEqual(results, [("diffuse", True), ("all", True), ("missing", False), ("nomember", False)])
+        # A single member is renamed to the file name, glob matches keep their names.
+        with open(self.sdAsset.makeFilePath("wall.png")) as f:
+            self.assertEqual(f.read(), "Diffuse.")
+        self.assertEqual(sorted(os.listdir(testAssetDir)), ["diffuse.png", "normal.png", "wall.png"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import sys
+from os import path
+# NOTE: I needed to fix the sys.path to point up and over to sqs directory for imports.
+#       This is a huge hack that works under certain particular circumstances and will
+#       probably need modifying in the future.
+sys.path.append(  path.abspath("tools/sqs/") )
+
+import os
+import unittest
+from common import ScratchDirManager
+from stepcache import StepCache, makeStepKey
+
+
+step1 = [{"filter": "shellexec", "options": {"command-template": "cp {pathIn} {pathOut}"}}]
+step2 = [{"filter": "shellexec", "options": {"command-template": "mv {pathIn} {pathOut}"}}]
+
+
+class TestStepCache(unittest.TestCase):
+
+    def setUp(self):
+        self.sd = ScratchDirManager("tools/sqs_test/scr/stepcache")
+
+    def tearDown(self):
+        self.sd.remove()
+
+    def test_key(self):
+        inputs = [("a.txt", "1" * 64), ("b.txt", "2" * 64)]
+        self.assertEqual(makeStepKey(step1, inputs), makeStepKey(step1, list(inputs)))
+        self.assertNotEqual(makeStepKey(step1, inputs), makeStepKey(step2, inputs))
+        self.assertNotEqual(makeStepKey(step1, inputs), makeStepKey(step1, inputs[:1]))
+        self.assertNotEqual(makeStepKey(step1, inputs), makeStepKey(step1, [inputs[1], inputs[0]]))
+
+    def test_putGet(self):
+        cache = StepCache(self.sd.makeSubDir("cache"), 1000)
+        self.assertIsNone(cache.get("a" * 64))
+
+        filePath = self.sd.makeFilePath("out.txt")
+        with open(filePath, "wb") as f:
+            f.write(b"file")
+        self.assertTrue(cache.putFiles("a" * 64, 1, [filePath]))
+        self.assertTrue(cache.putBuffers("b" * 64, 2, [("x.txt", b"x"), ("y.txt", b"yy")]))
+
+        count, filePaths = cache.get("b" * 64)
+        self.assertEqual(count, 2)
+        self.assertEqual([path.basename(filePath) for filePath in filePaths], ["x.txt", "y.txt"])
+        with open(filePaths[1], "rb") as f:
+            self.assertEqual(f.read(), b"yy")
+
+        # A new cache object finds the entries on disk.
+        cache = StepCache(self.sd.makeFilePath("cache"), 1000)
+        self.assertEqual(cache.getSize(), 7)
+        count, filePaths = cache.get("a" * 64)
+        self.assertEqual(count, 1)
+
+        # Damaged entries are dropped.
+        os.remove(filePaths[0])
+        self.assertIsNone(cache.get("a" * 64))
+        self.assertEqual(cache.getSize(), 3)
+
+    def test_evict(self):
+        cache = StepCache(self.sd.makeSubDir("cache"), 250)
+        keys = [str(i) * 64 for i in range(4)]
+        for key in keys[:2]:
+            self.assertTrue(cache.putBuffers(key, 1, [("f.bin", b"x" * 100)]))
+
+        # Using the first entry makes the second one the least recently used.
+        os.utime(self.sd.makeFilePath(path.join("cache", keys[1], "step.json")), (1, 1))
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertTrue(cache.putBuffers(keys[2], 1, [("f.bin", b"x" * 100)]))
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertIsNotNone(cache.get(keys[2]))
+        self.assertLessEqual(cache.getSize(), 250)
+
+        # Outputs bigger than the budget are not cached.
+        self.assertFalse(cache.putBuffers(keys[3], 1, [("f.bin", b"x" * 300)]))
+        self.assertIsNone(cache.get(keys[3]))
+
+if __name__ == '__main__':
+    unittest.main()